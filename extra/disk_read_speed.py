@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import os, ctypes, ctypes.util, io, mmap, pathlib
 from tinygrad import Tensor, dtypes, Device
-from tinygrad.helpers import Timing, from_mv
+from tinygrad.helpers import Timing, from_mv, getenv
+from tinygrad.nn.state import safe_load, load_bulk
 libc = ctypes.CDLL(ctypes.util.find_library("c"))
 
 #from extra.hip_gpu_driver import hip_ioctl
@@ -75,10 +76,26 @@ def read_to_gpu_pingpong(fd, sz, gpubuf):
 MAP_LOCKED = 0x2000
 MAP_HUGETLB = 0x40000
 
+def load_state_dict_speed(fns:list[str]):
+  # drop the page cache between the runs to measure the disk
+  sz = sum(os.stat(fn).st_size for fn in fns)
+  with Timing("serial load: ", lambda x: f", {sz/x:.2f} GB/s"):
+    for fn in fns:
+      for v in safe_load(fn).values(): v.to(Device.DEFAULT).realize()
+    dev.synchronize()
+  with Timing("bulk load:   ", lambda x: f", {sz/x:.2f} GB/s"):
+    load_bulk({f"{i}.{k}":v for i,fn in enumerate(fns) for k,v in safe_load(fn).items()}, depth=getenv("DEPTH", 64), seg_len=getenv("SEG", 1<<22))
+    dev.synchronize()
+
 if __name__ == "__main__":
   dev = Device[Device.DEFAULT]
 
   warm = (Tensor.ones(1024, device=Device.DEFAULT).contiguous() + Tensor.ones(1024, device=Device.DEFAULT).contiguous()).realize()
+  # FN=model-00001-of-00002.safetensors,model-00002-of-00002.safetensors python3 extra/disk_read_speed.py
+  if (fns:=getenv("FN", "")):
+    load_state_dict_speed(fns.split(","))
+    exit(0)
+
   #fn = "/home/tiny/tinygrad/weights/rng"
   fn = pathlib.Path(__file__).parents[1] / "weights/LLaMA-2/70B/consolidated.00.pth"
   sz = os.stat(fn).st_size
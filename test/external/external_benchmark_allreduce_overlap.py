@@ -0,0 +1,62 @@
+import time, itertools
+from collections import defaultdict
+from tinygrad import Tensor, nn
+from tinygrad.device import Buffer
+from tinygrad.helpers import getenv, Context
+from tinygrad.uop.ops import Ops
+from tinygrad.engine.schedule import ScheduleItem
+from tinygrad.engine.realize import lower_schedule_item
+
+# python3 test/external/external_benchmark_allreduce_overlap.py
+# the data parallel backward of an MLP on CPU virtual devices, in BFS order (EARLY_COPY=0), with the copies first (EARLY_COPY=1) and with the
+# gradients in buckets (ALLREDUCE_BUCKET). the CPU devices run everything in series, so every item is timed on its own and the schedule is
+# replayed with a compute and a copy queue per device: an item starts when its queue is done with the items before it and its inputs are written.
+# with unlimited queues the replay is the critical path of the dependencies, the order of the schedule doesn't change that one.
+# a copy between CPU devices is a memcpy, LINK=x replays the copies x times slower for a link that is slower than the memory
+
+def replay(sched:list[ScheduleItem], tms:list[float], queues=True) -> float:
+  written: dict[Buffer, float] = {}
+  read: defaultdict[Buffer, float] = defaultdict(float)
+  free: defaultdict[tuple[str, bool], float] = defaultdict(float)
+  for si,tm in zip(sched, tms):
+    nout = len(si.ast.src) if si.ast.op is Ops.SINK else 1
+    outs, ins = [b.base for b in si.bufs[:nout]], [b.base for b in si.bufs[nout:]]
+    st = max([written.get(b, 0.0) for b in outs+ins] + [read[b] for b in outs])
+    if queues: st = max(st, free[q:=(si.bufs[0].device, si.ast.op is Ops.COPY)])
+    end = st + tm
+    if queues: free[q] = end
+    for b in outs: written[b] = end
+    for b in ins: read[b] = max(read[b], end)
+  return max(written.values())
+
+def step(layers:list[nn.Linear], x:Tensor) -> list[Tensor]:
+  h = x
+  for l in layers: h = l(h).relu()
+  return h.sum().gradient(*[p for l in layers for p in (l.weight, l.bias)])
+
+if __name__ == "__main__":
+  N, LAYERS, BS, DEVS, BUCKET, CNT = getenv("N", 512), getenv("LAYERS", 8), getenv("BS", 256), getenv("DEVS", 4), getenv("BUCKET", 1<<21), 5
+  LINK = getenv("LINK", 1.0)
+  devs = tuple(f"CPU:{i}" for i in range(DEVS))
+  layers = [nn.Linear(N, N) for _ in range(LAYERS)]
+  for l in layers:
+    for p in (l.weight, l.bias): p.shard_(devs).realize()
+  x = Tensor.rand(BS, N).shard(devs, axis=0).realize()
+  # the same kernel on the same devices is timed once, so the orders of one graph are replayed with the same times
+  tms: dict[tuple, float] = {}
+  for bucket, early_copy in itertools.product([0, BUCKET], [0, 1]):
+    with Context(EARLY_COPY=early_copy, ALLREDUCE_BUCKET=bucket): sched = Tensor.schedule(*step(layers, x))
+    keys = [(si.ast, tuple(b.device for b in si.bufs)) for si in sched]
+    for si,k in zip(sched, keys):
+      if k in tms: continue
+      ei, tms[k] = lower_schedule_item(si), float("inf")
+      for _ in range(CNT):
+        st = time.perf_counter()
+        ei.run(wait=True, do_update_stats=False)
+        tms[k] = min(tms[k], (time.perf_counter() - st) * (LINK if si.ast.op is Ops.COPY else 1))
+    copies, sched_tms = [i for i,si in enumerate(sched) if si.ast.op is Ops.COPY], [tms[k] for k in keys]
+    busy: defaultdict[tuple[str, bool], float] = defaultdict(float)
+    for si,tm in zip(sched, sched_tms): busy[(si.bufs[0].device, si.ast.op is Ops.COPY)] += tm
+    print(f"EARLY_COPY={early_copy} ALLREDUCE_BUCKET={bucket:8d}: {len(sched)-len(copies):4d} kernels {len(copies):4d} copies, first copy at "
+          f"{copies[0]:4d}  serial {sum(sched_tms)*1e3:8.2f} ms  queues {replay(sched, sched_tms)*1e3:8.2f} ms  critical path "
+          f"{replay(sched, sched_tms, queues=False)*1e3:8.2f} ms  busiest queue {max(busy.values())*1e3:8.2f} ms")
@@ -0,0 +1,52 @@
+import os, tempfile, time
+# a fresh diskcache, so the searches aren't cached and the trained models don't replace the real one
+os.environ["CACHEDB"] = os.path.join(tempfile.mkdtemp(), "cache.db")
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, diskcache_items
+from tinygrad.opt import search
+from tinygrad.opt.kernel import Kernel
+from tinygrad.opt.search import beam_search, bufs_from_lin
+from tinygrad.opt.costmodel import CostModel
+from extra.optimization.helpers import time_linearizer
+
+# CPU=1 python3 test/external/external_benchmark_beam_costmodel.py
+# exhaustive BEAM vs BEAM with the cost model keeping the TOPK best predicted candidates, the model of each kernel is trained on the others
+
+def kernels() -> list[Kernel]:
+  a, b, x, w = Tensor.empty(64, 64), Tensor.empty(64, 64), Tensor.empty(1, 8, 16, 16), Tensor.empty(8, 8, 3, 3)
+  outs = [a @ b, (a @ b.T).relu(), x.conv2d(w), a.sum(1), a.max(0), (a * b).sum(), a.softmax(1), (a + b).exp2(), a.T.contiguous(), x.mean((2, 3))]
+  return [Kernel(si.ast, opts=Device[Device.DEFAULT].renderer) for out in outs for si in out.schedule() if si.ast.op.name == "SINK"]
+
+def spearman(x:list[float], y:list[float]) -> float:
+  def rank(v): return {i:r for r,i in enumerate(sorted(range(len(v)), key=lambda i: v[i]))}
+  rx, ry, n = rank(x), rank(y), len(x)
+  return 1 - 6*sum((rx[i]-ry[i])**2 for i in range(n)) / (n*(n*n-1)) if n > 1 else 1.0
+
+if __name__ == "__main__":
+  AMT, TOPK, dev = getenv("BEAM", 2), getenv("TOPK", 8), Device.DEFAULT
+  ks = kernels()
+  full = []
+  for k in ks:
+    st = time.perf_counter()
+    kb = beam_search(k.copy(), bufs:=bufs_from_lin(k), AMT, disable_cache=True)
+    full.append((kb, time.perf_counter() - st, bufs))
+  samples = {key["ast"]: v for key,v in diskcache_items("beam_samples") if key["device"] == dev}
+
+  search.BEAM_TOPK = TOPK
+  tot_full = tot_pruned = tm_full = tm_pruned = 0.0
+  for k,(kb,search_tm,bufs) in zip(ks, full):
+    model = CostModel.train([v for key,v in samples.items() if key != k.ast.key])
+    model.save(dev)
+    held = samples[k.ast.key]
+    rho = spearman([model.predict(f) for f,_ in held], [tm for _,tm in held])
+    best = min(range(len(held)), key=lambda i: held[i][1])
+    top = sorted(range(len(held)), key=lambda i: model.predict(held[i][0]))[:TOPK]
+    st = time.perf_counter()
+    kp = beam_search(k.copy(), bufs, AMT, disable_cache=True)
+    pruned_tm = time.perf_counter() - st
+    t_full, t_pruned = time_linearizer(kb, bufs, allow_test_size=False, cnt=10, disable_cache=True), \
+                       time_linearizer(kp, bufs, allow_test_size=False, cnt=10, disable_cache=True)
+    tot_full, tot_pruned, tm_full, tm_pruned = tot_full+search_tm, tot_pruned+pruned_tm, tm_full+t_full, tm_pruned+t_pruned
+    print(f"{k.name:24s} {len(held):4d} timed  spearman {rho:5.2f}  best in top{TOPK} {str(best in top):5s}  "
+          f"search {search_tm:6.2f}s -> {pruned_tm:6.2f}s  kernel {t_full*1e6:8.2f}us -> {t_pruned*1e6:8.2f}us")
+  print(f"total search {tot_full:.2f}s -> {tot_pruned:.2f}s ({tot_full/tot_pruned:.2f}x), kernel time {tm_full*1e6:.2f}us -> {tm_pruned*1e6:.2f}us")
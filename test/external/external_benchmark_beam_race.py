@@ -0,0 +1,43 @@
+import time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, Context
+from tinygrad.opt import search
+from tinygrad.opt.kernel import Kernel
+from tinygrad.opt.search import beam_search, bufs_from_lin
+from extra.optimization.helpers import time_linearizer
+
+# CPU=1 python3 test/external/external_benchmark_beam_race.py
+# BEAM with 3 runs of every candidate (BEAM_RACE=0) vs successive halving, the search time, the time spent in timing runs and the time of the
+# kernels it picks. a search that finds a faster kernel can take more steps, so the search time includes more compiles
+
+def kernels() -> list[Kernel]:
+  a, b, x, w = Tensor.empty(64, 64), Tensor.empty(64, 64), Tensor.empty(1, 8, 16, 16), Tensor.empty(8, 8, 3, 3)
+  outs = [a @ b, (a @ b.T).relu(), x.conv2d(w), a.sum(1), a.max(0), (a * b).sum(), a.softmax(1), (a + b).exp2(), a.T.contiguous(), x.mean((2, 3))]
+  return [Kernel(si.ast, opts=Device[Device.DEFAULT].renderer) for out in outs for si in out.schedule() if si.ast.op.name == "SINK"]
+
+if __name__ == "__main__":
+  AMT, RACE = getenv("BEAM", 2), getenv("RACE", 4)
+  tot = {0: [0.0, 0.0, 0.0, 0], RACE: [0.0, 0.0, 0.0, 0]}
+  for k in kernels():
+    bufs, res = bufs_from_lin(k), {}
+    for race in tot:
+      runs, run_tm = 0, 0.0
+      def counted(*args, **kwargs):
+        global runs, run_tm
+        st = time.perf_counter()
+        runs += len(ret:=run_program(*args, **kwargs))
+        run_tm += time.perf_counter() - st
+        return ret
+      run_program, search._run_program = search._run_program, counted
+      st = time.perf_counter()
+      with Context(BEAM_RACE=race): kb = beam_search(k.copy(), bufs, AMT, disable_cache=True)
+      search_tm = time.perf_counter() - st
+      search._run_program = run_program
+      res[race] = (search_tm, time_linearizer(kb, bufs, allow_test_size=False, cnt=10, disable_cache=True), run_tm, runs)
+      tot[race] = [a+b for a,b in zip(tot[race], res[race])]
+    print(f"{k.name:24s} search {res[0][0]:6.2f}s -> {res[RACE][0]:6.2f}s  {res[0][3]:4d} runs {res[0][2]*1e3:7.2f}ms -> "
+          f"{res[RACE][3]:4d} runs {res[RACE][2]*1e3:7.2f}ms  "
+          f"kernel {res[0][1]*1e6:8.2f}us -> {res[RACE][1]*1e6:8.2f}us")
+  print(f"total search {tot[0][0]:.2f}s -> {tot[RACE][0]:.2f}s, timing {tot[0][3]} runs {tot[0][2]*1e3:.2f}ms -> {tot[RACE][3]} runs "
+        f"{tot[RACE][2]*1e3:.2f}ms ({tot[0][2]/tot[RACE][2]:.2f}x), "
+        f"kernel time {tot[0][1]*1e6:.2f}us -> {tot[RACE][1]*1e6:.2f}us")
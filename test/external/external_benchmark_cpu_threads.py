@@ -0,0 +1,29 @@
+import os, time
+from tinygrad import Tensor, Device, Context
+from tinygrad.helpers import getenv
+
+# CPU=1 python3 test/external/external_benchmark_cpu_threads.py
+
+def bench(fxn, threads, cnt=getenv("CNT", 5)):
+  with Context(CPU_THREADS=threads):
+    tms = []
+    for _ in range(cnt):
+      out = fxn()
+      st = time.perf_counter()
+      out.realize()
+      Device[out.device].synchronize()
+      tms.append(time.perf_counter() - st)
+  return min(tms)
+
+if __name__ == "__main__":
+  N = getenv("N", 2048)
+  a, b = Tensor.rand(N, N).realize(), Tensor.rand(N, N).realize()
+  max_threads = getenv("MAX_THREADS", os.cpu_count() or 1)
+  threads = [t for t in [1, 2, 4, 8, 16, 32, 64, 128] if t <= max_threads]
+  for name, fxn, flops in [("elementwise", lambda: (a * b + 1).exp(), N*N*3), ("gemm", lambda: a @ b, 2*N*N*N)]:
+    bench(fxn, 1)  # warmup and compile
+    base = None
+    for t in threads:
+      tm = bench(fxn, t)
+      base = base or tm
+      print(f"{name:12s} threads {t:4d}: {tm*1e3:9.2f} ms {flops/tm*1e-9:9.2f} GFLOPS {base/tm:6.2f}x")
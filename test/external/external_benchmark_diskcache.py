@@ -0,0 +1,46 @@
+import os, tempfile, time
+from extra.models.resnet import ResNet50
+from tinygrad import Tensor, Device, nn
+from tinygrad.helpers import getenv, Context, Timing
+from tinygrad.uop.ops import Ops
+from tinygrad.engine.realize import get_program
+import tinygrad.helpers as helpers
+
+# cold compile of a ResNet-sized schedule, with every put committed on its own vs written behind in batches
+# CPU=1 python3 test/external/external_benchmark_diskcache.py
+
+def fresh_db(sync:int):
+  helpers.diskcache_flush()
+  helpers.CACHEDB, helpers.DISKCACHE_SYNC = os.path.join(tempfile.mkdtemp(), "cache.db"), sync
+  helpers._db_connection = None
+  helpers._db_tables.clear()
+  helpers._db_lru.clear()
+  helpers._db_lru_bytes = 0
+
+if __name__ == "__main__":
+  mdl = ResNet50()
+  for p in nn.state.get_parameters(mdl): p.replace(Tensor.empty(p.shape))
+  sched = mdl(Tensor.empty(getenv("BS", 64), 3, 224, 224)).schedule()
+  asts = list({x.ast.key:x.ast for x in sched if x.ast.op is Ops.SINK}.values())
+  dev = Device[Device.DEFAULT]
+  with Timing(f"render {len(asts)} kernels "), Context(CACHELEVEL=0):
+    srcs = [get_program(ast, dev.renderer).src for ast in asts]
+
+  libs = None
+  for sync in [1, 0]:
+    fresh_db(sync)
+    st = time.perf_counter()
+    libs = [dev.compiler.compile_cached(src) for src in srcs]
+    helpers.diskcache_flush()
+    print(f"DISKCACHE_SYNC={sync} cold compile_cached {len(srcs)} kernels: {(time.perf_counter()-st)*1e3:9.2f} ms")
+
+  # the cache alone, without the compiler
+  for sync in [1, 0]:
+    fresh_db(sync)
+    st = time.perf_counter()
+    for i,lib in enumerate(libs or []): helpers.diskcache_put("bench_diskcache", str(i), lib)
+    helpers.diskcache_flush()
+    tput = time.perf_counter()-st
+    st = time.perf_counter()
+    for i in range(len(libs or [])): helpers.diskcache_get("bench_diskcache", str(i))
+    print(f"DISKCACHE_SYNC={sync} put {tput*1e3:9.2f} ms  get {(time.perf_counter()-st)*1e3:9.2f} ms")
@@ -0,0 +1,32 @@
+import os, tempfile, time
+# a fresh diskcache, so the joint search isn't cached
+os.environ["CACHEDB"] = os.path.join(tempfile.mkdtemp(), "cache.db")
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, Context
+from tinygrad.engine.realize import run_schedule
+
+# CPU=1 python3 test/external/external_benchmark_joint_beam.py
+# the time of a schedule of kernels that share buffers with the opts picked per kernel, and with JOINT_BEAM
+
+def model(x:Tensor, ws:list[Tensor]) -> Tensor:
+  for w in ws: x = (x @ w).relu().contiguous()
+  return x.softmax(1)
+
+if __name__ == "__main__":
+  N, LAYERS, CNT, AMT = getenv("N", 128), getenv("LAYERS", 4), getenv("CNT", 20), getenv("JOINT", 4)
+  x, ws = Tensor.rand(N, N).realize(), [Tensor.rand(N, N).realize() for _ in range(LAYERS)]
+  for joint in [0, AMT]:
+    with Context(JOINT_BEAM=joint):
+      st = time.perf_counter()
+      model(x, ws).realize()
+      search_tm = time.perf_counter() - st
+      tms, kernels = [], len(model(x, ws).schedule())
+      for _ in range(CNT):
+        sched = model(x, ws).schedule()
+        Device[Device.DEFAULT].synchronize()
+        st = time.perf_counter()
+        run_schedule(sched)
+        Device[Device.DEFAULT].synchronize()
+        tms.append(time.perf_counter() - st)
+    print(f"JOINT_BEAM={joint}: {kernels} kernels, first run {search_tm:7.2f}s, "
+          f"schedule {min(tms)*1e6:9.2f}us min {sorted(tms)[len(tms)//2]*1e6:9.2f}us median")
@@ -1,5 +1,8 @@
 from tinygrad import Tensor, Device, GlobalCounters, TinyJit, dtypes
 from tinygrad.helpers import getenv, Context, RING, DEBUG
+from tinygrad.uop.ops import Ops
+
+ALGOS = {0: "naive", 2: "ring", 3: "halving_doubling", 4: "hierarchical", 5: "cost_model"}
 
 def test(devs: list[str], N: int, iters:int = 10):
   @TinyJit
@@ -17,7 +20,7 @@ def test(devs: list[str], N: int, iters:int = 10):
     i_secs = GlobalCounters.time_sum_s
     i_gflops = GlobalCounters.global_ops/i_secs/10**9
     i_gbs = (N*4)/i_secs/10**9
-    print(f"{'ring_allreduce' if RING >= 2 else 'naive_allreduce'} iter {i+1}/{iters}: {i_secs:.6f} sec {i_gflops:.2f} GFLOP/s {i_gbs:.2f} GB/s")
+    print(f"{ALGOS.get(RING.value, 'threshold')}_allreduce iter {i+1}/{iters}: {i_secs:.6f} sec {i_gflops:.2f} GFLOP/s {i_gbs:.2f} GB/s")
     secs += i_secs
     gflops += i_gflops
     gbs += i_gbs
@@ -27,14 +30,28 @@ def test(devs: list[str], N: int, iters:int = 10):
 def run(sz, n_gpus=6, iters=10, use_ring=False):
   devs = tuple([f"{Device.DEFAULT}:{x}" for x in range(n_gpus)])
   N = sz // dtypes.float32.itemsize
-  with Context(RING=(2 if use_ring else 0), DEBUG=max(DEBUG.value, 2)): return test(devs, N, iters=iters)
+  # ALGO=3 compares halving-doubling, ALGO=4 hierarchical to the naive allreduce instead of the ring
+  with Context(RING=(getenv("ALGO", 2) if use_ring else 0), DEBUG=max(DEBUG.value, 2)): return test(devs, N, iters=iters)
+
+def count(devs:tuple[str, ...], N:int, ring:int) -> tuple[int, int]:
+  # kernels and copies in the schedule of the allreduce
+  with Context(RING=ring):
+    sched = Tensor.empty((len(devs), N)).shard(devs, 0).realize().sum(0).schedule()
+  return len([si for si in sched if si.ast.op is Ops.SINK]), len([si for si in sched if si.ast.op is Ops.COPY])
 
 def main():
   ONLY_RING = getenv("ONLY_RING", 0)
   n_gpus = getenv("GPUS", 6)
   iters = getenv("ITERS", 10)
 
-  if getenv("BENCHMARK_SPLIT"):
+  if getenv("COUNT"):
+    # CPU=1 COUNT=1 python3 test/external/external_benchmark_multitensor_allreduce.py
+    for n in [2, 3, 4, 6, 8]:
+      devs = tuple(f"{Device.DEFAULT}:{x}" for x in range(n))
+      for ring,name in ALGOS.items():
+        kernels, copies = count(devs, getenv("SZ", 1000) * 10**6 // dtypes.float32.itemsize, ring)
+        print(f"{n} devices {name:16s} {kernels:4d} kernels {copies:4d} copies")
+  elif getenv("BENCHMARK_SPLIT"):
     l, r = 0, 512
     while r - l > 1:
       m = (l + r) // 2
@@ -48,7 +65,7 @@ def main():
     print(f"Using {sz/10**9:.2f} GB of numbers on each of {n_gpus} GPUs, {n_gpus*sz/10**9:.2f} GB total.")
     (ring_gflops, ring_gbs, ring_secs) = run(sz, use_ring=True, n_gpus=n_gpus, iters=iters)
     if not ONLY_RING: (naive_gflops, naive_gbs, naive_secs) = run(sz, use_ring=False, n_gpus=n_gpus, iters=iters)
-    print(f"Ring:\n  {ring_secs:.6f} seconds/iter\n  {ring_gflops:.2f} GFLOP/s\n  {ring_gbs:.2f} GB/s")
+    print(f"{ALGOS[getenv('ALGO', 2)].capitalize()}:\n  {ring_secs:.6f} seconds/iter\n  {ring_gflops:.2f} GFLOP/s\n  {ring_gbs:.2f} GB/s")
     if not ONLY_RING: print(f"Naive:\n  {naive_secs:.6f} seconds/iter\n  {naive_gflops:.2f} GFLOP/s\n  {naive_gbs:.2f} GB/s")
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+import time
+from tinygrad import Tensor, Context
+from tinygrad.helpers import getenv
+from tinygrad.engine import realize
+from tinygrad.engine.realize import run_schedule
+
+# CPU=1 python3 test/external/external_benchmark_parallel_compile.py
+# time to first result of a cold schedule of N distinct kernels, serial vs COMPILE_WORKERS
+
+def cold(n:int, workers:int, salt:int) -> float:
+  # NOTE: salt makes the kernels miss the method cache of the previous run
+  outs = [(Tensor.arange(64)*(i+salt*n)).reshape(8, 8).sum(axis=i%2) for i in range(n)]
+  with Context(COMPILE_WORKERS=workers, COMPILE_WORKERS_MIN=2, DISABLE_COMPILER_CACHE=1):
+    sched, var_vals = Tensor.schedule_with_vars(*outs)
+    st = time.perf_counter()
+    run_schedule(sched, var_vals)
+    return time.perf_counter() - st
+
+if __name__ == "__main__":
+  N = getenv("N", 64)
+  for i,workers in enumerate([1, 2, 4, getenv("WORKERS", 8)]):
+    if realize.compile_pool is not None: realize.compile_pool.terminate()
+    realize.compile_pool = None
+    if workers > 1: cold(2, workers, 1000+i)  # start the pool
+    print(f"{N} kernels, {workers:2d} workers: {cold(N, workers, i)*1e3:9.2f} ms")
@@ -0,0 +1,26 @@
+import time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv
+from tinygrad.engine.realize import lower_schedule_item
+
+# PYTHON=1 python3 test/external/external_benchmark_python_numpy.py
+
+def bench(prg, ei, vectorized):
+  prg.vectorized = vectorized
+  st = time.perf_counter()
+  ei.run()
+  return time.perf_counter() - st
+
+if __name__ == "__main__":
+  assert Device.DEFAULT == "PYTHON", "run with PYTHON=1"
+  N = getenv("N", 256)
+  a, b = Tensor.rand(N, N).realize(), Tensor.rand(N, N).realize()
+  for name, out in [("elementwise", (a * b + 1).relu()), ("gemm", a @ b)]:
+    si = out.schedule()[-1]
+    ei = lower_schedule_item(si)
+    prg = ei.prg._prg
+    tv = bench(prg, ei, True)
+    ref = bytes(si.bufs[0].as_buffer())
+    ts = bench(prg, ei, False)
+    assert ref == bytes(si.bufs[0].as_buffer()), "numpy and scalar results differ"
+    print(f"{name:12s} N={N}: scalar {ts*1e3:10.2f} ms  numpy {tv*1e3:8.2f} ms  {ts/tv:8.1f}x")
@@ -0,0 +1,32 @@
+import os, sys, subprocess, time
+import numpy as np
+from tinygrad.helpers import getenv
+
+# REMOTEDEV=CPU python3 test/external/external_benchmark_remote.py
+# uploads the weights of an MLP to a local REMOTE server and runs inference, once with the streaming protocol and once with /batch
+
+def child():
+  from tinygrad import Tensor, Device
+  N, LAYERS, CNT = getenv("N", 1024), getenv("LAYERS", 16), getenv("CNT", 20)
+  ws = [np.random.rand(N, N).astype(np.float32) for _ in range(LAYERS)]
+  Tensor.ones(1).realize()  # start the server
+  st = time.perf_counter()
+  weights = [Tensor(w).realize() for w in ws]
+  Device[Device.DEFAULT].synchronize()
+  upload = time.perf_counter() - st
+  def run(x:Tensor) -> Tensor:
+    for w in weights: x = (x @ w).relu() / N
+    return x
+  run(Tensor.rand(1, N)).numpy()  # compile
+  st = time.perf_counter()
+  for _ in range(CNT): run(Tensor.rand(1, N)).numpy()
+  infer = time.perf_counter() - st
+  print(f"REMOTE_STREAM={getenv('REMOTE_STREAM', 1)}: upload {LAYERS*N*N*4/1e6:.0f} MB in {upload*1e3:8.2f} ms, "
+        f"{CNT} inferences in {infer*1e3:8.2f} ms, total {(upload+infer)*1e3:8.2f} ms")
+
+if __name__ == "__main__":
+  if getenv("CHILD"): child()
+  else:
+    for stream in [0, 1]:
+      subprocess.run([sys.executable, __file__], env={**os.environ, "CHILD": "1", "REMOTE": "1", "REMOTE_STREAM": str(stream),
+                                                      "REMOTEDEV": os.environ.get("REMOTEDEV", "CPU")}, check=True)
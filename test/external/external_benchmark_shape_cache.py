@@ -0,0 +1,29 @@
+import time, gc, os, resource
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv
+from tinygrad.shape.view import shape_cache_stats
+
+# NULL=1 python3 test/external/external_benchmark_shape_cache.py
+# schedules a graph with a new shape every step, the RSS should be flat once the shape caches are at their size (SHAPE_CACHE)
+
+def rss_mb() -> float:
+  try:
+    with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+  except FileNotFoundError: return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e6
+
+def step(i:int):
+  a, b = Tensor.empty(i+1, 24, device=Device.DEFAULT), Tensor.empty(24, 3, 8, device=Device.DEFAULT)
+  out = (a @ b.reshape(24, 24)).pad(((1, 2), (0, i%5))).permute(1, 0)
+  return (out.sum(1) + out.max(1) + out.flatten()[i%7:i%7+out.shape[0]]).schedule()
+
+if __name__ == "__main__":
+  STEPS, EVERY = getenv("STEPS", 4000), getenv("EVERY", 500)
+  st = time.perf_counter()
+  for i in range(STEPS):
+    step(i)
+    if (i+1) % EVERY == 0:
+      gc.collect()
+      tm, st = time.perf_counter() - st, time.perf_counter()
+      print(f"{i+1:6d} steps  rss {rss_mb():8.1f} MB  {tm/EVERY*1e3:6.2f} ms/step")
+  for name,(hits,misses,size,evicted) in shape_cache_stats().items():
+    print(f"{name:32s} {hits/max(hits+misses, 1)*100:5.1f}% hits  {size:6d} entries  {evicted:6d} evicted")
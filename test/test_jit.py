@@ -5,7 +5,7 @@ import numpy as np
 from hypothesis import given, settings, strategies as strat
 from test.helpers import assert_jit_cache_len, not_support_multi_device, REAL_DEV
 from tinygrad.tensor import Tensor
-from tinygrad.engine.jit import TinyJit
+from tinygrad.engine.jit import TinyJit, JitArena
 from tinygrad.device import Device
 from tinygrad.helpers import Context, JIT, GlobalCounters
 from tinygrad.dtype import dtypes
@@ -72,6 +72,57 @@ class TestJit(unittest.TestCase):
       np.testing.assert_allclose(e.numpy(), a.numpy()*b.numpy(), atol=1e-4, rtol=1e-5)
     assert_jit_cache_len(f, 3)
 
+  def test_jit_diskcache(self):
+    def f(a, b): return (a+b).realize(), (a*b).sum().realize()
+    jf = TinyJit(f, diskcache=True)
+    for _ in range(3): jf(Tensor.randn(10, 10), Tensor.randn(10, 10))
+    # a fresh jit of the same function replays from the first call
+    jf2 = TinyJit(f, diskcache=True)
+    a, b = Tensor.randn(10, 10), Tensor.randn(10, 10)
+    c, d = jf2(a, b)
+    self.assertEqual(jf2.cnt, 3)
+    np.testing.assert_allclose(c.numpy(), a.numpy()+b.numpy(), atol=1e-4, rtol=1e-5)
+    np.testing.assert_allclose(d.numpy(), (a.numpy()*b.numpy()).sum(), atol=1e-4, rtol=1e-5)
+    # a different input shape doesn't hit the cache
+    jf3 = TinyJit(f, diskcache=True)
+    jf3(Tensor.randn(10, 11), Tensor.randn(10, 11))
+    self.assertEqual(jf3.cnt, 1)
+
+  def test_jit_diskcache_weights(self):
+    w = Tensor.ones(10, 10).contiguous().realize()
+    def f(a): return (a @ w).realize()
+    jf = TinyJit(f, diskcache=True)
+    for _ in range(3): jf(Tensor.randn(10, 10))
+    # a new process has other weights, the loaded jit reads them and doesn't store its own
+    w = Tensor.full((10, 10), 2.0).contiguous().realize()
+    jf2 = TinyJit(f, diskcache=True)
+    a = Tensor.randn(10, 10)
+    c = jf2(a)
+    self.assertEqual(jf2.cnt, 3)
+    self.assertTrue(any(b is w.uop.buffer for ei in jf2.jit_cache for b in ei.bufs))
+    np.testing.assert_allclose(c.numpy(), a.numpy() @ w.numpy(), atol=1e-4, rtol=1e-5)
+
+  def test_jit_diskcache_closure(self):
+    def mul(k): return lambda a: (a*k).realize()
+    jf = TinyJit(mul(2), diskcache=True)
+    for _ in range(3): jf(Tensor.randn(10, 10))
+    # the same code with another value in its closure doesn't hit the cache
+    jf2 = TinyJit(mul(3), diskcache=True)
+    a = Tensor.randn(10, 10)
+    c = jf2(a)
+    self.assertEqual(jf2.cnt, 1)
+    np.testing.assert_allclose(c.numpy(), a.numpy()*3, atol=1e-4, rtol=1e-5)
+
+  def test_jit_diskcache_uncacheable(self):
+    # an object without a __dict__ can't be keyed, the jit isn't stored
+    ks = {2}
+    def f(a): return (a+len(ks)).realize()
+    jf = TinyJit(f, diskcache=True)
+    for _ in range(3): jf(Tensor.randn(10, 10))
+    jf2 = TinyJit(f, diskcache=True)
+    jf2(Tensor.randn(10, 10))
+    self.assertEqual(jf2.cnt, 1)
+
   def test_nothing_jitted(self):
     @TinyJit
     def add(a, b): return None
@@ -669,5 +720,37 @@ class TestJitFree(unittest.TestCase):
     out = fxn(Tensor([11,1,2,3,4]))
     self.assertEqual(out.item(), 13600)
 
+  def test_jit_arena(self):
+    if not hasattr(Device[Device.DEFAULT].allocator, '_offset'): raise unittest.SkipTest("no suballocation")
+    w = Tensor.rand(32, 32).realize()
+    def f(x): return ((x @ w).relu().contiguous() @ w).exp2().contiguous().sum(0)
+    def g(x): return ((x @ w + 1).contiguous() * 2).contiguous().max(0)
+    mem = []
+    for arena in [None, JitArena()]:
+      jf, jg = TinyJit(f, arena=arena), TinyJit(g, arena=arena)
+      base = GlobalCounters.mem_used
+      for _ in range(4):
+        x = Tensor.rand(8, 32).realize()
+        np.testing.assert_allclose(jf(x).numpy(), f(x).numpy(), rtol=1e-5)
+        np.testing.assert_allclose(jg(x).numpy(), g(x).numpy(), rtol=1e-5)
+      del x
+      mem.append(GlobalCounters.mem_used - base)
+      arenas = {b.base for j in (jf, jg) for ei in j.captured.jit_cache for b in ei.bufs if b is not None and b._base is not None}
+      self.assertEqual(len(arenas), 1 if arena is not None else 2)
+    self.assertLess(mem[1], mem[0])
+
+  def test_jit_arena_grows(self):
+    if not hasattr(Device[Device.DEFAULT].allocator, '_offset'): raise unittest.SkipTest("no suballocation")
+    arena = JitArena()
+    def f(x, n): return ((x + n).contiguous() * x).contiguous().sum()
+    small, big = TinyJit(functools.partial(f, n=1), arena=arena), TinyJit(functools.partial(f, n=2), arena=arena)
+    for i in range(3):
+      np.testing.assert_allclose(small(Tensor.full((4,), i).contiguous()).item(), 4*(i+1)*i)
+    for i in range(3):
+      np.testing.assert_allclose(big(Tensor.full((256,), i).contiguous()).item(), 256*(i+2)*i)
+    # the small jit was moved to the bigger arena
+    np.testing.assert_allclose(small(Tensor.full((4,), 3).contiguous()).item(), 48)
+    self.assertEqual(len({b.base for j in (small, big) for ei in j.captured.jit_cache for b in ei.bufs if b is not None and b._base is not None}), 1)
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,7 +1,7 @@
-import unittest
-from tinygrad import dtypes, Device
+import unittest, random
+from tinygrad import dtypes, Device, Tensor
 from tinygrad.device import Buffer
-from tinygrad.engine.memory import _internal_memory_planner
+from tinygrad.engine.memory import _internal_memory_planner, inplace_outputs, place_blocks
 
 global_map = {}
 def b(i, base=None, offset=0, pin=False, size=16):
@@ -120,5 +120,54 @@ class TestMemoryPlanner(unittest.TestCase):
     ]
     check_assign(bs)
 
+class TestInplace(unittest.TestCase):
+  def setUp(self):
+    global global_map
+    global_map = {}
+
+  def _inplace(self, out:Tensor):
+    si = [si for si in out.schedule() if si.ast.op.name == "SINK"][-1]
+    return {o:set(ins) for o,ins in inplace_outputs(si.ast, si.bufs).items()}, si.bufs
+
+  def test_elementwise(self):
+    a = Tensor.empty(16, 16)
+    ret, bufs = self._inplace(a.exp2() * Tensor.empty(16, 16))
+    self.assertEqual(ret, {bufs[0]: {bufs[1], bufs[2]}})
+
+  def test_not_inplace(self):
+    a = Tensor.empty(16, 16)
+    for out in [a.sum(1), a.permute(1, 0).contiguous(), a + a.flip(0), a.pad(((1, 0), (0, 0)))[:16] + 1]:
+      ret, bufs = self._inplace(out)
+      self.assertTrue(all(bufs[1] not in ins for ins in ret.values()), out)
+
+  def test_planner_inplace(self):
+    bs = [[b(1), b(0, pin=True)], [b(2), b(1)], [b(3), b(2)], [b(4), b(2), b(3)]]
+    inplace = [{}, {b(2): (b(1),)}, {b(3): (b(2),)}, {b(4): (b(3),)}]
+    assigned = _internal_memory_planner(bs, inplace=inplace)
+    def mem(x): return (assigned[x].base, assigned[x].offset)
+    # b(2) is still read at the last step, so b(3) can't take it
+    self.assertEqual(mem(b(2)), mem(b(1)))
+    self.assertNotEqual(mem(b(3)), mem(b(2)))
+    self.assertEqual(mem(b(4)), mem(b(3)))
+
+class TestPlaceBlocks(unittest.TestCase):
+  def test_compaction(self):
+    # TLSF puts the last block after the second, the 2 page hole the first leaves is too small
+    offsets, sz, peak = place_blocks([[1, 5, 0x2000], [3, 7, 0x2000], [6, 10, 0x3000]])
+    self.assertEqual((sz, peak), (0x5000, 0x5000))
+    self.assertEqual(offsets, [0, 0x3000, 0])
+
+  def test_random(self):
+    random.seed(0)
+    for _ in range(200):
+      blocks = [[st:=random.randint(0, 10), st+random.randint(1, 5), random.randint(1, 4)*0x1000] for _ in range(random.randint(1, 12))]
+      offsets, sz, peak = place_blocks(blocks)
+      self.assertGreaterEqual(sz, peak)
+      self.assertEqual(sz, max(off+b[2] for off,b in zip(offsets, blocks)))
+      for i,(st,en,bsz) in enumerate(blocks):
+        for j in range(i):
+          if st < blocks[j][1] and blocks[j][0] < en:
+            self.assertTrue(offsets[i]+bsz <= offsets[j] or offsets[j]+blocks[j][2] <= offsets[i])
+
 if __name__ == "__main__":
   unittest.main()
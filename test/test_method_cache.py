@@ -1,5 +1,8 @@
-import unittest
+import unittest, os, subprocess, sys, tempfile, pathlib
 from tinygrad import Tensor, Device, Variable
+from tinygrad.helpers import Context, getenv
+from tinygrad.engine import realize
+from tinygrad.engine.realize import method_cache, method_cache_keys, run_schedule
 from examples.gpt2 import Transformer
 from tinygrad.nn.state import get_state_dict
 
@@ -30,6 +33,30 @@ class TestMethodCache(unittest.TestCase):
     Device[Device.DEFAULT].compiler = None
     ((c+d)+(a+b)).realize()
 
+  @unittest.skipIf(getenv("VIZ"), "no parallel compile with VIZ")
+  def test_parallel_compile(self):
+    # NOTE: the NOOPT context keeps these kernels out of the method cache of the other tests
+    outs = [(Tensor.arange(16)+i).sum() for i in range(4)]
+    with Context(NOOPT=1, COMPILE_WORKERS=2, COMPILE_WORKERS_MIN=2):
+      sched, var_vals = Tensor.schedule_with_vars(*outs)
+      asts = [si.ast for si in sched]
+      run_schedule(sched, var_vals)
+      for ast in asts: self.assertIn(method_cache_keys(Device.DEFAULT, ast)[0], method_cache)
+    self.assertEqual([o.item() for o in outs], [120+16*i for i in range(4)])
+    self.assertIsNotNone(realize.compile_pool)
+
+  @unittest.skipUnless(sys.platform == "linux", "the compile workers are only forked on linux")
+  def test_unguarded_script(self):
+    # the forked compile workers don't run a script without an if __name__ == "__main__" guard again
+    with tempfile.TemporaryDirectory() as d:
+      with open(script:=os.path.join(d, "unguarded.py"), "w") as f:
+        f.write("from tinygrad import Tensor\nfrom tinygrad.engine import realize\nwith __import__('tinygrad').Context(NOOPT=1):\n"
+                "  print(Tensor.stack(*[(Tensor.arange(32)+i).sum() for i in range(20)]).tolist())\nprint(realize.compile_pool is not None)\n")
+      env = {**os.environ, "COMPILE_WORKERS":"2", "COMPILE_WORKERS_MIN":"2", "PYTHONPATH":str(pathlib.Path(__file__).parents[1])}
+      p = subprocess.run([sys.executable, script], capture_output=True, env=env, timeout=120)
+    self.assertEqual(p.returncode, 0, p.stderr.decode())
+    self.assertEqual(p.stdout.decode().splitlines(), [str([496+32*i for i in range(20)]), "True"])
+
   @unittest.skip("incorrect use of transformer")
   def test_small_transformer(self):
     args_tiny = {"dim": 16, "n_heads": 8, "n_layers": 8, "norm_eps": 1e-05, "vocab_size": 10}
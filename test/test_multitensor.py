@@ -248,13 +248,15 @@ class TestMultiTensor(unittest.TestCase):
         t = Tensor.rand(shape).shard_(tuple([d0, d1, d2, d3][:n]), 0)
         with Context(RING=0):
           a = Tensor(UOp.allreduce(t.uop, Ops.ADD, t.device))
-        with Context(RING=2):
-          b = Tensor(UOp.allreduce(t.uop, Ops.ADD, t.device))
-        diff = a - b
-        mean_err = diff.reshape((prod(diff.shape),)).abs().mean().numpy()
-        max_err = diff.reshape((prod(diff.shape),)).abs().max().numpy()
-        assert mean_err < 1e-6, f"big mean error, iteration {it}_{n}"
-        assert max_err < 1e-6, f"big max error, iteration {it}_{n}"
+        # ring, halving-doubling and hierarchical
+        for ring in [2, 3, 4]:
+          with Context(RING=ring):
+            b = Tensor(UOp.allreduce(t.uop, Ops.ADD, t.device))
+          diff = a - b
+          mean_err = diff.reshape((prod(diff.shape),)).abs().mean().numpy()
+          max_err = diff.reshape((prod(diff.shape),)).abs().max().numpy()
+          assert mean_err < 1e-6, f"big mean error, iteration {it}_{n} RING={ring}"
+          assert max_err < 1e-6, f"big max error, iteration {it}_{n} RING={ring}"
 
   def _test_matmul_shard_axis(self, shard_x, shard_w, device):
     X = Tensor.kaiming_uniform(N, N).realize()
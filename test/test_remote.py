@@ -1,9 +1,11 @@
-import numpy as np, unittest, string
+import numpy as np, unittest, unittest.mock, string, asyncio, threading, os, zlib
 from hypothesis import given, strategies as st
 from tinygrad import Device, Tensor, TinyJit, dtypes
-from tinygrad.runtime.ops_remote import RemoteDevice, parse_hosts
+from tinygrad.runtime.ops_remote import RemoteDevice, RemoteConnection, RemoteHandler, BatchRequest, SessionKey, BufferAlloc, CopyIn, CopyOut
+from tinygrad.runtime.ops_remote import SessionFree, parse_hosts, frame_hdr, chunk_hdr, FRAME_BLOB, FRAME_REQS, FRAME_ZBLOB, MAX_BLOB, BlobCache
+from tinygrad.device import BufferSpec
 from tinygrad.runtime.graph.remote import RemoteGraph
-from tinygrad.helpers import LazySeq, all_same, Context
+from tinygrad.helpers import LazySeq, all_same, Context, getenv
 
 def multihost_env(devices):
   def same_hosts(devices): return all_same([h for h,_ in devices])
@@ -62,6 +64,100 @@ class TestRemoteMultiHost(unittest.TestCase):
     # or more here.
     self.assertLess(len(do.captured._jit_cache[0].prg.template), 28, "Very bad scheduling! Many unnecesary graph breaks!")
 
+@unittest.skipUnless(getenv("REMOTE_STREAM", 1), "needs the streaming protocol")
+class TestRemoteStream(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(RemoteHandler("CPU"), host="127.0.0.1", port=0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    cls.host = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+  def setUp(self):
+    self.conn, self.session = RemoteConnection(self.host), SessionKey(self.host, 0, self._testMethodName)
+    self.conn.chunk_size, self.conn.compress = 64, False
+  def tearDown(self): self.conn.q(SessionFree(session=self.session), wait=True)
+
+  def test_frames(self):
+    req = BatchRequest()
+    req.q(BufferAlloc(0, 1000, BufferSpec()))
+    req.q(CopyIn(0, req.h(bytes(1000))))
+    dat, kinds = b''.join(req.frames(reply=False, chunk_size=64)), []
+    while dat:
+      kinds.append((hdr:=frame_hdr.unpack(dat[:frame_hdr.size]))[0])
+      dat = dat[frame_hdr.size+hdr[1]:]
+    # the alloc is sent before the blob, the copyin after it
+    self.assertEqual(kinds, [FRAME_REQS] + [FRAME_BLOB]*16 + [FRAME_REQS])
+
+  def test_chunked_copyin(self):
+    data = bytes(range(256))*4 + b"tail"
+    self.conn.q(BufferAlloc(0, len(data), BufferSpec(), session=self.session))
+    self.conn.q(CopyIn(0, self.conn.req.h(data), session=self.session))
+    self.assertEqual(bytes(self.conn.q(CopyOut(0, session=self.session), wait=True)), data)
+
+  def test_batches_in_flight(self):
+    datas = [bytes([i])*(100*i+1) for i in range(8)]
+    for i,data in enumerate(datas):
+      self.conn.q(BufferAlloc(i, len(data), BufferSpec(), session=self.session))
+      self.conn.q(CopyIn(i, self.conn.req.h(data), session=self.session))
+      self.conn.flush()
+    for i,data in enumerate(datas): self.assertEqual(bytes(self.conn.q(CopyOut(i, session=self.session), wait=True)), data)
+
+  def _upload(self, session:SessionKey, data:bytes, buffer_num:int=0) -> int:
+    sent = self.conn.sent_bytes
+    self.conn.q(BufferAlloc(buffer_num, len(data), BufferSpec(), session=session))
+    self.conn.q(CopyIn(buffer_num, self.conn.req.h(data), session=session))
+    self.assertEqual(bytes(self.conn.q(CopyOut(buffer_num, session=session), wait=True)), data)
+    self.conn.send_q.join()
+    return self.conn.sent_bytes - sent
+
+  def test_dedup(self):
+    data, other = os.urandom(1<<18), SessionKey(self.host, 0, "other")
+    self.assertGreater(self._upload(self.session, data), len(data))
+    # the server has the blob from the other session, only the requests are sent
+    self.assertLess(self._upload(other, data), 1024)
+    self.conn.q(SessionFree(session=other), wait=True)
+
+  def test_dedup_connections(self):
+    data, conn = os.urandom(1<<18), RemoteConnection(self.host)
+    conn.q(BufferAlloc(0, len(data), BufferSpec(), session=self.session))
+    conn.q(CopyIn(0, conn.req.h(data), session=self.session))
+    conn.q(CopyOut(0, session=self.session), wait=True)
+    # the server has the blob from the other connection
+    self.assertLess(self._upload(self.session, data, 1), 1024)
+
+  def test_dedup_wrong_hash(self):
+    data, conn = os.urandom(1<<18), RemoteConnection(self.host)
+    conn.q(BufferAlloc(0, len(data), BufferSpec(), session=self.session))
+    conn.req._h[datahash:=conn.req.h(data)] = os.urandom(len(data))
+    conn.q(CopyIn(0, datahash, session=self.session))
+    conn.q(CopyOut(0, session=self.session), wait=True)
+    # the blob sent under the hash of data isn't kept, data is sent again
+    self.assertGreater(self._upload(self.session, data, 1), len(data))
+
+  def test_dedup_evicted(self):
+    a, b = os.urandom(1<<17), os.urandom(1<<17)
+    with unittest.mock.patch.object(BlobCache, "size", 1<<17):
+      self._upload(self.session, a)
+      # the server has a when it's asked, b evicts it before the copyin that uses it
+      self.conn.q(BufferAlloc(1, len(b), BufferSpec(), session=self.session))
+      self.conn.q(CopyIn(1, self.conn.req.h(b), session=self.session))
+      self.conn.q(CopyIn(0, self.conn.req.h(a), session=self.session))
+      self.assertEqual(bytes(self.conn.q(CopyOut(0, session=self.session), wait=True)), a)
+
+  def test_oversized_chunks(self):
+    # a blob over the limit, a compressed chunk that inflates past its blob and a chunk past its blob close the stream
+    for kind,total,dat in [(FRAME_BLOB, MAX_BLOB+1, b"x"), (FRAME_ZBLOB, 16, zlib.compress(bytes(1<<20))), (FRAME_BLOB, 16, bytes(32))]:
+      sock = RemoteConnection._connect_stream(self.host)
+      sock.sendall(frame_hdr.pack(kind, chunk_hdr.size+len(dat)) + chunk_hdr.pack(bytes(16), total, 0) + dat)
+      self.assertEqual(sock.recv(1), b"")
+      sock.close()
+
+  def test_compress(self):
+    self.conn.chunk_size, self.conn.compress = 1<<14, True
+    self.assertLess(self._upload(self.session, bytes(1<<16) + os.urandom(16)), 4096)
+    self.assertGreater(self._upload(self.session, data:=os.urandom(1<<16), 1), len(data))
+
 class TestParseHosts(unittest.TestCase):
   def assert_seq(self, result:LazySeq, host:str):
     self.assertIsInstance(result, LazySeq)
@@ -2,14 +2,14 @@
 # schedule confirms the right things are capable of fusing
 # NOTE: this has overlap with external_test_opt.py
 
-import unittest
+import unittest, unittest.mock, threading
 import numpy as np
 import functools
 from typing import List, Optional, Union, cast
 from hypothesis import assume, given, strategies as strat
 
 from tinygrad import nn, dtypes, Device, Tensor
-from tinygrad.device import is_dtype_supported
+from tinygrad.device import is_dtype_supported, Buffer
 from tinygrad.dtype import DType, ImageDType
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.uop.ops import PatternMatcher, UOp, Ops, GroupOp, UPat, graph_rewrite, track_rewrites
@@ -17,7 +17,7 @@ from tinygrad.uop.symbolic import symbolic_simple
 from tinygrad.helpers import CI, DEBUG, FUSE_ARANGE, SPLIT_REDUCEOP, GlobalCounters, Context, getenv, all_same, temp
 from tinygrad.kernelize.kernelize import merge_views, get_kernelize_map, Kernel
 from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars
-from tinygrad.engine.realize import CompiledRunner, run_schedule, lower_schedule
+from tinygrad.engine.realize import CompiledRunner, BufferCopy, run_schedule, lower_schedule
 
 class KernelCountException(Exception): pass
 def check_schedule(t:Union[Tensor, List[Tensor], UOp], allowed:int, to_prerealize:Optional[List[Tensor]]=None, filter_sink=True):
@@ -2665,5 +2665,99 @@ class TestUOpBecome(unittest.TestCase):
     b.shrink(((0,4),)).assign(a_view).realize()
     self.assertListEqual(b.tolist(), [0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0])
 
+class TestAsyncSchedule(unittest.TestCase):
+  def test_async_matches_serial(self):
+    def f(): return [((Tensor(np.arange(64, dtype=np.float32)+i).reshape(8, 8) @ Tensor.ones(8, 8)).relu().sum(0)) for i in range(4)]
+    GlobalCounters.reset()
+    expected = Tensor.realize(*f())
+    kernel_count = GlobalCounters.kernel_count
+    with Context(ASYNC_SCHEDULE=2):
+      GlobalCounters.reset()
+      out = Tensor.realize(*f())
+      self.assertEqual(GlobalCounters.kernel_count, kernel_count)
+    for x,y in zip(out, expected): np.testing.assert_equal(x.numpy(), y.numpy())
+
+  def test_async_copies_overlap(self):
+    copies, allocs = [], []
+    orig_copy, orig_alloc = BufferCopy.copy, Buffer.allocate
+    def copy(self, dest, src):
+      copies.append(threading.current_thread().name)
+      return orig_copy(self, dest, src)
+    def allocate(self, *args, **kwargs):
+      allocs.append(threading.current_thread())
+      return orig_alloc(self, *args, **kwargs)
+    out = [Tensor(np.full(16, i, dtype=np.int32))+1 for i in range(4)]
+    sched, var_vals = Tensor.schedule_with_vars(*out)
+    # the copies of the numpy inputs don't depend on the compute and run in the copy thread, the buffers are allocated by the lowering thread
+    with Context(ASYNC_SCHEDULE=4), unittest.mock.patch.object(BufferCopy, "copy", copy), unittest.mock.patch.object(Buffer, "allocate", allocate):
+      run_schedule(sched, var_vals)
+    self.assertEqual([x.tolist() for x in out], [[i+1]*16 for i in range(4)])
+    self.assertTrue(len(copies) and all(x.startswith("tinygrad_copy") for x in copies), copies)
+    self.assertTrue(len(allocs) and all(t is not threading.current_thread() for t in allocs), allocs)
+
+  def test_async_copy_waits(self):
+    # the second copy reads what the first one writes, the kernel reads the second one
+    a = Tensor(np.arange(16, dtype=np.int32)).to(f"{Device.DEFAULT}:1").to(Device.DEFAULT)+1
+    sched, var_vals = a.schedule_with_vars()
+    with Context(ASYNC_SCHEDULE=4): run_schedule(sched, var_vals)
+    self.assertEqual(a.tolist(), list(range(1, 17)))
+
+  def test_async_lowering_error(self):
+    a = Tensor.ones(4).contiguous()
+    sched, var_vals = (a+1).schedule_with_vars()
+    with Context(ASYNC_SCHEDULE=2), unittest.mock.patch("tinygrad.engine.realize.lower_schedule_item", side_effect=RuntimeError("lower")):
+      with self.assertRaises(RuntimeError): run_schedule(sched, var_vals)
+
+class TestScheduleCache(unittest.TestCase):
+  def _train(self, steps=4):
+    Tensor.manual_seed(0)
+    w = Tensor.uniform(8, 8, requires_grad=True).contiguous().realize()
+    opt = nn.optim.SGD([w], lr=0.1, momentum=0.9)
+    with Tensor.train():
+      for i in range(steps):
+        x = Tensor(np.arange(16, dtype=np.float32).reshape(2, 8)+i)
+        opt.zero_grad()
+        loss = (x @ w).relu().sum()
+        loss.backward()
+        opt.step()
+    return w.numpy()
+
+  def test_cache_matches_uncached(self):
+    expected = self._train()
+    with Context(SCHEDULE_CACHE=16):
+      GlobalCounters.reset()
+      out = self._train()
+      self.assertGreater(GlobalCounters.schedule_hits, 0)
+    np.testing.assert_allclose(out, expected)
+
+  def test_cache_new_buffers(self):
+    with Context(SCHEDULE_CACHE=16):
+      a = Tensor([1., 2., 3.]).contiguous().realize()
+      b = Tensor([4., 5., 6.]).contiguous().realize()
+      GlobalCounters.reset()
+      x, y = (a*2+1).realize(), (b*2+1).realize()
+      self.assertEqual(GlobalCounters.schedule_hits, 1)
+      self.assertIsNot(x.uop.buffer, y.uop.buffer)
+      self.assertListEqual(x.tolist(), [3., 5., 7.])
+      self.assertListEqual(y.tolist(), [9., 11., 13.])
+
+  def test_cache_key_context(self):
+    a, b, c = [Tensor([1., 2., 3.]).contiguous().realize() for _ in range(3)]
+    with Context(SCHEDULE_CACHE=16):
+      (a*3+2).realize()
+      GlobalCounters.reset()
+      # a ContextVar that doesn't change the schedule hits, one that does misses
+      with Context(BEAM=0, TRACEMETA=2): (b*3+2).realize()
+      self.assertEqual((GlobalCounters.schedule_hits, GlobalCounters.schedule_misses), (1, 0))
+      with Context(FUSE_ARANGE=1): (c*3+2).realize()
+      self.assertEqual((GlobalCounters.schedule_hits, GlobalCounters.schedule_misses), (1, 1))
+
+  def test_cache_no_leak(self):
+    with Context(SCHEDULE_CACHE=16):
+      for _ in range(3):
+        base = GlobalCounters.mem_used
+        Tensor.ones(256).contiguous().realize()
+        self.assertEqual(GlobalCounters.mem_used-base, 0)
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
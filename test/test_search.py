@@ -1,4 +1,7 @@
-import unittest
+import unittest, tempfile
+import numpy as np
+from unittest.mock import patch
+from dataclasses import replace
 
 from tinygrad.opt.kernel import Opt, OptOps, Kernel
 from tinygrad.uop.ops import UOp, Ops
@@ -137,5 +140,59 @@ class TestBEAM(unittest.TestCase):
     beam_search(lin, bufs, 3, disable_cache=True)
     self.assertEqual(kcount, len(Kernel.kernel_cnt))
 
+  def test_beam_costmodel_topk(self):
+    from tinygrad.opt import search
+    from tinygrad.opt.costmodel import CostModel, FEATURES
+    lin = Kernel((Tensor.empty(32, 32) @ Tensor.empty(32, 32)).schedule()[-1].ast)
+    bufs = bufs_from_lin(lin)
+    # a model that prefers the candidates with the fewest uops
+    model = CostModel([1.0 if f == "uops" else 0.0 for f in FEATURES])
+    with patch.object(search, "BEAM_TOPK", 2), patch.object(CostModel, "load", return_value=model), \
+         patch.object(search, "_time_program", wraps=search._time_program) as timed:
+      k = beam_search(lin, bufs, 2, disable_cache=True)
+    steps = len(k.applied_opts) + 1
+    self.assertLessEqual(timed.call_count, 2*2*steps)
+
+  def test_beam_db(self):
+    from tinygrad.opt import beamdb, get_optimized_ast
+    lin = Kernel((Tensor.empty(16, 16) @ Tensor.empty(16, 16)).schedule()[-1].ast)
+    kb = beam_search(lin, bufs_from_lin(lin), 2, disable_cache=True)
+    entries = [e for e in beamdb.export_beam() if e.ast == lin.ast.key.hex()]
+    self.assertEqual([e.opts for e in entries], [tuple(kb.applied_opts)])
+    # merge keeps the fastest entry and the file round trips
+    slow = replace(entries[0], opts=(), time=entries[0].time*10)
+    with tempfile.NamedTemporaryFile(suffix=".json") as f:
+      beamdb.save_beam(f.name, beamdb.merge_beam([slow], entries))
+      self.assertEqual(beamdb.load_beam(f.name), entries)
+    # an imported entry is applied without BEAM
+    with patch.object(beamdb, "_imported", {e.kernel_key:e for e in entries}), Context(BEAM=0):
+      self.assertEqual(get_optimized_ast(lin.ast, lin.opts).arg.applied_opts, tuple(kb.applied_opts))
+    with patch.object(beamdb, "_imported", {slow.kernel_key:slow}), Context(BEAM=0):
+      self.assertEqual(get_optimized_ast(lin.ast, lin.opts).arg.applied_opts, ())
+
+  def test_joint_descend(self):
+    from tinygrad.opt.joint import descend
+    # kernel 0's second candidate is only faster when kernel 1 runs its second candidate, like a layout both have to agree on
+    def cost(i, choice): return {(0, 0): 3.0, (1, 0): 4.0, (0, 1): 2.5, (1, 1): 1.0}[tuple(choice)]
+    self.assertEqual(descend([2, 2], cost, sweeps=2, min_gain=0.02), [1, 1])
+    self.assertEqual(descend([2, 2], cost, sweeps=1, min_gain=0.02), [0, 1])
+    # a gain under the noise margin doesn't move
+    self.assertEqual(descend([2, 1], lambda i,choice: 1.0 - 0.01*choice[0], sweeps=2, min_gain=0.02), [0, 0])
+
+  def test_joint_beam(self):
+    from tinygrad.opt.joint import optimize_schedule
+    a, b = Tensor.rand(16, 16).realize(), Tensor.rand(16, 16).realize()
+    sched = ((a @ b).relu().contiguous() @ b.T).schedule()
+    mem_used = GlobalCounters.mem_used
+    with Context(JOINT_BEAM=2, CACHELEVEL=0): opt = optimize_schedule(sched, {})
+    # the scratch buffers are freed
+    self.assertEqual(GlobalCounters.mem_used, mem_used)
+    self.assertEqual(len(opt), len(sched))
+    for si,osi in zip(sched, opt):
+      self.assertEqual(osi.bufs, si.bufs)
+      if si.ast.op is Ops.SINK: self.assertIsNotNone(osi.ast.arg.opts_to_apply)
+    with Context(JOINT_BEAM=2, CACHELEVEL=0): out = ((a @ b).relu().contiguous() @ b.T).realize()
+    np.testing.assert_allclose(out.numpy(), np.maximum(a.numpy() @ b.numpy(), 0) @ b.numpy().T, rtol=1e-5)
+
 if __name__ == '__main__':
   unittest.main()
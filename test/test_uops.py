@@ -10,11 +10,12 @@ from tinygrad.device import Buffer, Device
 from tinygrad.uop.ops import Ops, UOp, UPat, KernelInfo, exec_alu # noqa F401
 from tinygrad.uop.spec import spec
 from tinygrad.renderer import ProgramSpec
-from tinygrad.engine.realize import CompiledRunner, get_program
+from tinygrad.engine.realize import CompiledRunner, get_program, lower_schedule_item
 from tinygrad.codegen import full_rewrite
 from tinygrad.uop.symbolic import sym
 from tinygrad.device import is_dtype_supported
-from tinygrad.opt.kernel import Opt, OptOps
+from tinygrad.opt.kernel import Opt, OptOps, Kernel
+from tinygrad.runtime.ops_python import PythonProgram, PythonRenderer, PythonCompiler
 
 def to_uops_list(u:list[UOp], opts=None, skip_check=False) -> list[UOp]: return full_rewrite(UOp.sink(*u), opts)
 
@@ -344,6 +345,66 @@ class TestLocalAccess(unittest.TestCase):
     sres = uop(uops, Ops.LOAD, dtypes.int32, (smem.index(ofs),))
     self.assertEqual(_test_uops_result(dtypes.int32, uops, sres), 42)
 
+class TestPythonNumpy(unittest.TestCase):
+  def _check(self, *outs:Tensor, min_vectorized=1):
+    vectorized = 0
+    for si in Tensor.schedule(*outs):
+      ei = lower_schedule_item(si)
+      if not isinstance(ei.prg, CompiledRunner):
+        ei.run()
+        continue
+      prg = ei.prg._prg
+      vectorized += prg.vectorized
+      ins = [bytes(b.as_buffer()) if b.is_allocated() else None for b in si.bufs]
+      ei.run()
+      out = [bytes(b.as_buffer()) for b in si.bufs]
+      # run it again with the scalar emulator on the same inputs
+      for b,x in zip(si.bufs, ins):
+        if x is not None: b.copyin(memoryview(x))
+      prg.vectorized, vec = False, prg.vectorized
+      try: ei.run()
+      finally: prg.vectorized = vec
+      for a,b in zip(out, si.bufs): self.assertEqual(a, bytes(b.as_buffer()))
+    self.assertGreaterEqual(vectorized, min_vectorized)
+
+  def test_matmul(self):
+    a, b = Tensor.randn(16, 24).to("PYTHON").realize(), Tensor.randn(24, 8).to("PYTHON").realize()
+    self._check((a @ b).relu())
+
+  def test_reduce_gated(self):
+    a = Tensor.randn(5, 7).to("PYTHON").realize()
+    self._check(a.pad(((1, 2), (0, 3))).cumsum(1), a.max(0).exp(), a.sqrt().log2())
+
+  def test_int_alu(self):
+    a = Tensor.arange(-40, 40).to("PYTHON").realize()
+    u = a.cast(dtypes.uint32)
+    self._check(a // 3, a % 7, (u << 3) ^ (u >> 1), a.cast(dtypes.uint8), (a * 0.37).cast(dtypes.half).cast(dtypes.float),
+                (a < 5).where(a.maximum(-3), 2))
+
+  def test_locals(self):
+    a = Tensor.randn(4, 64).to("PYTHON").realize()
+    sched = a.sum(1).schedule()
+    k = Kernel(sched[-1].ast, opts=PythonRenderer())
+    k.apply_opt(Opt(OptOps.GROUP, 0, 16))
+    prg = PythonProgram("test", PythonCompiler().compile((p:=get_program(k.get_optimized_ast(), k.opts)).src))
+    self.assertTrue(prg.vectorized)
+    for vec in (False, True):
+      prg.vectorized = vec
+      buf = Buffer("PYTHON", 4, dtypes.float).allocate()
+      prg(buf._buf, a.uop.buffer._buf, global_size=tuple(p.global_size), local_size=tuple(p.local_size))
+      if not vec: ref = bytes(buf.as_buffer())
+    self.assertEqual(ref, bytes(buf.as_buffer()))
+    np.testing.assert_allclose(np.frombuffer(ref, np.float32), a.numpy().sum(1), rtol=1e-5)
+
+  def test_out_of_bounds(self):
+    uops = []
+    g = uop(uops, Ops.DEFINE_GLOBAL, dtypes.int32.ptr(), (), 0)
+    st = uop(uops, Ops.STORE, dtypes.void, (g.index(uop(uops, Ops.CONST, dtypes.int32, (), 4)), uop(uops, Ops.CONST, dtypes.int32, (), 1)))
+    lst = full_rewrite(UOp.sink(st), PythonRenderer())
+    prg = PythonProgram("test", PythonCompiler().compile(PythonRenderer().render(lst)))
+    self.assertTrue(prg.vectorized)
+    with self.assertRaises(IndexError): prg(memoryview(bytearray(16)))
+
 @unittest.skipUnless(getenv("PTX"), "This only tests assembly backends")
 class TestAssembly(unittest.TestCase):
   def test_bitshift_left(self):
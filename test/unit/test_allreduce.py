@@ -1,7 +1,15 @@
-import unittest
+import unittest, unittest.mock, os
+import numpy as np
 from tinygrad import Tensor
-from tinygrad.helpers import Context
+from tinygrad.helpers import Context, getenv
 from tinygrad.uop.ops import Ops
+from tinygrad.kernelize.multi import allreduce_cost, allreduce_groups, ring_crossover_latency, NAIVE, RING_ALLREDUCE, HALVING_DOUBLING, HIERARCHICAL
+
+def _copies(N:int) -> list[tuple[int, int]]:
+  # (from, to) device numbers of the copies in the allreduce
+  t = Tensor.empty(N, N*100).shard(tuple(f"CPU:{i}" for i in range(N)), axis=0).realize()
+  def num(d:str) -> int: return int(d.split(":")[1]) if ":" in d else 0
+  return [(num(si.bufs[1].device), num(si.bufs[0].device)) for si in t.sum(0).schedule() if si.ast.op is Ops.COPY]
 
 class TestRingAllReduce(unittest.TestCase):
   def test_schedule_ring(self):
@@ -25,5 +33,125 @@ class TestRingAllReduce(unittest.TestCase):
       out = t.sum(0)
       self.assertListEqual(out.tolist(), [4]*N*100)
 
+class TestHalvingDoublingAllReduce(unittest.TestCase):
+  def test_schedule_halving_doubling(self):
+    with Context(RING=3):
+      N = 4
+      pairs = _copies(N)
+      # log2(N) steps of N copies in the reduce-scatter, and N*(N-1) pieces in the allgather
+      self.assertEqual(len(pairs), N*2 + N*(N-1))
+      # every copy is between partners: the device numbers differ in one bit
+      self.assertTrue(all(bin(a ^ b).count("1") == 1 for a,b in pairs))
+
+  def test_correct_halving_doubling(self):
+    for N in [2, 3, 4, 6]:
+      with Context(RING=3):
+        ds = tuple(f"CPU:{i}" for i in range(N))
+        t = Tensor.arange(N*N*10).reshape(N, N*10).contiguous().shard(ds, axis=0).realize()
+        self.assertListEqual(t.sum(0).tolist(), Tensor.arange(N*N*10).reshape(N, N*10).sum(0).tolist())
+        self.assertListEqual(t.max(0).tolist(), Tensor.arange(N*N*10).reshape(N, N*10).max(0).tolist())
+
+class TestHierarchicalAllReduce(unittest.TestCase):
+  def test_schedule_hierarchical(self):
+    with Context(RING=4, ALLREDUCE_GROUP=2):
+      pairs = _copies(4)
+      # to the first device of each group, between them, and back
+      self.assertEqual(sorted(pairs), [(0, 1), (0, 2), (1, 0), (2, 0), (2, 3), (3, 2)])
+
+  def test_correct_hierarchical(self):
+    for N,G in [(4, 2), (6, 3), (5, 2)]:
+      with Context(RING=4, ALLREDUCE_GROUP=G):
+        ds = tuple(f"CPU:{i}" for i in range(N))
+        t = Tensor.ones(N, N*10).contiguous().shard(ds, axis=0).realize()
+        self.assertListEqual(t.sum(0).tolist(), [N]*N*10)
+
+  def test_groups(self):
+    self.assertIsNone(allreduce_groups(("CPU:0", "CPU:1")))
+    self.assertEqual(allreduce_groups(("AMD:0", "AMD:1", "CUDA:0", "CUDA:1")), [[0, 1], [2, 3]])
+    with Context(ALLREDUCE_GROUP=2): self.assertEqual(allreduce_groups(("CPU:0", "CPU:1", "CPU:2")), [[0, 1], [2]])
+
+class TestAllReduceBucket(unittest.TestCase):
+  def _schedule(self, *ts:Tensor, **ctx) -> list[Ops]:
+    with Context(RING=0, **ctx): return [si.ast.op for si in Tensor.schedule(*ts)]
+
+  def test_bucket_schedule(self):
+    N = 4
+    ds = tuple(f"CPU:{i}" for i in range(N))
+    a, b = Tensor.empty(N, 100).shard(ds, axis=0).realize(), Tensor.empty(N, 30, 2).shard(ds, axis=0).realize()
+    self.assertEqual(self._schedule(a.sum(0), b.sum(0)).count(Ops.COPY), 2*N*(N-1))
+    # one naive allreduce for both
+    self.assertEqual(self._schedule(a.sum(0), b.sum(0), ALLREDUCE_BUCKET=1<<20).count(Ops.COPY), N*(N-1))
+    # the bucket is full after the first one
+    self.assertEqual(self._schedule(a.sum(0), b.sum(0), ALLREDUCE_BUCKET=100*4).count(Ops.COPY), 2*N*(N-1))
+
+  def test_bucket_correct(self):
+    N = 4
+    ds = tuple(f"CPU:{i}" for i in range(N))
+    a = Tensor.arange(N*10).reshape(N, 10).contiguous().shard(ds, axis=0).realize()
+    b = Tensor.arange(N*6).reshape(N, 3, 2).float().contiguous().shard(ds, axis=0).realize()
+    # the last allreduce depends on the first, it can't be in its bucket
+    outs = [a.sum(0), b.sum(0), (b * a.sum(0)[:2]).sum(0), a.max(0)]
+    with Context(ALLREDUCE_BUCKET=1<<20): Tensor.realize(*outs)
+    na, nb = np.arange(N*10).reshape(N, 10), np.arange(N*6).reshape(N, 3, 2)
+    for out,ref in zip(outs, [na.sum(0), nb.sum(0), (nb * na.sum(0)[:2]).sum(0), na.max(0)]): np.testing.assert_equal(out.numpy(), ref)
+
+  def test_early_copy(self):
+    N = 4
+    x = Tensor.empty(N, 64).shard(tuple(f"CPU:{i}" for i in range(N)), axis=0).realize()
+    def f() -> list[Tensor]:
+      y = x
+      for _ in range(3): y = (y * 2 + 1).contiguous()
+      return [x.sum(0), y]
+    bfs, early = self._schedule(*f()), self._schedule(*f(), EARLY_COPY=1)
+    self.assertEqual(sorted(bfs, key=str), sorted(early, key=str))
+    # the copies of the allreduce right after the reduce, not after the first kernel of y
+    self.assertEqual(bfs.index(Ops.COPY), 2*N)
+    self.assertEqual(early.index(Ops.COPY), N)
+
+class TestAllReduceCost(unittest.TestCase):
+  def _pick(self, n, nbytes, groups=None):
+    return min([NAIVE, RING_ALLREDUCE, HALVING_DOUBLING] + ([HIERARCHICAL] if groups else []), key=lambda a: allreduce_cost(a, n, nbytes, groups))
+
+  def test_small_is_naive(self):
+    for n in [2, 3, 4, 8]: self.assertEqual(self._pick(n, 1024), NAIVE)
+    self.assertEqual(self._pick(2, 1 << 30), NAIVE)
+
+  def test_cost_model_picks(self):
+    # RING=5 uses the model: a small allreduce is naive, every device copies from the N-1 others
+    with Context(RING=5): self.assertEqual(len(_copies(4)), 4*3)
+
+  def test_ring_above_threshold(self):
+    # RING=1 is the ring on more than 2 devices above RING_ALLREDUCE_THRESHOLD elements
+    with unittest.mock.patch.dict(os.environ, {"RING_ALLREDUCE_THRESHOLD": "100"}), Context(RING=1):
+      getenv.cache_clear()
+      self.assertEqual(len(_copies(4)), 4*3*2)
+      self.assertEqual(len(_copies(2)), 2)
+    getenv.cache_clear()
+    with Context(RING=1): self.assertEqual(len(_copies(4)), 4*3)
+
+  def test_large(self):
+    # same bytes as the ring in fewer steps for a power of 2, the ring has no devices to fold in otherwise
+    self.assertEqual(self._pick(8, 1 << 26), HALVING_DOUBLING)
+    self.assertEqual(self._pick(6, 1 << 26), RING_ALLREDUCE)
+
+  def test_crossover_latency(self):
+    for n in [3, 6, 8]:
+      with unittest.mock.patch.dict(os.environ, {"ALLREDUCE_LATENCY": str(ring_crossover_latency(10_000, n))}):
+        getenv.cache_clear()
+        self.assertAlmostEqual(allreduce_cost(NAIVE, n, 10_000*4), allreduce_cost(RING_ALLREDUCE, n, 10_000*4))
+    getenv.cache_clear()
+
+  def test_ring_threshold(self):
+    # RING_ALLREDUCE_THRESHOLD moves where the naive and the ring cross on 6 devices
+    for thr in [10_000, 256_000, 4_000_000]:
+      with unittest.mock.patch.dict(os.environ, {"RING_ALLREDUCE_THRESHOLD": str(thr)}):
+        getenv.cache_clear()
+        self.assertEqual(self._pick(6, thr*4//2), NAIVE)
+        self.assertEqual(self._pick(6, thr*4*2), RING_ALLREDUCE)
+    getenv.cache_clear()
+
+  def test_hierarchical(self):
+    self.assertEqual(self._pick(8, 1 << 18, [[0, 1, 2, 3], [4, 5, 6, 7]]), HIERARCHICAL)
+
 if __name__ == '__main__':
   unittest.main()
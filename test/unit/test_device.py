@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 import unittest, os, subprocess, sys
-from tinygrad import Tensor
-from tinygrad.device import Device, Compiler
-from tinygrad.helpers import diskcache_get, diskcache_put, getenv, Context
+import numpy as np
+from tinygrad import Tensor, TinyJit
+from tinygrad.device import Device, Compiler, LRUAllocator, size_class
+from tinygrad.helpers import diskcache_get, diskcache_put, getenv, Context, GlobalCounters
+from tinygrad.uop.ops import Ops
+from tinygrad.engine.realize import get_program
 
 class TestDevice(unittest.TestCase):
   def test_canonicalize(self):
@@ -53,6 +56,120 @@ class TestCompiler(unittest.TestCase):
       a = Tensor([0.,1.], device=Device.DEFAULT).realize()
       (a + 1).realize()
 
+@unittest.skipUnless(Device.DEFAULT in {"CPU", "LLVM"}, "threads are only on host devices")
+class TestCPUThreads(unittest.TestCase):
+  def _check(self, fxn, *shapes, cores):
+    ts = [Tensor.rand(*s).realize() for s in shapes]
+    with Context(CPU_THREADS=4):
+      p = get_program(fxn(*ts).schedule()[-1].ast, Device[Device.DEFAULT].renderer)
+      self.assertEqual(p.global_size[0] if p.global_size is not None else 1, cores)
+      out = fxn(*ts).numpy()
+    np.testing.assert_allclose(out, fxn(*ts).numpy(), atol=1e-4, rtol=1e-4)
+
+  def test_elementwise(self): self._check(lambda a,b: (a+b).exp(), (256, 256), (256, 256), cores=4)
+  def test_matmul(self): self._check(lambda a,b: a@b, (128, 128), (128, 128), cores=4)
+  def test_odd_loop(self): self._check(lambda a: a.sum(1), (9, 8191), cores=3)
+  def test_full_reduce_not_split(self): self._check(lambda a: a.sum(), (256, 256), cores=1)
+  def test_small_not_split(self): self._check(lambda a: a+1, (16, 16), cores=1)
+
+  def test_uops_have_core(self):
+    a = Tensor.rand(256, 256).realize()
+    with Context(CPU_THREADS=2):
+      p = get_program((a+1).schedule()[-1].ast, Device[Device.DEFAULT].renderer)
+    self.assertEqual([u.arg for u in p.uops if u.op is Ops.SPECIAL], [("core0", 2)])
+
+  def test_jit_graph(self):
+    @TinyJit
+    def f(a, b): return (a+b).exp().realize(), (a*b).sum(1).realize()
+    with Context(CPU_THREADS=4):
+      for _ in range(4):
+        a, b = Tensor.rand(256, 256).realize(), Tensor.rand(256, 256).realize()
+        out = [x.numpy() for x in f(a, b)]
+    np.testing.assert_allclose(out[0], (a+b).exp().numpy(), atol=1e-4, rtol=1e-4)
+    np.testing.assert_allclose(out[1], (a*b).sum(1).numpy(), atol=1e-4, rtol=1e-4)
+    self.assertIsInstance(f.jit_cache[0].prg, Device[Device.DEFAULT].graph)
+
+  def test_worker_exception(self):
+    from tinygrad.device import CPUWorkers
+    w, ran = CPUWorkers(), []
+    def fxn(i):
+      if i == 2: raise RuntimeError("core 2")
+      ran.append(i)
+    with self.assertRaisesRegex(RuntimeError, "core 2"): w.run(fxn, [[0], [1], [2], [3]])
+    # the workers are still there for the next run
+    w.run(fxn, [[0], [1], [3], [4]])
+    self.assertEqual(sorted(ran), [0, 0, 1, 1, 3, 3, 4])
+
+class _TrackingAllocator(LRUAllocator):
+  def __init__(self):
+    super().__init__(None)
+    self.freed: list = []
+  def _alloc(self, size:int, options): return bytearray(size)
+  def _free(self, opaque, options): self.freed.append(opaque)
+  def _offset(self, buf, size:int, offset:int): return memoryview(buf)[offset:offset+size]
+
+class TestLRUAllocator(unittest.TestCase):
+  def setUp(self): GlobalCounters.reset()
+
+  def test_size_class(self):
+    self.assertEqual([size_class(x) for x in [1, 64, 65, 1024, 1025, 2048, 2049, 3000]], [64, 64, 128, 1024, 1280, 2048, 2560, 3072])
+    for x in range(1, 100000, 77): self.assertTrue(x <= size_class(x) <= max(x*1.25, x+63))
+
+  def test_exact_size_without_budget(self):
+    a = _TrackingAllocator()
+    a.free(b0:=a.alloc(1000), 1000)
+    self.assertIsInstance(b0, bytearray)
+    self.assertEqual(len(b0), 1000)
+    self.assertIsNot(a.alloc(1010), b0)
+    self.assertIs(a.alloc(1000), b0)
+
+  @Context(LRU_BUDGET=1<<20)
+  def test_reuse_size_class(self):
+    a, mem_used = _TrackingAllocator(), GlobalCounters.mem_used
+    b0 = a.alloc(1000)
+    self.assertEqual(len(b0), 1000)
+    self.assertEqual(GlobalCounters.mem_used - mem_used, 24)
+    a.free(b0, 1000)
+    self.assertEqual(GlobalCounters.mem_used, mem_used)
+    b1 = a.alloc(1010)
+    self.assertEqual(len(b1), 1010)
+    self.assertIs(b1.obj, b0.obj)
+    self.assertEqual((GlobalCounters.lru_hits, GlobalCounters.lru_misses), (1, 1))
+
+  @Context(LRU_BUDGET=1<<20)
+  def test_view_of_larger(self):
+    a = _TrackingAllocator()
+    a.free(b0:=a.alloc(4096), 4096)
+    b1 = a.alloc(3000)
+    self.assertEqual(len(b1), 3000)
+    self.assertIs(b1.obj, b0)
+    # freeing the view caches the whole buffer again
+    a.free(b1, 3000)
+    self.assertIs(a.alloc(4096), b0)
+    # but not a buffer more than twice as large
+    a.free(b0, 4096)
+    self.assertIsNot(a.alloc(1024), b0)
+
+  def test_budget_evicts_lru(self):
+    a = _TrackingAllocator()
+    bufs = [a.alloc(4096) for _ in range(4)]
+    with Context(LRU_BUDGET=3*4096):
+      for b in bufs: a.free(b, 4096)
+      self.assertEqual(a.freed, bufs[:1])
+      # reusing a buffer makes it the most recently freed
+      a.free(a.alloc(4096), 4096)
+      a.free(a.alloc(8192), 8192)
+    self.assertEqual(a.freed, bufs[:3])
+    self.assertEqual(a.cached_bytes, 4096+8192)
+    self.assertEqual(GlobalCounters.lru_evicts, 3)
+
+  def test_free_cache(self):
+    a = _TrackingAllocator()
+    for b in [a.alloc(100), a.alloc(5000)]: a.free(b, len(b))
+    a.free_cache()
+    self.assertEqual(len(a.freed), 2)
+    self.assertEqual(a.cached_bytes, 0)
+
 class TestRunAsModule(unittest.TestCase):
   def test_module_runs(self):
     p = subprocess.run([sys.executable, "-m", "tinygrad.device"],stdout=subprocess.PIPE, stderr=subprocess.PIPE,
@@ -1,6 +1,8 @@
 import unittest
-import pickle
-from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear
+import pickle, sqlite3
+from unittest.mock import patch
+from tinygrad import helpers
+from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear, diskcache_flush, CACHEDB, VERSION
 
 def remote_get(table,q,k): q.put(diskcache_get(table, k))
 def remote_put(table,k,v): diskcache_put(table, k, v)
@@ -64,6 +66,26 @@ class DiskCache(unittest.TestCase):
     self.assertEqual(hello("billy"), "worldbilly")
     self.assertEqual(kcalls, calls)
 
+  def test_write_behind(self):
+    table = "test_write_behind"
+    for i in range(10): diskcache_put(table, i, i*2)
+    self.assertEqual(diskcache_get(table, 3), 6)
+    diskcache_flush()
+    self.assertEqual(len(helpers._db_pending), 0)
+    # another connection sees the puts after the flush
+    conn = sqlite3.connect(CACHEDB)
+    self.assertEqual(pickle.loads(conn.execute(f"SELECT val FROM '{table}_{VERSION}' WHERE key=?", (3,)).fetchone()[0]), 6)
+    conn.close()
+
+  def test_lru_bounded(self):
+    table = "test_lru_bounded"
+    with patch.object(helpers, "DISKCACHE_LRU", 1000):
+      for i in range(10): diskcache_put(table, i, b"x"*300)
+      self.assertLessEqual(helpers._db_lru_bytes, 1000)
+      # evicted entries are still read back from the pending puts or the db
+      for i in range(10): self.assertEqual(diskcache_get(table, i), b"x"*300)
+      self.assertLessEqual(helpers._db_lru_bytes, 1000)
+
   def test_dict_key(self):
     table = "test_dict_key"
     fancy_key = {"hello": "world", "goodbye": 7, "good": True, "pkl": pickle.dumps("cat")}
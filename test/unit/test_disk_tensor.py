@@ -1,10 +1,14 @@
-import os, pathlib, tempfile, unittest
+import os, pathlib, tempfile, unittest, unittest.mock, gc
 import numpy as np
 from tinygrad import Tensor, Device, dtypes
 from tinygrad.dtype import DType
-from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load
+from tinygrad.nn import state as nn_state
+from tinygrad.nn.state import safe_load, safe_save, get_state_dict, torch_load, gguf_load, load_bulk
+from tinygrad.runtime import ops_disk
+from tinygrad.runtime.ops_disk import DiskDevice
 from tinygrad.helpers import Timing, fetch, temp, CI, OSX
 from tinygrad.device import is_dtype_supported
+from tinygrad.uop.ops import Ops
 
 def compare_weights_both(url):
   import torch
@@ -209,6 +213,75 @@ class TestSafetensors(unittest.TestCase):
       assert v.numpy().dtype == tensors[k].dtype
       np.testing.assert_allclose(v.numpy(), tensors[k])
 
+  def test_load_bulk(self):
+    # two shard files, a tensor split in many reads and a cast that runs after its read
+    shards = [{"a": Tensor(np.random.rand(5000).astype(np.float32)), "b": Tensor([1, 2, 3], dtype=dtypes.uint8)},
+              {"c": Tensor(np.random.rand(7, 9).astype(np.float32))}]
+    for i,sd in enumerate(shards): safe_save(sd, temp(f"bulk{i}.safetensors"))
+    state_dict = safe_load(temp("bulk0.safetensors")) | safe_load(temp("bulk1.safetensors"))
+    state_dict["c"] = state_dict["c"].to("CPU").cast(dtypes.float16)
+    if not hasattr(DiskDevice, "io_uring"): self.skipTest("needs io_uring")
+    reqs, orig_read_bulk = [], ops_disk.read_bulk
+    def read_bulk(r, depth, seg_len):
+      reqs.extend(r)
+      yield from orig_read_bulk(r, depth, seg_len)
+    with unittest.mock.patch("tinygrad.runtime.ops_disk.read_bulk", read_bulk): ret = load_bulk(state_dict, "CPU", depth=4, seg_len=4096)
+    self.assertEqual(len(reqs), 5+1+1)
+    np.testing.assert_equal(ret["a"].numpy(), shards[0]["a"].numpy())
+    np.testing.assert_equal(ret["b"].numpy(), shards[0]["b"].numpy())
+    np.testing.assert_equal(ret["c"].numpy(), shards[1]["c"].numpy().astype(np.float16))
+    self.assertTrue(all(v.uop.is_realized and v.device == "CPU" for v in ret.values()))
+
+class TestMmapLoad(unittest.TestCase):
+  def test_safe_load_mmap(self):
+    # the data starts 8 byte aligned, one of the w tensors is 32 byte aligned and mapped. the odd sized b leaves c unaligned
+    state_dict = {**{f"w{i}": Tensor.arange(2, dtype=dtypes.float32)+i for i in range(4)}, "b": Tensor([1, 2, 3], dtype=dtypes.uint8),
+                  "c": Tensor.arange(16, dtype=dtypes.int32).reshape(4, 4)}
+    safe_save(state_dict, fn:=temp("mmap.safetensors"))
+    ret = safe_load(fn, mmap=True)
+    for k,v in state_dict.items():
+      self.assertEqual((ret[k].device, ret[k].shape, ret[k].dtype), ("CPU", v.shape, v.dtype))
+      np.testing.assert_equal(ret[k].numpy(), v.numpy())
+    mapped = [k for k,v in ret.items() if (opts:=v.uop.base.buffer.options) is not None and opts.external_ptr is not None]
+    self.assertEqual(len(mapped), 1)
+    # the mapping is copy-on-write
+    ret[mapped[0]].assign(ret[mapped[0]] + 10).realize()
+    np.testing.assert_equal(safe_load(fn)[mapped[0]].numpy(), state_dict[mapped[0]].numpy())
+    with self.assertRaises(ValueError): safe_load(Tensor(pathlib.Path(fn)), mmap=True)
+
+  def test_gguf_load_mmap(self):
+    import struct
+    def gguf_str(s:str): return struct.pack("<Q", len(s)) + s.encode()
+    a, b = np.arange(12, dtype=np.float32).reshape(3, 4), np.arange(5, dtype=np.int8)
+    # header: magic, version, n_tensors, n_kv, one u32 kv and the tensor infos (name, dims reversed, type, offset)
+    dat = b"GGUF" + struct.pack("<iqq", 3, 2, 1) + gguf_str("general.alignment") + struct.pack("<iI", 4, 32)
+    dat += gguf_str("a") + struct.pack("<IQQiQ", 2, 4, 3, 0, 0) + gguf_str("b") + struct.pack("<IQiQ", 1, 5, 16, 64)
+    dat = dat.ljust((len(dat)+31)//32*32, b"\0") + a.tobytes().ljust(64, b"\0") + b.tobytes()
+    with open(fn:=temp("mmap.gguf"), "wb") as f: f.write(dat)
+    kv_data, state_dict = gguf_load(fn, mmap=True)
+    self.assertEqual(kv_data, {"general.alignment": 32})
+    # both tensors are CPU buffers in the mapping of the file
+    m = nn_state._mmaps[(os.path.realpath(fn), len(dat), os.stat(fn).st_mtime_ns)]
+    bufs = [u.buffer for v in state_dict.values() for u in v.uop.toposort() if u.op is Ops.BUFFER]
+    self.assertEqual(len(bufs), 2)
+    for buf in bufs:
+      self.assertEqual(buf.device, "CPU")
+      self.assertTrue(m.addr <= buf.options.external_ptr < m.addr + len(dat))
+    np.testing.assert_equal(state_dict["a"].numpy(), a)
+    np.testing.assert_equal(state_dict["b"].numpy(), b)
+    kv_data2, state_dict2 = gguf_load(Tensor(pathlib.Path(fn)).to(None))
+    self.assertEqual(kv_data, kv_data2)
+    for k in state_dict: np.testing.assert_equal(state_dict[k].numpy(), state_dict2[k].numpy())
+    # without mmap a filename is read from DISK
+    _, state_dict3 = gguf_load(fn)
+    self.assertTrue(all(u.buffer.device.startswith("DISK") for v in state_dict3.values() for u in v.uop.toposort() if u.op is Ops.BUFFER))
+    with self.assertRaises(ValueError): gguf_load(Tensor(pathlib.Path(fn)), mmap=True)
+    del state_dict3
+    # the file is unmapped with its last buffer
+    del state_dict, bufs, buf, m
+    gc.collect()
+    self.assertEqual(len(nn_state._mmaps), 0)
+
 def helper_test_disk_tensor(fn, data, np_fxn, tinygrad_fxn=None):
   if tinygrad_fxn is None: tinygrad_fxn = np_fxn
   pathlib.Path(temp(fn)).unlink(missing_ok=True)
@@ -1,9 +1,13 @@
-import unittest
+import unittest, itertools, time, math
+from unittest.mock import patch
 from tinygrad import Tensor, Device
 from tinygrad.opt.kernel import Kernel
 from tinygrad.device import Buffer
-from tinygrad.opt.search import get_test_global_size, bufs_from_lin
-from tinygrad.helpers import GlobalCounters
+from tinygrad.opt import search
+from tinygrad.opt.search import get_test_global_size, bufs_from_lin, optimize_local_size
+from tinygrad.helpers import GlobalCounters, Context, prod
+from tinygrad.dtype import dtypes
+from tinygrad.opt.costmodel import CostModel, FEATURES
 from extra.optimization.helpers import time_linearizer
 
 class TestSearchUtil(unittest.TestCase):
@@ -51,5 +55,68 @@ class TestTimeLinearizer(unittest.TestCase):
     time_linearizer(lin, bufs, allow_test_size=False, cnt=2, disable_cache=True, clear_l2=True)
     assert GlobalCounters.kernel_count == kernel_count, "kernel count was incremented by time_linearizer"
 
+class TestCostModel(unittest.TestCase):
+  def test_train_ranks(self):
+    # log2 time is linear in two of the features, with an offset per kernel the model doesn't need to learn
+    def sample(a, b, offset): return [a, 0, 0, b] + [0]*(len(FEATURES)-4), 2**(offset + a - 0.3*b)
+    kernels = [[sample(a, b, offset) for a in range(4) for b in range(0, 8, 3)] for offset in [-20, -10, -15]]
+    model = CostModel.train(kernels)
+    for samples in kernels:
+      self.assertEqual(sorted(range(len(samples)), key=lambda i: model.predict(samples[i][0])),
+                       sorted(range(len(samples)), key=lambda i: samples[i][1]))
+
+  def test_train_skips_failed(self):
+    model = CostModel.train([[([1.0]*len(FEATURES), float("inf"))], [([0.0]*len(FEATURES), 1e-5), ([1.0]*len(FEATURES), 2e-5)]])
+    self.assertEqual(len(model.weights), len(FEATURES))
+
+class TestOptimizeLocalSize(unittest.TestCase):
+  def setUp(self): self.bufs = [Buffer(Device.DEFAULT, 16, dtypes.float32).allocate()]
+  @staticmethod
+  def prg(*bufs, global_size, local_size, wait):
+    # 128 threads with a wide x dim is the fastest
+    return 1 + abs(math.log2(prod(local_size)) - 7) + (local_size[0] < 16)
+
+  def test_deterministic(self):
+    ret = [optimize_local_size(self.prg, [256, 64, 3], self.bufs) for _ in range(3)]
+    self.assertEqual(ret[0], ret[1])
+    self.assertEqual(ret[0], ret[2])
+    self.assertEqual(prod(ret[0]), 128)
+    self.assertGreaterEqual(ret[0][0], 16)
+
+  def test_local_max(self):
+    ret = optimize_local_size(self.prg, [256, 64, 3], self.bufs, local_max=(8, 4, 1))
+    self.assertTrue(all(l <= m and g % l == 0 for g,l,m in zip([256, 64, 3], ret, (8, 4, 1))))
+
+  def test_cached(self):
+    key = {"src": f"test_cached {time.time()}", "global_size": "256,64,3", "device": Device.DEFAULT}
+    ret = optimize_local_size(self.prg, [256, 64, 3], self.bufs, key=key)
+    def fail(*args, **kwargs): raise RuntimeError("not cached")
+    self.assertEqual(optimize_local_size(fail, [256, 64, 3], self.bufs, key=key), ret)
+
+class TestRace(unittest.TestCase):
+  # the runners are the true times, a run is the true time with 2% of jitter
+  def race(self, times:list[float], keep:int) -> list[list[float]]:
+    jitter = itertools.cycle([1.0, 1.02, 1.01])
+    def run(runner, var_vals, rawbufs, early_stop=None, clear_l2=False, cnt=3): return [runner[0]*next(jitter) for _ in range(cnt)]
+    tms = [run((t, 1.0), {}, [], cnt=1) for t in times]
+    with patch.object(search, "_run_program", run), Context(BEAM_RACE=4):
+      search._race([(t, 1.0) for t in times], tms, keep, {}, [])
+    return tms
+
+  def test_race_drops_slow(self):
+    tms = self.race([8.0, 1.0, 4.0, 2.0, 16.0, 1.5], keep=2)
+    # the slowest half and the 2.0, which is in the fastest half but slower than the noise, are timed once
+    self.assertEqual([len(t) for t in tms], [1, 4, 1, 1, 1, 4])
+    self.assertLess(min(tms[1]), min(tms[5]))
+
+  def test_race_keeps_ties(self):
+    # the fastest half is raced when it's within the timer noise of the best
+    tms = self.race([1.0, 1.005, 1.0, 1.005], keep=1)
+    self.assertEqual(sum(len(t) > 1 for t in tms), 2)
+
+  def test_race_skips_failed(self):
+    tms = self.race([float("inf"), 1.0, 2.0], keep=1)
+    self.assertEqual(len(tms[0]), 1)
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
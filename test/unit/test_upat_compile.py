@@ -1,8 +1,9 @@
-import unittest
-from tinygrad.helpers import DEBUG
+import unittest, shutil
+from tinygrad.helpers import DEBUG, getenv
 from tinygrad.dtype import dtypes
-from tinygrad.uop.ops import UPat, track_rewrites, GroupOp, Ops
-from tinygrad.uop.upat import _get_code, upat_compile
+from tinygrad.uop.ops import UPat, UOp, PatternMatcher, track_rewrites, GroupOp, Ops
+from tinygrad.uop.upat import _get_code, upat_compile, pm_compile_c
+from tinygrad.uop.symbolic import sym
 import dis
 
 @track_rewrites()
@@ -49,5 +50,34 @@ class TestUPatCompile(unittest.TestCase):
     up = UPat(Ops.CAST, dtypes.float, UPat.var("x", dtypes.bfloat16))
     do_compile(up)
 
+@unittest.skipIf(shutil.which(getenv("CC", "clang")) is None, "needs clang")
+class TestPatternMatcherC(unittest.TestCase):
+  def test_sym_same_rewrites(self):
+    a, b = UOp.variable("a", 0, 10), UOp.variable("b", -5, 5)
+    exprs = [(a+0)*1, a*2+a*3, (a*4)//4, (a+b)%3, (a<5).where(a, b), (a*2+1)//2, a.cast(dtypes.float).cast(dtypes.int), (a+b)-(b+a),
+             ((a+3)*2).maximum(b), (a//2)*2+a%2, a.alu(Ops.CMPNE, a), (-a)*-1, (a+1)*(b+1)-a*b]
+    rewrite = pm_compile_c(sym)
+    for u in UOp.sink(*exprs).toposort(): self.assertIs(rewrite(u), sym.rewrite(u), u)
+
+  def test_python_fallback(self):
+    # names in a repeated src aren't compiled
+    pm = PatternMatcher([(UPat(Ops.SINK, src=UPat(Ops.CONST, name="c")), lambda c: c),
+                         (UPat(Ops.SINK, name="x"), lambda x: UOp.const(dtypes.int, len(x.src)))])
+    c = UOp.const(dtypes.int, 2)
+    for u in [c.sink(), c.sink(c), c.sink(c+1), UOp(Ops.SINK)]: self.assertIs(pm_compile_c(pm)(u), pm.rewrite(u))
+
+  def test_arg_nan(self):
+    pm = PatternMatcher([(UPat(Ops.CONST, arg=(nan:=float("nan")), name="x"), lambda x: x.rtag())])
+    u = UOp.const(dtypes.float, nan)
+    self.assertIsNone(pm.rewrite(u))
+    self.assertIsNone(pm_compile_c(pm)(u))
+
+  def test_ctx(self):
+    pm = PatternMatcher([(UPat(Ops.CONST, name="x"), lambda ctx,x: x.const_like(ctx))])
+    rewrite = pm_compile_c(pm)
+    self.assertEqual(rewrite(UOp.const(dtypes.int, 2), 3).arg, 3)
+    self.assertEqual(rewrite(UOp.const(dtypes.int, 2), ctx=4).arg, 4)
+    with self.assertRaises(TypeError): rewrite(UOp.const(dtypes.int, 2), ctxx=4)
+
 if __name__ == "__main__":
   unittest.main()
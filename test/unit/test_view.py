@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import unittest
-from tinygrad.shape.view import View, merge_dims
+from tinygrad.shape.view import View, merge_dims, strides_for_shape, shape_cache_generation, shape_cache_stats
+from tinygrad.helpers import Context
 # from tinygrad.shape.shapetracker import ShapeTracker
 
 class TestView(unittest.TestCase):
@@ -244,5 +245,28 @@ class TestMergeViews(unittest.TestCase):
     # TODO: why is this different?
     self.assertIsNone(v)
 
+class TestShapeCache(unittest.TestCase):
+  def test_generation_drops_old(self):
+    with Context(SHAPE_CACHE=0):
+      shape_cache_generation()
+      shape_cache_generation()
+    hits, misses, size, evicted = shape_cache_stats()["strides_for_shape"]
+    self.assertEqual(size, 0)
+    for i in range(100): strides_for_shape((i+1000, 3))
+    with Context(SHAPE_CACHE=10): shape_cache_generation()
+    # the full cache turns old, nothing is dropped yet
+    self.assertEqual(shape_cache_stats()["strides_for_shape"][2:], (100, evicted))
+    strides_for_shape((1000, 3))
+    with Context(SHAPE_CACHE=10): shape_cache_generation()
+    # the entry hit since the last generation survives, the rest of the old generation is dropped
+    strides_for_shape((1000, 3))
+    h, m, size, e = shape_cache_stats()["strides_for_shape"]
+    self.assertEqual((h-hits, m-misses, size, e-evicted), (2, 100, 1, 99))
+
+  def test_generation_keeps_small_cache(self):
+    strides_for_shape((7, 5, 3))
+    shape_cache_generation()
+    self.assertGreater(shape_cache_stats()["strides_for_shape"][2], 0)
+
 if __name__ == '__main__':
   unittest.main()
@@ -1,6 +1,6 @@
 import math
-from tinygrad.uop.ops import UOp, Ops, sint, PatternMatcher, UPat, KernelInfo, ssimplify
-from tinygrad.helpers import all_int
+from tinygrad.uop.ops import UOp, Ops, sint, PatternMatcher, UPat, KernelInfo, ssimplify, AxisType
+from tinygrad.helpers import all_int, prod, getenv
 from tinygrad.dtype import dtypes
 from tinygrad.shape.view import get_contraction
 from tinygrad.renderer import Renderer
@@ -71,3 +71,25 @@ def add_gpudims(ctx:Renderer, s:UOp):
 pm_add_gpudims = PatternMatcher([
   (UPat(Ops.SINK, name="s"), add_gpudims),
 ])
+
+# *** split the outer loop of a CPU kernel across threads ***
+
+def add_threads(ctx:int, s:UOp):
+  if not isinstance(ki:=s.arg, KernelInfo) or ctx < 2: return None
+  s_topo = list(s.toposort())
+  if any(x.op is Ops.SPECIAL for x in s_topo): return None
+  const_ranges = [x for x in s_topo if x.op is Ops.RANGE and x.src[0].op is Ops.CONST]
+  # small kernels aren't worth waking up the workers for
+  if prod(x.src[0].arg for x in const_ranges) < getenv("CPU_THREADS_MIN", 8192): return None
+  # only LOOP axes are safe to split, each of their iterations writes different outputs
+  loops = sorted([x for x in const_ranges if x.arg < len(ki.axis_types) and ki.axis_types[x.arg] is AxisType.LOOP], key=lambda x: x.arg)
+  if not loops: return None
+  # the outermost loop that divides across the most cores: core_id*chunk + RANGE(chunk)
+  cores, rng = max([(max(d for d in range(1, ctx+1) if r.src[0].arg % d == 0), r) for r in loops], key=lambda x: x[0])
+  if cores < 2: return None
+  chunk = rng.src[0].arg // cores
+  return s.substitute({rng: UOp(Ops.SPECIAL, dtypes.int, (), ("core0", cores))*chunk + rng.replace(src=(rng.src[0].const_like(chunk),))})
+
+pm_add_threads = PatternMatcher([
+  (UPat(Ops.SINK, name="s"), add_threads),
+])
@@ -2,9 +2,10 @@ from __future__ import annotations
 from dataclasses import dataclass, replace, field
 from collections import defaultdict
 from typing import Optional, Any, Generic, TypeVar, Iterator
-import importlib, inspect, functools, pathlib, os, ctypes, ctypes.util, platform, contextlib, sys, re, atexit, pickle, decimal, time
+import importlib, inspect, functools, pathlib, os, ctypes, ctypes.util, platform, contextlib, sys, re, atexit, pickle, decimal, time, threading, queue
 from tinygrad.helpers import CI, OSX, LRU, getenv, diskcache_get, diskcache_put, DEBUG, GlobalCounters, flat_mv, from_mv, PROFILE, temp, mv_address, \
-                             cpu_time_execution, colored, Context, round_up, DISABLE_COMPILER_CACHE, ALLOW_DEVICE_USAGE, cpu_events, ProfileEvent
+                             cpu_time_execution, colored, Context, round_up, DISABLE_COMPILER_CACHE, ALLOW_DEVICE_USAGE, cpu_events, ProfileEvent, \
+                             LRU_BUDGET
 from tinygrad.dtype import DType, ImageDType, PtrDType, dtypes, _to_np_dtype
 from tinygrad.renderer import Renderer
 
@@ -238,27 +239,76 @@ class Allocator(Generic[DeviceType]):
   # def _offset(self, buf, size:int, offset:int):
   # def _transfer(self, dest, src, sz:int, src_dev, dest_dev):
 
+# 4 size classes per power of two, a rounded up buffer wastes at most 25%
+def size_class(size:int) -> int: return round_up(size, 64) if size <= 1024 else round_up(size, 1 << (size.bit_length() - 3))
+
 class LRUAllocator(Allocator, Generic[DeviceType]):
   """
   The LRU Allocator is responsible for caching buffers.
   It ensures that buffers are not freed until it is absolutely necessary, optimizing performance.
+  Once more than LRU_BUDGET bytes are cached, the least recently freed buffers are released.
+  With a budget, sizes are rounded up to a size class and a request is served by a cached buffer of its class or a view of one up to twice as
+  large, the rounding is counted in mem_used.
+  It's locked, the lowering thread of ASYNC_SCHEDULE allocates buffers and loads programs while the other threads free the buffers they drop.
   """
   def __init__(self, dev:DeviceType):
-    self.cache: dict[tuple[int, Optional[BufferSpec]], Any] = defaultdict(list)
+    # (size, options) -> {id(opaque): opaque}, the most recently freed is last
+    self.cache: dict[tuple[int, Optional[BufferSpec]], dict[int, Any]] = defaultdict(dict)
+    self.lru: dict[int, tuple[int, Optional[BufferSpec]]] = {}  # id(opaque) -> cache key, the least recently freed is first
+    self.views: dict[int, tuple[Any, int]] = {}  # id(view) -> (opaque, size) of the buffer it was made from
+    self.cached_bytes = 0
+    self.lock = threading.RLock()
     super().__init__(dev)
+  def _sized(self, options:Optional[BufferSpec]) -> bool:
+    if options is not None and (options.image is not None or options.external_ptr is not None or options.nolru): return False
+    return bool(LRU) and bool(LRU_BUDGET) and hasattr(self, "_offset")
+  def _pop(self, size:int, options:Optional[BufferSpec]):
+    if not (c:=self.cache.get((size, options))): return None
+    _, opaque = c.popitem()
+    del self.lru[id(opaque)]
+    self.cached_bytes -= size
+    return opaque
   def alloc(self, size:int, options:Optional[BufferSpec]=None):
-    if len(c := self.cache[(size, options)]): return c.pop()
-    try: return super().alloc(size, options)
-    except (RuntimeError, MemoryError):
-      self.free_cache()
-      return super().alloc(size, options)
+    with self.lock:
+      sz = size_class(size) if (sized:=self._sized(options)) else size
+      bsz, opaque = sz, self._pop(sz, options)
+      # a view of a larger cached buffer
+      while opaque is None and sized and bsz < 2*sz: opaque = self._pop(bsz:=size_class(bsz+1), options)
+      if opaque is not None: GlobalCounters.lru_hits += 1
+      else:
+        GlobalCounters.lru_misses += 1
+        bsz = sz
+        try: opaque = super().alloc(sz, options)
+        except (RuntimeError, MemoryError):
+          self.free_cache()
+          opaque = super().alloc(sz, options)
+      if bsz == size: return opaque
+      self.views[id(view:=self._offset(opaque, size, 0))] = (opaque, bsz)  # type: ignore[attr-defined]
+      GlobalCounters.mem_used += bsz - size
+      return view
   def free_cache(self):
-    for (sz,options),opaques in self.cache.items():
-      for opaque in opaques: super().free(opaque, sz, options)
-      opaques.clear()
+    with self.lock:
+      for (sz,options),opaques in self.cache.items():
+        for opaque in opaques.values(): super().free(opaque, sz, options)
+        opaques.clear()
+      self.lru.clear()
+      self.cached_bytes = 0
   def free(self, opaque:Any, size:int, options:Optional[BufferSpec]=None):
-    if LRU and (options is None or not options.nolru): self.cache[(size, options)].append(opaque)
-    else: super().free(opaque, size, options)
+    with self.lock:
+      if (v:=self.views.pop(id(opaque), None)) is not None:
+        # like in Buffer.deallocate, GlobalCounters is None when a buffer is freed during interpreter teardown
+        if GlobalCounters is not None: GlobalCounters.mem_used -= v[1] - size
+        opaque, size = v
+      if not LRU or (options is not None and options.nolru): return super().free(opaque, size, options)
+      self.cache[(size, options)][id(opaque)] = opaque
+      self.lru[id(opaque)] = (size, options)
+      self.cached_bytes += size
+      while LRU_BUDGET.value and self.cached_bytes > LRU_BUDGET.value:
+        GlobalCounters.lru_evicts += 1
+        sz, options = self.lru[oldest:=next(iter(self.lru))]
+        super().free(self.cache[(sz, options)].pop(oldest), sz, options)
+        del self.lru[oldest]
+        self.cached_bytes -= sz
 
 class _MallocAllocator(LRUAllocator['Compiled']):
   def _alloc(self, size:int, options:BufferSpec):
@@ -281,8 +331,34 @@ MallocAllocator = _MallocAllocator(None) # type: ignore
 # NOTE: MAP_JIT is added to mmap module in python 3.13
 MAP_JIT = 0x0800
 
+# CPUWorkers is a persistent pool of threads for kernels split across cores. ctypes releases the GIL while the native code runs
+class CPUWorkers:
+  def __init__(self):
+    self.queues: list[queue.SimpleQueue] = []
+    self.done: queue.SimpleQueue = queue.SimpleQueue()
+    self.lock = threading.Lock()
+  def _worker(self, q:queue.SimpleQueue):
+    while True:
+      fxn, args = q.get()
+      # an exception is raised on the calling thread, this thread keeps serving its queue
+      try:
+        fxn(*args)
+        self.done.put(None)
+      except BaseException as e: self.done.put(e)
+  def run(self, fxn, core_args:list[list]):
+    with self.lock:
+      while len(self.queues) < len(core_args) - 1:
+        self.queues.append(q:=queue.SimpleQueue[tuple[Any, list]]())
+        threading.Thread(target=self._worker, args=(q,), daemon=True).start()
+      for q,args in zip(self.queues, core_args[1:]): q.put((fxn, args))
+      # core 0 runs on the calling thread, the other cores are waited for even if it raises
+      try: fxn(*core_args[0])
+      finally: errs = [e for _ in core_args[1:] if (e:=self.done.get()) is not None]
+      if errs: raise errs[0]
+
 # CPUProgram is a jit/shellcode program that can be just mmapped and jumped to
 class CPUProgram:
+  workers = CPUWorkers()
   rt_lib = ctypes.CDLL(ctypes.util.find_library('System' if OSX else 'kernel32') if OSX or sys.platform == "win32" else 'libgcc_s.so.1')
 
   def __init__(self, name:str, lib:bytes):
@@ -315,15 +391,24 @@ class CPUProgram:
 
       self.fxn = ctypes.CFUNCTYPE(None)(mv_address(self.mem))
 
-  def __call__(self, *bufs, vals=(), wait=False):
-    args = list(bufs) + list(vals)
-    # NOTE: replace this by --target={host's triple}-elf in clang args once we only support macos sequoia and later.
-    # Apple relaxes abi requirement for stack arguments to always be at least 8 byte aligned on arm64
-    # https://developer.apple.com/documentation/xcode/writing-arm64-code-for-apple-platforms
-    # This hack is required because clang/llvm bug doesn't allow us to just use {host's triple}+'-elf' (relocation failures)
-    # The bug was fixed in https://github.com/llvm/llvm-project/commit/454cc36630296262cdb6360b60f90a64a97f7f1a but was only backported to xcode 16+
-    if platform.machine() == "arm64" and OSX: args = args[:8] + [ctypes.c_int64(a) if isinstance(a, int) else a for a in args[8:]]
-    return cpu_time_execution(lambda: self.fxn(*args), enable=wait)
+  # NOTE: replace this by --target={host's triple}-elf in clang args once we only support macos sequoia and later.
+  # Apple relaxes abi requirement for stack arguments to always be at least 8 byte aligned on arm64
+  # https://developer.apple.com/documentation/xcode/writing-arm64-code-for-apple-platforms
+  # This hack is required because clang/llvm bug doesn't allow us to just use {host's triple}+'-elf' (relocation failures)
+  # The bug was fixed in https://github.com/llvm/llvm-project/commit/454cc36630296262cdb6360b60f90a64a97f7f1a but was only backported to xcode 16+
+  @staticmethod
+  def arg(i:int, a):
+    return ctypes.c_int64(a) if i >= 8 and isinstance(a, int) and platform.machine() == "arm64" and OSX else a
+
+  def core_args(self, bufs, vals, global_size:Optional[tuple[int, ...]]=None) -> list[list]:
+    # kernels split across threads take the core id as the last argument, global_size[0] is the number of cores
+    return [[CPUProgram.arg(i, a) for i,a in enumerate(list(bufs) + list(vals) + ([core_id] if global_size is not None else []))]
+            for core_id in range(global_size[0] if global_size else 1)]
+
+  def __call__(self, *bufs, vals=(), global_size:Optional[tuple[int, ...]]=None, local_size:Optional[tuple[int, ...]]=None, wait=False):
+    core_args = self.core_args(bufs, vals, global_size)
+    if len(core_args) == 1: return cpu_time_execution(lambda: self.fxn(*core_args[0]), enable=wait)
+    return cpu_time_execution(lambda: CPUProgram.workers.run(self.fxn, core_args), enable=wait)
 
   def __del__(self):
     if sys.platform == 'win32': ctypes.windll.kernel32.VirtualFree(ctypes.c_void_p(self.mem), ctypes.c_size_t(0), 0x8000) #0x8000 - MEM_RELEASE
@@ -349,6 +434,8 @@ class Compiled:
   def __init__(self, device:str, allocator:Allocator, renderer:Optional[Renderer], compiler:Optional[Compiler], runtime, graph=None):
     self.device, self.allocator, self.compiler, self.runtime, self.graph = device, allocator, compiler or Compiler(), runtime, graph
     self.renderer = renderer or Renderer()
+    # held by the threads of ASYNC_SCHEDULE while they use the device, the queues of a device aren't used by two threads at once
+    self.lock = threading.RLock()
   def synchronize(self):
     """
     Synchronize all pending operations on the device.
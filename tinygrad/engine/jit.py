@@ -1,13 +1,14 @@
 from typing import TypeVar, Generic, Callable, Union, cast, Optional, Any
-import functools, collections
+import functools, collections, hashlib, pickle, marshal, io, weakref, types, enum
 from tinygrad.tensor import Tensor
 from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, JIT_BATCH_SIZE, dedup, partition, unwrap
+from tinygrad.helpers import ContextVar, diskcache_get, diskcache_put
 from tinygrad.device import Buffer, Compiled, Device, MultiBuffer
 from tinygrad.dtype import DType
 from tinygrad.uop.ops import UOp, Variable, sym_infer, Ops
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.engine.realize import ExecItem, capturing, ViewOp, BufferCopy, BufferXfer, CompiledRunner, Runner, Estimates
-from tinygrad.engine.memory import _internal_memory_planner
+from tinygrad.engine.memory import _internal_memory_planner, inplace_outputs
 from tinygrad.nn.state import get_parameters
 from dataclasses import dataclass
 from weakref import WeakKeyDictionary
@@ -207,6 +208,27 @@ class CapturedJit(Generic[ReturnType]):
     self._clear_inputs()
     return self.ret
 
+class JitArena:
+  # the intermediates of TinyJits that never run at the same time (like the prefill and the decode of an LLM) are planned into one buffer per
+  # device, the size of the largest jit's intermediates instead of the sum. when a new jit needs a bigger one, the others are moved to it
+  def __init__(self):
+    self.arenas: dict[str, Buffer] = {}
+    self.members: list[weakref.ref[CapturedJit]] = []
+
+  def add(self, captured:CapturedJit, old:dict[str, Buffer]):
+    moved = {old[dev]:arena for dev,arena in self.arenas.items() if dev in old and old[dev] is not arena}
+    self.members = [r for r in self.members if r() is not None]
+    if moved:
+      for c in cast(list[CapturedJit], [r() for r in self.members]):
+        new: dict[Buffer, Buffer] = {}
+        def rebase(b:Buffer|None) -> Buffer|None:
+          if b is None or b._base not in moved: return b
+          if b not in new: new[b] = Buffer(b.device, b.size, b.dtype, base=moved[b._base], offset=b.offset).ensure_allocated()
+          return new[b]
+        c.jit_cache = [ExecItem(ei.prg, [rebase(b) for b in ei.bufs], ei.metadata, ei.fixedvars) for ei in c.jit_cache]
+        c.__post_init__()
+    self.members.append(weakref.ref(captured))
+
 def _prepare_jit_inputs(args, kwargs):
   input_tensors: list[tuple[int|str, Tensor]] = [(name,t) for name,t in list(enumerate(args))+sorted(kwargs.items()) if t.__class__ is Tensor]
   names, tensors = [name for name,_ in input_tensors], [t for _,t in input_tensors]
@@ -221,18 +243,120 @@ def _prepare_jit_inputs(args, kwargs):
   st_vars_dtype_device = [(x[0], tuple(sorted(x[1].keys(), key=lambda v: v.expr)), x[2], x[3]) for x in st_varval_dtype_device]
   return input_buffers, var_vals, names, st_vars_dtype_device
 
+# what the function reads besides its Tensor inputs: the other args, its closure, the globals it names and the functions of its module that it
+# calls. only primitive values, Tensors, named functions, modules and classes and the objects holding them go in the diskcache key, anything else
+# (like an object without a __dict__ or a set) makes the jit uncacheable. the Tensors (like the weights) are found again by their path on load
+class _Uncacheable(Exception): pass
+def _code_names(code:types.CodeType) -> list[str]:
+  return list(code.co_names) + flatten([_code_names(c) for c in code.co_consts if isinstance(c, types.CodeType)])
+def _jit_state(fxn:Callable, args:tuple, kwargs:dict) -> tuple[list, dict[tuple, Tensor]]:
+  desc: list = []
+  tensors: dict[tuple, Tensor] = {}
+  seen: set[int] = set()
+  def walk(path:tuple, x:Any):
+    if isinstance(x, (int, float, complex, str, bytes, type(None), DType)): return desc.append((path, x))
+    if isinstance(x, enum.Enum): return desc.append((path, type(x).__module__, type(x).__qualname__, x.name))
+    if isinstance(x, UOp) and x.op in {Ops.DEFINE_VAR, Ops.BIND}: return desc.append((path, x.unbind()[0].arg if x.op is Ops.BIND else x.arg))
+    if id(x) in seen: return
+    seen.add(id(x))
+    if isinstance(x, Tensor):
+      tensors[path] = x
+      desc.append((path, tuple(s if isinstance(s, int) else (s.render(), s.vmin, s.vmax) for s in x.shape), x.dtype, x.device))
+    elif isinstance(x, (list, tuple)):
+      for i,v in enumerate(x): walk(path+(i,), v)
+    elif isinstance(x, dict):
+      for k,v in x.items():
+        if not isinstance(k, (int, str)): raise _Uncacheable(f"{path} has a {type(k).__qualname__} key")
+        walk(path+(k,), v)
+    elif isinstance(x, types.MethodType):
+      walk(path+("__self__",), x.__self__)
+      walk(path, x.__func__)
+    elif isinstance(x, types.FunctionType) and x.__module__ == getattr(fxn, "__module__", None):
+      desc.append((path, marshal.dumps(x.__code__)))
+      for name,cell in zip(x.__code__.co_freevars, x.__closure__ or ()):
+        try: walk(path+(name,), cell.cell_contents)
+        except ValueError: pass  # the cell isn't set yet
+      for name in _code_names(x.__code__):
+        if name in x.__globals__: walk(path+(name,), x.__globals__[name])
+    elif isinstance(x, (types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type)):
+      desc.append((path, getattr(x, "__module__", None), x.__qualname__ if hasattr(x, "__qualname__") else x.__name__))
+    # a jit changes when it runs, that doesn't change what this jit captures
+    elif isinstance(x, (TinyJit, CapturedJit, JitArena)): desc.append((path, type(x).__qualname__))
+    elif hasattr(x, "__dict__") and not isinstance(x, (Buffer, MultiBuffer, UOp)):
+      desc.append((path, type(x).__module__, type(x).__qualname__))
+      walk(path, vars(x))
+    else: raise _Uncacheable(f"{path} is a {type(x).__qualname__}")
+  walk(("fxn",), fxn)
+  walk(("args",), args)
+  walk(("kwargs",), kwargs)
+  return desc, tensors
+
+def _tensor_buffers(t:Tensor) -> list[Buffer]:
+  lbs: list[UOp] = list(t.uop.src) if t.uop.op is Ops.MULTI else [t.uop]
+  return flatten([rb.bufs if isinstance(rb:=lb.base.realized, MultiBuffer) else [rb] for lb in lbs if lb.base.realized is not None])
+
+# these don't change what gets captured
+JIT_DISKCACHE_IGNORE = {"DEBUG", "PROFILE", "TRACEMETA", "CAPTURING", "CACHELEVEL", "VIZ"}
+def _jit_diskcache_key(fxn:Callable, names:list[int|str], st_vars_dtype_device:list, state:list) -> str:
+  ctx = sorted((k, v.value) for k,v in ContextVar._cache.items() if k not in JIT_DISKCACHE_IGNORE)
+  return hashlib.sha256(pickle.dumps((getattr(fxn, "__module__", None), getattr(fxn, "__qualname__", type(fxn).__qualname__),
+    names, str(st_vars_dtype_device), state, ctx, getenv("JITBEAM", BEAM.value)))).hexdigest()
+
+# only the kernels and the plan are stored. the buffers of the Tensors the function reads are stored as their path and the ones it writes first
+# without their data. UNIQUE numbers are per process, the loaded ones get fresh numbers so they can't alias the Tensors of the loading process
+class _JitPickler(pickle.Pickler):
+  def __init__(self, file, params:dict[Buffer, tuple]):
+    super().__init__(file)
+    self.params = params
+  def persistent_id(self, obj):
+    if isinstance(obj, Buffer) and obj in self.params: return (*self.params[obj], obj.device, obj.size, obj.dtype)
+    return None
+  def reducer_override(self, obj):
+    if isinstance(obj, UOp) and obj.op is Ops.UNIQUE: return UOp.unique, ()
+    if isinstance(obj, Buffer) and obj._base is None and obj.device != "NPY":
+      return Buffer, (obj.device, obj.size, obj.dtype, None, obj.options, None, obj.uop_refcount)
+    return NotImplemented
+class _JitUnpickler(pickle.Unpickler):
+  def __init__(self, file, tensors:dict[tuple, Tensor]):
+    super().__init__(file)
+    self.tensors = tensors
+  def persistent_load(self, pid):
+    path, i, device, size, dtype = pid
+    if (t:=self.tensors.get(path)) is None: raise pickle.UnpicklingError(f"no Tensor at {path}")
+    if not t.uop.is_realized: t.realize()
+    if i >= len(bufs:=_tensor_buffers(t)) or (bufs[i].device, bufs[i].size, bufs[i].dtype) != (device, size, dtype):
+      raise pickle.UnpicklingError(f"the Tensor at {path} doesn't match")
+    return bufs[i]
+
+def _pickle_captured(captured:CapturedJit, tensors:dict[tuple, Tensor], external:set[Buffer], input_buffers:list[Buffer]) -> bytes|None:
+  params = {b:(path, i) for path,t in reversed(tensors.items()) for i,b in enumerate(_tensor_buffers(t))}
+  outputs = {b for t in get_parameters(captured.ret) for b in _tensor_buffers(t)}
+  if len(unknown:=external - set(params) - outputs - set(input_buffers)):
+    if DEBUG >= 1: print(f"JIT not stored in diskcache, {len(unknown)} of the buffers it reads aren't reachable from the function")
+    return None
+  _JitPickler(buf:=io.BytesIO(), params).dump(captured)
+  return buf.getvalue()
+
 class TinyJit(Generic[ReturnType]):
-  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False, optimize=False):
+  def __init__(self, fxn:Optional[Callable[..., ReturnType]], captured:Optional[CapturedJit]=None, prune=False, optimize=False, diskcache=False,
+               arena:Optional[JitArena]=None):
     assert fxn or captured, "need either a function or a CapturedJit"
     self.fxn = fxn
     self.captured: Optional[CapturedJit] = captured
     self.cnt: int = 2 if self.fxn is None else 0
     self.prune = prune
     self.optimize = optimize
+    # store the CapturedJit in the diskcache so a new process replays on the first call. the Tensors the function reads (like weights) must be
+    # reachable from its args, closure or globals, the loaded JIT reads the ones of the new process
+    self.diskcache = diskcache
+    # share the memory of the intermediates with the other jits of the arena, they must not run at the same time as this one
+    self.arena = arena
 
   def add_buffer(self, b:Buffer) -> Buffer:
     if found:=self._buffer_replace.get(b, None): return found
-    if b.is_allocated() or b.uop_refcount > 0: return b
+    if b.is_allocated() or b.uop_refcount > 0:
+      self._external.add(b.base)
+      return b
     if b._base is not None:
       self._buffer_replace[b] = ret = Buffer(b.device, b.size, b.dtype, base=self.add_buffer(b._base), offset=b.offset)
     else:
@@ -261,6 +385,20 @@ class TinyJit(Generic[ReturnType]):
 
   def __call__(self, *args, **kwargs) -> ReturnType:
     input_buffers, var_vals, names, st_vars_dtype_device = _prepare_jit_inputs(args, kwargs)
+    cache_key: str|None = None
+    if JIT and self.diskcache and self.cnt < 2 and self.fxn is not None:
+      try:
+        state, tensors = _jit_state(self.fxn, args, kwargs)
+        cache_key = _jit_diskcache_key(self.fxn, names, st_vars_dtype_device, state)
+      except _Uncacheable as e:
+        if DEBUG >= 1: print(f"JIT not cached in diskcache, {e}")
+      if cache_key is not None and (data:=diskcache_get("jit", cache_key)) is not None:
+        try:
+          captured = _JitUnpickler(io.BytesIO(data), tensors).load()
+          if DEBUG >= 1: print(f"JIT loaded {len(captured.jit_cache)} kernels from diskcache")
+          self.captured, self.cnt = captured, 2
+        except pickle.UnpicklingError as e:
+          if DEBUG >= 1: print(f"JIT not loaded from diskcache, {e}")
     if not JIT or self.cnt == 0:
       # jit ignore
       assert self.fxn is not None
@@ -273,6 +411,7 @@ class TinyJit(Generic[ReturnType]):
       if capturing: raise RuntimeError(f"having TinyJit inside another TinyJit is not supported {len(capturing)=} {capturing=}")
       self._jit_cache: list[ExecItem] = []
       self._buffer_replace: WeakKeyDictionary[Buffer, Buffer] = WeakKeyDictionary()
+      self._external: set[Buffer] = set()
       # TODO: should we always disable the memory planner here? it must be off for prune
       with Context(BEAM=getenv("JITBEAM", BEAM.value), NO_MEMORY_PLANNER=int(self.prune)):
         capturing.append(self)
@@ -281,8 +420,8 @@ class TinyJit(Generic[ReturnType]):
           if len(params:=get_parameters(ret)): Tensor.realize(params[0], *params[1:])
         except Exception as e: raise e
         finally: capturing.clear()
-      jit_cache = self._jit_cache
-      del self._buffer_replace, self._jit_cache
+      jit_cache, external = self._jit_cache, self._external
+      del self._buffer_replace, self._jit_cache, self._external
       assert len(jit_cache), "didn't JIT anything!"
       if DEBUG >= 1: print(f"JIT captured {len(jit_cache)} kernels with {len(input_buffers)} inputs")
 
@@ -310,7 +449,10 @@ class TinyJit(Generic[ReturnType]):
       # memory planning (optional)
       # Exclude buffers involved in transfer ops to preserve parallelism.
       noopt_buffers = {b for ji in jit_cache if isinstance(ji.prg, BufferXfer) for b in ji.bufs}
-      assigned = _internal_memory_planner([cast(list[Buffer], item.bufs) for item in jit_cache], noopt_buffers, debug_prefix="JIT ")
+      old_arenas = dict(self.arena.arenas) if self.arena is not None else {}
+      inplace = [inplace_outputs(ji.prg.p.ast, ji.bufs) if isinstance(ji.prg, CompiledRunner) else {} for ji in jit_cache]
+      assigned = _internal_memory_planner([cast(list[Buffer], item.bufs) for item in jit_cache], noopt_buffers, debug_prefix="JIT ",
+                                          inplace=inplace, arenas=self.arena.arenas if self.arena is not None else None)
       jit_cache = [ExecItem(item.prg, [assigned.get(b,b).ensure_allocated() for b in item.bufs if b is not None],
                             item.metadata, item.fixedvars) for item in jit_cache]
 
@@ -320,6 +462,10 @@ class TinyJit(Generic[ReturnType]):
       # set this for next run
       self.captured = CapturedJit(ret, jit_cache, input_replace, extra_view_inputs, names, st_vars_dtype_device)
       if self.optimize: self.captured.replan_buffers_memory_layout()
+      if self.arena is not None: self.arena.add(self.captured, old_arenas)
+      # the onetime kernels of prune aren't stored, their outputs would be stale when the weights change
+      if cache_key is not None and not self.prune and (data:=_pickle_captured(self.captured, tensors, external, input_buffers)) is not None:
+        diskcache_put("jit", cache_key, data)
     elif self.cnt >= 2:
       # jit exec
       assert self.captured is not None
@@ -1,15 +1,54 @@
-from typing import cast
+from typing import cast, Sequence
 from collections import defaultdict
 from tinygrad.engine.schedule import ScheduleItem
 from tinygrad.device import Device, Buffer
 from tinygrad.helpers import NO_MEMORY_PLANNER, dedup, DEBUG, round_up
-from tinygrad.uop.ops import Ops
+from tinygrad.uop.ops import Ops, UOp
 from tinygrad.dtype import dtypes, ImageDType
 from tinygrad.runtime.support.memory import TLSFAllocator
 
 # **************** memory planning ****************
 
-def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ignore_checks=False, debug_prefix="") -> dict[Buffer, Buffer]:
+def inplace_outputs(ast:UOp, bufs:Sequence[Buffer|None]) -> dict[Buffer, tuple[Buffer, ...]]:
+  # a kernel with one store can write its output over an input it reads through the same contiguous view, each element is read by the thread
+  # that writes it before it's written. the planner does it if the kernel is the last use of the input and they have the same size
+  if ast.op is not Ops.SINK or len(ast.src) != 1 or (store:=ast.src[0]).op is not Ops.STORE or (out:=store.src[0]).op is not Ops.VIEW: return {}
+  if out.src[0].op is not Ops.DEFINE_GLOBAL or not out.arg.contiguous or (obuf:=bufs[out.src[0].arg]) is None: return {}
+  views: defaultdict[int, set[UOp]] = defaultdict(set)
+  for u in (topo:=ast.toposort()):
+    if u.op is Ops.VIEW and u.src and u.src[0].op is Ops.DEFINE_GLOBAL: views[u.src[0].arg].add(u)
+    elif any(s.op is Ops.DEFINE_GLOBAL for s in u.src): return {}
+  if any(u.op is Ops.LOAD and u.src[0].src[0] is out.src[0] for u in topo): return {}
+  srcs = tuple(b for g,vs in views.items() if g != out.src[0].arg and (b:=bufs[g]) is not None and b is not obuf and all(v.arg == out.arg for v in vs)
+               and sum(x is not None and x.base is b.base for x in bufs) == 1)
+  return {obuf: srcs} if srcs else {}
+
+def place_blocks(blocks:list[list[int]]) -> tuple[list[int], int, int]:
+  # blocks are [start, end, size], live from step start until before step end. returns the offsets, the arena size and the peak of live bytes.
+  # TLSF in timeline order is the first placement. if that leaves holes the blocks are compacted greedy by size: the biggest first, each at the
+  # lowest offset that's free over its lifetime. the smaller arena wins
+  live, peak = 0, 0
+  for _,sz in sorted([(st, sz) for st,_,sz in blocks] + [(en, -sz) for _,en,sz in blocks]): peak = max(peak, live:=live+sz)
+  tlsf = TLSFAllocator(1 << 44, block_size=0x1000, lv2_cnt=32)
+  offsets = [0]*len(blocks)
+  for _,is_open,i in sorted([(st, True, i) for i,(st,_,_) in enumerate(blocks)] + [(en, False, i) for i,(_,en,_) in enumerate(blocks)]):
+    if is_open: offsets[i] = tlsf.alloc(blocks[i][2])
+    else: tlsf.free(offsets[i])
+  if (sz:=max((off+b[2] for off,b in zip(offsets, blocks)), default=0)) <= peak: return offsets, sz, peak
+  compact, placed = [0]*len(blocks), list[int]()
+  for i in sorted(range(len(blocks)), key=lambda i: (-blocks[i][2], blocks[i][0])):
+    st, en, bsz = blocks[i]
+    for lo,hi in sorted((compact[j], compact[j]+blocks[j][2]) for j in placed if blocks[j][0] < en and st < blocks[j][1]):
+      if compact[i] + bsz <= lo: break
+      compact[i] = max(compact[i], hi)
+    placed.append(i)
+  if (csz:=max(off+b[2] for off,b in zip(compact, blocks))) < sz: return compact, csz, peak
+  return offsets, sz, peak
+
+def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ignore_checks=False, debug_prefix="",
+                             inplace:list[dict[Buffer, tuple[Buffer, ...]]]|None=None, arenas:dict[str, Buffer]|None=None) -> dict[Buffer, Buffer]:
+  # inplace[i] are the outputs of step i that can take the memory of an input (see inplace_outputs). with arenas, the sub-allocations are planned
+  # from offset 0 of these buffers, an arena that's too small is replaced by a bigger one in the dict
   if NO_MEMORY_PLANNER: return {}
   first_appearance, last_appearance, buf_to_opt = {}, {}, set()
   for i,u in enumerate(buffers):
@@ -24,24 +63,49 @@ def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ign
   buffer_requests = sorted([((first_appearance[buf], True), buf) for buf in first_appearance.keys()] + \
                            [((last_appearance[buf] + 1, False), buf) for buf in first_appearance.keys()], key=lambda x: x[0])
 
-  # Try to suballocate from a shared buffer managed by global_planner using TLSFAllocator.
+  # Blocks of the shared buffer of each device: [start, end, size], an output written in place extends the block of its input.
   # Also track buffer replacements for buffers that do not support suballocation.
   buffer_replace:dict[Buffer, tuple[Buffer|None, int|None]] = {}
   reuse_buffers:dict[tuple, list[Buffer]] = defaultdict(list)
-  global_planner:dict[str, tuple[int, TLSFAllocator]] = defaultdict(lambda: (0, TLSFAllocator(1 << 44, block_size=0x1000, lv2_cnt=32)))
-  for (_, is_open_ev), buf in buffer_requests:
+  blocks:defaultdict[str, list[list[int]]] = defaultdict(list)
+  block_of:dict[Buffer, int] = {}
+  # inputs whose memory is taken by an output of their last step, the output frees it
+  taken:set[Buffer] = set()
+  for (tm, is_open_ev), buf in buffer_requests:
+    if is_open_ev and inplace is not None and (src:=next((x for x in inplace[first_appearance[buf]].get(buf, ()) if x in first_appearance and
+        x not in taken and last_appearance[x] == first_appearance[buf] and (x.device, x.dtype, x.options, x.nbytes) == \
+        (buf.device, buf.dtype, buf.options, buf.nbytes)), None)) is not None:
+      if src in block_of: block_of[buf] = block_of[src]
+      else: buffer_replace[buf] = buffer_replace[src]
+      taken.add(src)
+      continue
+    if not is_open_ev and buf in taken: continue
     # Check if suballocation is possible for the given buffer and device.
     if hasattr(Device[buf.device].allocator, "_offset") and not isinstance(buf.dtype, ImageDType):
-      if is_open_ev: buffer_replace[buf] = (None, global_planner[buf.device][1].alloc(round_up(buf.nbytes, 0x1000)))
-      else: global_planner[buf.device][1].free(cast(int, buffer_replace[buf][1]))
-      global_planner[buf.device] = (max(global_planner[buf.device][0], buffer_replace[buf][1] + buf.nbytes), global_planner[buf.device][1])
+      if is_open_ev: blocks[buf.device].append([tm, tm, round_up(buf.nbytes, 0x1000)])
+      block_of[buf] = len(blocks[buf.device])-1 if is_open_ev else block_of[buf]
+      blocks[buf.device][block_of[buf]][1] = tm
     else:
       key = (buf.device, buf.dtype, buf.options, buf.nbytes)
       if is_open_ev: buffer_replace[buf] = (reuse_buffers[key].pop(), None) if key in reuse_buffers and len(reuse_buffers[key]) > 0 else (buf, None)
       else: reuse_buffers[key].append(cast(Buffer, buffer_replace[buf][0]))
 
+  # Place the blocks in the shared buffer of each device.
+  global_planner:dict[str, tuple[int, int]] = {}
+  for dev,dblocks in blocks.items():
+    offsets, sz, peak = place_blocks(dblocks)
+    global_planner[dev] = (sz, peak)
+    for buf,i in block_of.items():
+      if buf.device == dev: buffer_replace[buf] = (None, offsets[i])
+
   # Allocate global buffers based on the memory planner.
-  global_buffers = {dev: Buffer(dev, round_up(sz, 0x1000), dtypes.int8) for dev, (sz, _) in global_planner.items()}
+  global_buffers = {dev: Buffer(dev, round_up(sz, 0x1000), dtypes.int8) for dev, (sz, _) in global_planner.items()
+                    if arenas is None or dev not in arenas or arenas[dev].nbytes < sz}
+  if arenas is not None:
+    for dev,arena in arenas.items():
+      if dev in global_buffers: global_buffers[dev] = Buffer(dev, max(global_buffers[dev].nbytes, arena.nbytes), dtypes.int8)
+    global_buffers = arenas | global_buffers
+    arenas.update(global_buffers)
   buffer_resolve:dict[Buffer, tuple[Buffer, int|None]] = {buf: (base or global_buffers[buf.device], off) for buf,(base,off) in buffer_replace.items()}
 
   # Assign buffers. First, assign full buffers (not sub-buffers).
@@ -56,9 +120,11 @@ def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ign
       assigned[buf] = Buffer(buf.device, buf.size, buf.dtype, base=(pbuf:=assigned.get(buf.base, buf.base)).base, offset=pbuf.offset+buf.offset)
 
   if DEBUG >= 1:
-    ak, av = dedup(x for x in assigned.keys() if x._base is None),dedup(x for x in assigned.values() if x._base is None)+list(global_buffers.values())
+    ak, av = dedup(x for x in assigned.keys() if x._base is None),dedup(x for x in assigned.values() if x._base is None)+ \
+      [global_buffers[dev] for dev in global_planner]
     omem, nmem = sum([x.nbytes for x in ak])/1e6, sum([x.nbytes for x in av])/1e6
-    if omem != nmem: print(f"{debug_prefix}memory reduced from {omem:.2f} MB -> {nmem:.2f} MB,", f"{len(ak)} -> {len(av)} bufs")
+    if omem != nmem: print(f"{debug_prefix}memory reduced from {omem:.2f} MB -> {nmem:.2f} MB,", f"{len(ak)} -> {len(av)} bufs" + \
+                           "".join(f", {dev} arena {sz/1e6:.2f} MB for {peak/1e6:.2f} MB live" for dev,(sz,peak) in global_planner.items()))
 
   return assigned
 
@@ -1,10 +1,13 @@
 from typing import Optional, cast, Generator
-import time, pprint
+import time, pprint, pickle, signal, atexit, multiprocessing, multiprocessing.pool, threading, queue, sys, contextlib
+from concurrent.futures import ThreadPoolExecutor, Future
+from multiprocessing.pool import AsyncResult
 from dataclasses import dataclass, replace, field
 from tinygrad.helpers import all_same, colored, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, TRACEMETA, TracingKey
-from tinygrad.helpers import DEVECTORIZE, time_to_str, VALIDATE_WITH_CPU, getenv
+from tinygrad.helpers import DEVECTORIZE, time_to_str, VALIDATE_WITH_CPU, getenv, CPU_THREADS, Context, ContextVar
+from tinygrad.helpers import COMPILE_WORKERS, COMPILE_WORKERS_MIN, ASYNC_SCHEDULE, JOINT_BEAM
 from tinygrad.uop.ops import Ops, PatternMatcher, UOp, UPat, Variable, sym_infer, graph_rewrite, print_uops, track_rewrites
-from tinygrad.device import Device, Buffer
+from tinygrad.device import Device, Buffer, Compiler
 from tinygrad.renderer import Renderer, ProgramSpec, Estimates
 from tinygrad.engine.schedule import ScheduleItem
 from tinygrad.opt import get_optimized_ast
@@ -44,8 +47,10 @@ def get_program(ast:UOp, renderer:Renderer) -> ProgramSpec:
   if DEBUG >= 6: print_uops(uops)
   src = renderer.render(uops)
 
+  # host kernels only have a launch size if they were split across threads
+  launch = renderer.has_local or (renderer.has_threads and any(u.op is Ops.SPECIAL for u in uops))
   return ProgramSpec(uops[-1].arg.name, src, renderer.device, ast, uops,
-                     global_size=[1,1,1] if renderer.has_local else None, local_size=[1,1,1] if renderer.has_local else None)
+                     global_size=[1,1,1] if launch else None, local_size=[1,1,1] if launch else None)
 
 # **************** Runners ****************
 
@@ -65,7 +70,10 @@ class CompiledRunner(Runner):
     self.p:ProgramSpec = p
     self.lib:bytes = precompiled if precompiled is not None else Device[p.device].compiler.compile_cached(p.src)
     if DEBUG >= 7: Device[p.device].compiler.disassemble(self.lib)
-    self._prg = Device[p.device].runtime(p.function_name, self.lib) if prg is None else prg
+    if prg is None:
+      # loading can copy the program to the device, that happens on the lowering thread of ASYNC_SCHEDULE
+      with Device[p.device].lock: prg = Device[p.device].runtime(p.function_name, self.lib)
+    self._prg = prg
     super().__init__(p.name, p.device, p.estimates)
 
   def __reduce__(self): return self.__class__, (self.p, self.lib)
@@ -75,7 +83,8 @@ class CompiledRunner(Runner):
     if global_size is not None and local_size is None and all_int(self.p.global_size): # type: ignore[arg-type]
       # TODO: this is copied from get_program
       from tinygrad.opt.search import optimize_local_size
-      local_size = optimize_local_size(self._prg, global_size, rawbufs)
+      key = {"src": self.p.src, "global_size": ",".join(map(str, global_size)), "device": self.p.device}
+      local_size = optimize_local_size(self._prg, global_size, rawbufs, Device[self.p.device].renderer.local_max, key)
       global_size = [g//l if g%l == 0 else g/l for g,l in zip(global_size, local_size)]
       self.p = replace(self.p, global_size=global_size, local_size=local_size)
     lra = {}
@@ -122,12 +131,14 @@ class BufferXfer(BufferCopy):
 # **************** method cache ****************
 
 method_cache: dict[tuple[str, bytes, tuple[int, ...], bool], CompiledRunner] = {}
-def get_runner(device:str, ast:UOp) -> CompiledRunner:
+def method_cache_keys(device:str, ast:UOp) -> tuple[tuple[str, bytes, tuple[int, ...], bool], tuple[str, bytes, tuple[int, ...], bool]]:
   # TODO: this should be all context relevant to rendering
-  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value)
-  ckey = (device, ast.key, context, False)
+  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value, CPU_THREADS.value)
+  return (device, ast.key, context, False), (device.split(":")[0], ast.key, context, True)
+
+def get_runner(device:str, ast:UOp) -> CompiledRunner:
+  ckey, bkey = method_cache_keys(device, ast)
   if cret:=method_cache.get(ckey): return cret
-  bkey = (device.split(":")[0], ast.key, context, True)
   if bret:=method_cache.get(bkey):
     method_cache[ckey] = ret = CompiledRunner(replace(bret.p, device=device), bret.lib)
   else:
@@ -135,6 +146,44 @@ def get_runner(device:str, ast:UOp) -> CompiledRunner:
     method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device))
   return ret
 
+# **************** parallel compile ****************
+
+def _init_compile_worker():
+  Context(ALLOW_DEVICE_USAGE=0, VIZ=0).__enter__()
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _compile_ast(ast:UOp, renderer:Renderer, compiler:Compiler, ctx:dict[str, int]) -> tuple[ProgramSpec, bytes]:
+  with Context(**{k:v for k,v in ctx.items() if k in ContextVar._cache}):
+    p = get_program(ast, renderer)
+    return p, compiler.compile_cached(p.src)
+
+compile_pool: Optional[multiprocessing.pool.Pool] = None
+_picklable_devices: dict[str, bool] = {}
+def compile_schedule(schedule:list[ScheduleItem]) -> dict[tuple, AsyncResult]:
+  """Start compiling the kernels of the schedule that aren't in the method cache in a pool of COMPILE_WORKERS processes."""
+  global compile_pool
+  # BEAM needs the device and has its own pool, VIZ has to see the rewrites
+  if BEAM or getenv("VIZ") or COMPILE_WORKERS.value < 2: return {}
+  misses: dict[tuple, tuple[str, UOp]] = {}
+  for si in schedule:
+    if si.ast.op is not Ops.SINK or (dname:=si.bufs[0].device) in _picklable_devices and not _picklable_devices[dname]: continue
+    ckey, bkey = method_cache_keys(dname, si.ast)
+    if ckey in method_cache or bkey in method_cache: continue
+    if dname not in _picklable_devices:
+      try: _picklable_devices[dname] = bool(pickle.dumps((Device[dname].renderer, Device[dname].compiler)))
+      except Exception: _picklable_devices[dname] = False
+      if not _picklable_devices[dname]: continue
+    misses.setdefault(bkey, (dname, si.ast))
+  # starting the pool isn't free
+  if len(misses) < COMPILE_WORKERS_MIN.value: return {}
+  if compile_pool is None:
+    # a forked worker doesn't import __main__ again, so a script without an if __name__ == "__main__" guard doesn't run in it
+    compile_pool = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn").Pool(COMPILE_WORKERS.value, _init_compile_worker)
+    atexit.register(compile_pool.close)
+  ctx = {k:v.value for k,v in ContextVar._cache.items() if k not in {"ALLOW_DEVICE_USAGE", "VIZ"}}
+  return {bkey:compile_pool.apply_async(_compile_ast, (ast, Device[dname].renderer, Device[dname].compiler, ctx))
+          for bkey,(dname,ast) in misses.items()}
+
 # **************** lowering functions ****************
 
 @dataclass(frozen=True)
@@ -147,20 +196,21 @@ class ExecItem:
     var_vals = self.fixedvars if _var_vals is None else (_var_vals|self.fixedvars)
     bufs = [cast(Buffer, x) for x in self.bufs] if jit else [cast(Buffer, x).ensure_allocated() for x in self.bufs]
     et = self.prg(bufs, var_vals, wait=wait or DEBUG >= 2)
-    if do_update_stats:
-      GlobalCounters.kernel_count += 1
-      GlobalCounters.global_ops += (op_est:=sym_infer(self.prg.estimates.ops, var_vals))
-      GlobalCounters.global_mem += (mem_est:=sym_infer(self.prg.estimates.mem, var_vals))
-      if et is not None: GlobalCounters.time_sum_s += et
-      if DEBUG >= 2:
-        lds_est = sym_infer(self.prg.estimates.lds, var_vals)
-        mem_est = min(mem_est, lds_est)   # there can't be more memory accessed than loads/stores. remove this when symbolic is fixed
-        ptm = colored(time_to_str(et, w=9), "yellow" if et > 0.01 else None) if et is not None else ""
-        print(f"{colored(f'*** {self.prg.device[:7]:7s} {GlobalCounters.kernel_count:4d}', 'magenta' if jit else ('green' if self.prg.first_run else None))} {self.prg.display_name+' '*(41-ansilen(self.prg.display_name))} arg {len(bufs):2d} mem {GlobalCounters.mem_used/1e9:5.2f} GB " +  # noqa: E501
-              (str() if et is None else f"tm {ptm}/{GlobalCounters.time_sum_s*1e3:9.2f}ms ({op_est/((et or 1e-20)*1e9):9.2f} GFLOPS {mem_est/((et or 1e-20)*1e9):6.1f}|{lds_est/((et or 1e-20)*1e9):<7.1f} GB/s)" +  # noqa: E501
-               f" {[repr(m) if TRACEMETA >= 2 else str(m) for m in self.metadata] if self.metadata else ''}"))
-      self.prg.first_run = False
+    if do_update_stats: self.update_stats(var_vals, et, jit)
     return et
+  def update_stats(self, var_vals:dict[Variable, int], et:Optional[float], jit=False):
+    GlobalCounters.kernel_count += 1
+    GlobalCounters.global_ops += (op_est:=sym_infer(self.prg.estimates.ops, var_vals))
+    GlobalCounters.global_mem += (mem_est:=sym_infer(self.prg.estimates.mem, var_vals))
+    if et is not None: GlobalCounters.time_sum_s += et
+    if DEBUG >= 2:
+      lds_est = sym_infer(self.prg.estimates.lds, var_vals)
+      mem_est = min(mem_est, lds_est)   # there can't be more memory accessed than loads/stores. remove this when symbolic is fixed
+      ptm = colored(time_to_str(et, w=9), "yellow" if et > 0.01 else None) if et is not None else ""
+      print(f"{colored(f'*** {self.prg.device[:7]:7s} {GlobalCounters.kernel_count:4d}', 'magenta' if jit else ('green' if self.prg.first_run else None))} {self.prg.display_name+' '*(41-ansilen(self.prg.display_name))} arg {len(self.bufs):2d} mem {GlobalCounters.mem_used/1e9:5.2f} GB " +  # noqa: E501
+            (str() if et is None else f"tm {ptm}/{GlobalCounters.time_sum_s*1e3:9.2f}ms ({op_est/((et or 1e-20)*1e9):9.2f} GFLOPS {mem_est/((et or 1e-20)*1e9):6.1f}|{lds_est/((et or 1e-20)*1e9):<7.1f} GB/s)" +  # noqa: E501
+             f" {[repr(m) if TRACEMETA >= 2 else str(m) for m in self.metadata] if self.metadata else ''}"))
+    self.prg.first_run = False
 
 # NOTE: ctx is the buffers
 si_lowerer = PatternMatcher([
@@ -174,9 +224,15 @@ def lower_schedule_item(si:ScheduleItem) -> ExecItem:
   return ExecItem(*cast(tuple[Runner,list], si_lowerer.rewrite(si.ast, si.bufs)), si.metadata, si.fixedvars)
 
 def lower_schedule(schedule:list[ScheduleItem]) -> Generator[tuple[ScheduleItem, ExecItem], None, None]:
+  # kernels compile in the background, an item runs as soon as its kernel is ready
+  compiling = compile_schedule(schedule)
   while len(schedule):
     si = schedule.pop(0)
-    try: yield (si, lower_schedule_item(si))
+    try:
+      if si.ast.op is Ops.SINK and (res:=compiling.pop((bkey:=method_cache_keys(si.bufs[0].device, si.ast))[1], None)) is not None:
+        p, lib = res.get()
+        method_cache[bkey[0]] = method_cache[bkey[1]] = CompiledRunner(replace(p, device=si.bufs[0].device), lib)
+      yield (si, lower_schedule_item(si))
     except Exception as e:
       if DEBUG >= 2:
         print(f"error lowering {si.ast.op}")
@@ -188,7 +244,69 @@ def lower_schedule(schedule:list[ScheduleItem]) -> Generator[tuple[ScheduleItem,
 
 capturing: list = []  # put classes with an add method in here
 
+@contextlib.contextmanager
+def _device_locks(bufs:list[Optional[Buffer]]):
+  with contextlib.ExitStack() as stack:
+    # in the same order on every thread
+    for d in sorted({cast(Buffer, b).device for b in bufs}): stack.enter_context(Device[d].lock)
+    yield
+
+def _lower_ahead(schedule:list[ScheduleItem], q:queue.Queue, stop:threading.Event):
+  try:
+    for si, ei in lower_schedule(schedule):
+      with _device_locks(ei.bufs):
+        for b in ei.bufs: cast(Buffer, b).ensure_allocated()
+      q.put((si, ei))
+      if stop.is_set(): return
+    q.put(None)
+  except Exception as e: q.put(e)
+
+def _run_copy(ei:ExecItem, var_vals:dict[Variable, int]) -> Optional[float]:
+  with _device_locks(ei.bufs): return ei.run(var_vals, do_update_stats=False)
+
+copy_executor: Optional[ThreadPoolExecutor] = None
+def run_schedule_async(schedule:list[ScheduleItem], var_vals:dict[Variable, int], do_update_stats=True):
+  """
+  Run the schedule while a thread lowers and allocates up to ASYNC_SCHEDULE items ahead.
+
+  The dependencies come from the base buffers of the items. A copy that doesn't touch a buffer used by compute dispatched before it runs in a
+  copy thread, an item waits for the in flight copies that share a buffer with it. A thread holds the locks of the devices it uses, so a copy
+  runs alongside the compute on the other devices.
+  """
+  global copy_executor
+  if copy_executor is None: copy_executor = ThreadPoolExecutor(1, thread_name_prefix="tinygrad_copy")
+  q: queue.Queue = queue.Queue(ASYNC_SCHEDULE.value)
+  threading.Thread(target=_lower_ahead, args=(schedule, q, stop:=threading.Event()), daemon=True).start()
+  copies: dict[Future, tuple[ExecItem, set[Buffer]]] = {}
+  computed: set[Buffer] = set()
+  def wait(fs:list[Future]):
+    for f in fs:
+      ei, _ = copies.pop(f)
+      et = f.result()
+      if do_update_stats: ei.update_stats(var_vals|ei.fixedvars, et)
+  try:
+    while (item:=q.get()) is not None:
+      if isinstance(item, Exception): raise item
+      si, ei = item
+      bufs = {cast(Buffer, b).base for b in ei.bufs}
+      wait([f for f,(_,fbufs) in copies.items() if fbufs & bufs])
+      if isinstance(ei.prg, BufferCopy) and not isinstance(ei.prg, BufferXfer) and not bufs & computed:
+        copies[copy_executor.submit(_run_copy, ei, var_vals)] = (ei, bufs)
+      else:
+        with _device_locks(ei.bufs): ei.run(var_vals, do_update_stats=do_update_stats)
+        computed |= bufs
+  finally:
+    stop.set()
+    while not q.empty(): q.get_nowait()
+    wait(list(copies))
+
 def run_schedule(schedule:list[ScheduleItem], var_vals:Optional[dict[Variable, int]]=None, do_update_stats=True):
+  if JOINT_BEAM and not NOOPT:
+    from tinygrad.opt.joint import optimize_schedule
+    schedule = optimize_schedule(schedule, var_vals or {})
+  # NOTE: BEAM installs signal handlers, it has to lower in the main thread. the jit captures in order
+  if ASYNC_SCHEDULE and not VALIDATE_WITH_CPU and not BEAM and not (len(capturing) and CAPTURING):
+    return run_schedule_async(schedule, var_vals or {}, do_update_stats)
   for si, ei in lower_schedule(schedule):
     if len(capturing) and CAPTURING: capturing[0].add(ei)
     if VALIDATE_WITH_CPU and si.ast.op is Ops.SINK:
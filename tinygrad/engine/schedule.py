@@ -1,9 +1,11 @@
-from typing import cast
+from typing import cast, Optional
+import hashlib, heapq, itertools, math
 from dataclasses import dataclass, field
-from collections import deque, defaultdict
+from collections import defaultdict
 from tinygrad.uop.ops import UOp, Variable, Ops, UPat, PatternMatcher, graph_rewrite, buffers
 from tinygrad.device import Buffer, MultiBuffer
-from tinygrad.helpers import Metadata, unwrap, merge_dicts
+from tinygrad.helpers import Metadata, unwrap, merge_dicts, SCHEDULE_CACHE, EARLY_COPY, FUSE_ARANGE, FUSE_CONV_BW, SPLIT_REDUCEOP, RING
+from tinygrad.helpers import DONT_REALIZE_EXPAND, DONT_GROUP_REDUCES, CORRECT_DIVMOD_FOLDING, ALLREDUCE_GROUP, ALLREDUCE_BUCKET, NO_MEMORY_PLANNER
 
 # **** ScheduleItem return type
 
@@ -60,12 +62,22 @@ def create_schedule_with_vars(sched_sink:UOp) -> tuple[list[ScheduleItem], dict[
       else:
         raise RuntimeError(f"input to kernel must be ASSIGN or BUFFER, not {s.op}")
 
-  # linearize KERNEL UOps into ScheduleItems in BFS order
-  queue = deque(k for k,v in in_degree.items() if v == 0)
+  # with EARLY_COPY a ready kernel goes first by how few kernels there are between it and a COPY, so the allreduce of a gradient starts as soon
+  # as it's computed and the copies run while the rest of the backward does. a kernel that reads a copy keeps its BFS place, on an in order queue
+  # it would wait there for the transfer. without EARLY_COPY this is the BFS order
+  after_copy = {c for k in in_degree if k.arg.ast.op is Ops.COPY for c in children[k]}
+  priority: dict[UOp, float] = {}
+  for k in reversed(in_degree):
+    if not EARLY_COPY or k in after_copy: priority[k] = math.inf
+    else: priority[k] = 0.0 if k.arg.ast.op is Ops.COPY else min([priority[c]+1 for c in children[k]], default=math.inf)
+
+  # linearize KERNEL UOps into ScheduleItems in BFS order, by priority first
+  cnt = itertools.count()
+  heapq.heapify(queue:=[(priority[k], next(cnt), k) for k,v in in_degree.items() if v == 0])
   schedule: list[ScheduleItem] = []
   var_vals: dict[Variable, int] = {}
   while queue:
-    k = queue.popleft()
+    k = heapq.heappop(queue)[2]
     # unbind var_vals from the kernel
     local_var_vals: list[dict[Variable, int]] = []
     ast = graph_rewrite(k.arg.ast, pm_unbind, ctx=local_var_vals, name="unbind vars")
@@ -86,6 +98,90 @@ def create_schedule_with_vars(sched_sink:UOp) -> tuple[list[ScheduleItem], dict[
       schedule.append(ScheduleItem(ast, cast(tuple[Buffer, ...], ubufs), k.arg.metadata))
     for x in children[k]:
       in_degree[x] -= 1
-      if in_degree[x] == 0: queue.append(x)
+      if in_degree[x] == 0: heapq.heappush(queue, (priority[x], next(cnt), x))
 
   return schedule, var_vals
+
+# **** schedule cache
+
+# a graph that only differs in the buffers it uses has the same kernels. the cache stores what kernelize did to the tensor graph and the
+# schedule with the buffers replaced by placeholders, a hit puts the new buffers in and makes new ones for the outputs and intermediates
+
+@dataclass(frozen=True)
+class CachedSchedule:
+  inputs: tuple[UOp, ...]
+  outputs: tuple[UOp, ...]
+  output_bufs: tuple[Optional[int], ...]
+  becomes: tuple[tuple[UOp, ...], tuple[UOp, ...]]
+  bufs: tuple[tuple, ...]  # ("in", i) | ("buf", device, size, dtype, options) | ("view", base, size, dtype, offset)
+  items: tuple[tuple[UOp, tuple[int, ...], tuple[Metadata, ...], dict[Variable, int]], ...]
+  var_vals: dict[Variable, int]
+  tm: float
+
+schedule_cache: dict[bytes, CachedSchedule] = {}
+# the ContextVars that change what kernelize and the memory planner make of a graph
+SCHEDULE_CONTEXT = (FUSE_ARANGE, FUSE_CONV_BW, SPLIT_REDUCEOP, DONT_REALIZE_EXPAND, DONT_GROUP_REDUCES, CORRECT_DIVMOD_FOLDING, RING,
+                    ALLREDUCE_GROUP, ALLREDUCE_BUCKET, EARLY_COPY, NO_MEMORY_PLANNER)
+
+def schedule_cache_key(sink:UOp) -> Optional[tuple[bytes, list[UOp]]]:
+  """The key of the graph with its BUFFERs numbered in order, and the BUFFERs. None if the graph can't be cached."""
+  inputs: dict[UOp, bytes] = {}
+  keys: dict[UOp, bytes] = {}
+  for u in sink.toposort(gate=lambda u: u.op is not Ops.BUFFER):
+    if u.op is Ops.KERNEL: return None
+    for s in u.src:
+      if s.op is Ops.BUFFER and s not in inputs:
+        if isinstance(s.device, tuple): return None
+        keys[s] = inputs[s] = str((s.op, s.dtype, s.arg, s.device, len(inputs))).encode()
+    keys[u] = hashlib.sha256(str((u.op, u.dtype, u.arg, u.tag)).encode() + b"".join([keys[s] for s in u.src])).digest()
+  ctx = str([v.value for v in SCHEDULE_CONTEXT]).encode()
+  return hashlib.sha256(keys[sink] + ctx).digest(), list(inputs)
+
+def _placeholder(u:UOp, i:int) -> UOp: return u.replace(src=(UOp(Ops.UNIQUE, arg=-1-i), u.src[1]))
+def _substitute_all(uops:list[UOp], sub:dict[UOp, UOp]) -> tuple[UOp, ...]: return UOp.sink(*uops).substitute(sub).src if uops else ()
+
+def schedule_cache_add(key:bytes, inputs:list[UOp], becomes_map:dict[UOp, UOp], schedule:list[ScheduleItem], var_vals:dict[Variable, int],
+                       tm:float):
+  becomes_map = {k:v for k,v in becomes_map.items() if k is not v}
+  outputs = [u for u in UOp.sink(*becomes_map.values()).toposort() if u.op is Ops.BUFFER and u not in inputs] if becomes_map else []
+  phs = {u:_placeholder(u, i) for i,u in enumerate(inputs+outputs)}
+  norm = _substitute_all([*becomes_map, *becomes_map.values()], phs)
+  # the buffers in the order they are made, a view comes after its base
+  bufs: list[tuple] = []
+  buf_idx: dict[Buffer, int] = {}
+  for i,u in enumerate(inputs):
+    if (b:=buffers.get(u)) is None: continue
+    # NOTE: the offset of a view of an input isn't in the key
+    if cast(Buffer, b)._base is not None: return
+    buf_idx[cast(Buffer, b)] = len(bufs)
+    bufs.append(("in", i))
+  # NOTE: a recursive closure here is a reference cycle that keeps the buffers alive until the gc runs
+  for b in [b for si in schedule for b in si.bufs]+[cast(Buffer, b) for u in outputs if (b:=buffers.get(u)) is not None]:
+    for x in ([b] if b._base is None else [b._base, b]):
+      if x in buf_idx: continue
+      buf_idx[x] = len(bufs)
+      if x._base is not None: bufs.append(("view", buf_idx[x._base], x.size, x.dtype, x.offset))
+      else: bufs.append(("buf", x.device, x.size, x.dtype, x.options))
+  items = tuple((si.ast, tuple(buf_idx[b] for b in si.bufs), si.metadata, si.fixedvars) for si in schedule)
+  output_bufs = tuple(buf_idx[cast(Buffer, b)] if (b:=buffers.get(u)) is not None else None for u in outputs)
+  if len(schedule_cache) >= SCHEDULE_CACHE.value: del schedule_cache[next(iter(schedule_cache))]
+  schedule_cache[key] = CachedSchedule(tuple(phs[u] for u in inputs), tuple(phs[u] for u in outputs), output_bufs,
+                                       (norm[:len(becomes_map)], norm[len(becomes_map):]), tuple(bufs), items, var_vals, tm)
+
+def schedule_cache_get(key:bytes, inputs:list[UOp]) -> Optional[tuple[dict[UOp, UOp], list[ScheduleItem], dict[Variable, int], float]]:
+  """On a hit, the map to apply to the tensors, the schedule with the new buffers, the var_vals and the time the miss took."""
+  if (c:=schedule_cache.get(key)) is None or any((b:=buffers.get(u)) is not None and cast(Buffer, b)._base is not None for u in inputs): return None
+  schedule_cache[key] = schedule_cache.pop(key)
+  outputs = [UOp.new_buffer(ph.device, ph.arg, ph.dtype) for ph in c.outputs]
+  bufs: list[Buffer] = []
+  for spec in c.bufs:
+    if spec[0] == "in": bufs.append(cast(Buffer, inputs[spec[1]].buffer))
+    elif spec[0] == "view": bufs.append(Buffer(bufs[spec[1]].device, spec[2], spec[3], base=bufs[spec[1]].base, offset=bufs[spec[1]].offset+spec[4]))
+    else: bufs.append(Buffer(spec[1], spec[2], spec[3], options=spec[4]))
+  for u,i in zip(outputs, c.output_bufs):
+    # like UOp.buffer, a view is from a BUFFER_VIEW and doesn't hold a reference
+    if i is not None: buffers[u] = bufs[i] if bufs[i]._base is not None else bufs[i].ref(1)
+  sub = dict(zip(c.inputs+c.outputs, inputs+outputs))
+  becomes = _substitute_all([*c.becomes[0], *c.becomes[1]], sub)
+  return dict(zip(becomes[:len(c.becomes[0])], becomes[len(c.becomes[0]):])), \
+    [ScheduleItem(ast, tuple(bufs[i] for i in idxs), metadata, fixedvars) for ast,idxs,metadata,fixedvars in c.items], c.var_vals, c.tm
@@ -1,6 +1,6 @@
 from __future__ import annotations
 import os, functools, platform, time, re, contextlib, operator, hashlib, pickle, sqlite3, tempfile, pathlib, string, ctypes, sys, gzip, getpass
-import urllib.request, subprocess, shutil, math, types, copyreg, inspect, importlib, decimal
+import urllib.request, threading, atexit, subprocess, shutil, math, types, copyreg, inspect, importlib, decimal
 from dataclasses import dataclass
 from typing import Union, ClassVar, Optional, Iterable, Any, TypeVar, Callable, Sequence, TypeGuard, Iterator, Generic, Generator
 
@@ -131,6 +131,17 @@ DONT_REALIZE_EXPAND, DONT_GROUP_REDUCES = ContextVar("DONT_REALIZE_EXPAND", 0),
 QUANTIZE, VALIDATE_WITH_CPU = ContextVar("QUANTIZE", 0), ContextVar("VALIDATE_WITH_CPU", 0)
 CORRECT_DIVMOD_FOLDING, FUSE_OPTIM = ContextVar("CORRECT_DIVMOD_FOLDING", 0), ContextVar("FUSE_OPTIM", 0)
 ALLOW_DEVICE_USAGE, AMD_LLVM = ContextVar("ALLOW_DEVICE_USAGE", 1), ContextVar("AMD_LLVM", 1)
+CPU_THREADS = ContextVar("CPU_THREADS", 1)
+LRU_BUDGET = ContextVar("LRU_BUDGET", 0)
+# the compile workers are forked on linux. elsewhere they're spawned and import __main__, so they're off by default and a script that sets
+# COMPILE_WORKERS needs an if __name__ == "__main__" guard
+COMPILE_WORKERS = ContextVar("COMPILE_WORKERS", (os.cpu_count() or 1) if sys.platform == "linux" else 0)
+COMPILE_WORKERS_MIN = ContextVar("COMPILE_WORKERS_MIN", 16)
+ASYNC_SCHEDULE, SCHEDULE_CACHE = ContextVar("ASYNC_SCHEDULE", 0), ContextVar("SCHEDULE_CACHE", 0)
+JOINT_BEAM, EARLY_COPY = ContextVar("JOINT_BEAM", 0), ContextVar("EARLY_COPY", 0)
+ALLREDUCE_GROUP, ALLREDUCE_BUCKET = ContextVar("ALLREDUCE_GROUP", 0), ContextVar("ALLREDUCE_BUCKET", 0)
+# the max runs of a BEAM candidate in successive halving, 0 is a fixed 3 runs per candidate with an early stop
+BEAM_RACE = ContextVar("BEAM_RACE", 0)
 
 @dataclass(frozen=True)
 class Metadata:
@@ -149,8 +160,17 @@ class GlobalCounters:
   time_sum_s: ClassVar[float] = 0.0
   kernel_count: ClassVar[int] = 0
   mem_used: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_hits: ClassVar[int] = 0
+  lru_misses: ClassVar[int] = 0
+  lru_evicts: ClassVar[int] = 0
+  schedule_hits: ClassVar[int] = 0
+  schedule_misses: ClassVar[int] = 0
+  schedule_saved_s: ClassVar[float] = 0.0
   @staticmethod
-  def reset(): GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
+  def reset():
+    GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
+    GlobalCounters.lru_hits, GlobalCounters.lru_misses, GlobalCounters.lru_evicts = 0,0,0
+    GlobalCounters.schedule_hits, GlobalCounters.schedule_misses, GlobalCounters.schedule_saved_s = 0,0,0.0
 
 # **************** timer and profiler ****************
 
@@ -210,48 +230,128 @@ cache_dir: str = os.path.join(getenv("XDG_CACHE_HOME", os.path.expanduser("~/Lib
 CACHEDB: str = getenv("CACHEDB", os.path.abspath(os.path.join(cache_dir, "cache.db")))
 
 VERSION = 21
+# puts are written behind and committed in batches by a background thread, DISKCACHE_SYNC=1 commits every put
+# recently used entries are kept pickled in memory, up to DISKCACHE_LRU bytes
+DISKCACHE_SYNC, DISKCACHE_LRU = getenv("DISKCACHE_SYNC", 0), getenv("DISKCACHE_LRU", 1<<26)
 _db_connection = None
+_db_lock, _db_mem_lock, _db_flush_event = threading.Lock(), threading.Lock(), threading.Event()
+_db_flusher: Optional[threading.Thread] = None
+_db_pending: dict[tuple[str, tuple], tuple[dict, bytes]] = {}
+_db_lru: dict[tuple[str, tuple], bytes] = {}  # dicts are ordered, the least recently used entry is first
+_db_lru_bytes = 0
+_db_tables: set[str] = set()
 def db_connection():
   global _db_connection
   if _db_connection is None:
     os.makedirs(CACHEDB.rsplit(os.sep, 1)[0], exist_ok=True)
-    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE")
+    # NOTE: the flusher thread writes with this connection, all use of it is under _db_lock
+    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE", check_same_thread=False)
     # another connection has set it already or is in the process of setting it
     # that connection will lock the database
     with contextlib.suppress(sqlite3.OperationalError): _db_connection.execute("PRAGMA journal_mode=WAL").fetchone()
     if DEBUG >= 8: _db_connection.set_trace_callback(print)
   return _db_connection
 
+# sqlite matches 4 and "4", so does the in memory cache
+def _db_key(table:str, key:dict) -> tuple[str, tuple]: return table, tuple((k, str(int(v)) if isinstance(v, int) else v) for k,v in key.items())
+def _db_lru_put(k:tuple[str, tuple], val:bytes):
+  global _db_lru_bytes
+  if (old:=_db_lru.pop(k, None)) is not None: _db_lru_bytes -= len(old)
+  if len(val) > DISKCACHE_LRU: return
+  _db_lru[k] = val
+  _db_lru_bytes += len(val)
+  while _db_lru_bytes > DISKCACHE_LRU: _db_lru_bytes -= len(_db_lru.pop(next(iter(_db_lru))))
+
+def diskcache_flush():
+  global _db_pending
+  with _db_lock:
+    with _db_mem_lock: pending, _db_pending = _db_pending, {}
+    if not pending: return
+    conn = db_connection()
+    cur = conn.cursor()
+    for (table, _), (key, val) in pending.items():
+      if table not in _db_tables:
+        TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
+        ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
+        cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, PRIMARY KEY ({', '.join(key.keys())}))")
+        _db_tables.add(table)
+      cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val) VALUES ({', '.join(['?']*len(key))}, ?)", tuple(key.values()) + (val, ))  # noqa: E501
+    conn.commit()
+    cur.close()
+
+def _db_flush_loop():
+  while True:
+    _db_flush_event.wait()
+    # wait a bit so puts that come together are committed together
+    time.sleep(0.05)
+    _db_flush_event.clear()
+    diskcache_flush()
+
+def _db_start_flusher():
+  global _db_flusher
+  if _db_flusher is not None: return
+  (_db_flusher:=threading.Thread(target=_db_flush_loop, daemon=True)).start()
+  # processes started by multiprocessing exit without running atexit
+  import multiprocessing.util
+  multiprocessing.util.Finalize(None, diskcache_flush, exitpriority=0)
+
+def _db_after_fork():
+  global _db_connection, _db_lock, _db_mem_lock, _db_flush_event, _db_flusher
+  # an sqlite connection can't be used across a fork, the child opens its own
+  _db_connection, _db_lock, _db_mem_lock, _db_flush_event, _db_flusher = None, threading.Lock(), threading.Lock(), threading.Event(), None
+atexit.register(diskcache_flush)
+# a child can read everything the parent put before the fork
+if hasattr(os, "register_at_fork"): os.register_at_fork(before=diskcache_flush, after_in_child=_db_after_fork)
+
 def diskcache_clear():
-  cur = db_connection().cursor()
-  drop_tables = cur.execute("SELECT 'DROP TABLE IF EXISTS ' || quote(name) || ';' FROM sqlite_master WHERE type = 'table';").fetchall()
-  cur.executescript("\n".join([s[0] for s in drop_tables] + ["VACUUM;"]))
+  global _db_lru_bytes
+  with _db_mem_lock:
+    _db_pending.clear()
+    _db_lru.clear()
+    _db_lru_bytes = 0
+  with _db_lock:
+    cur = db_connection().cursor()
+    drop_tables = cur.execute("SELECT 'DROP TABLE IF EXISTS ' || quote(name) || ';' FROM sqlite_master WHERE type = 'table';").fetchall()
+    cur.executescript("\n".join([s[0] for s in drop_tables] + ["VACUUM;"]))
+    _db_tables.clear()
 
 def diskcache_get(table:str, key:Union[dict, str, int]) -> Any:
   if CACHELEVEL < 1: return None
   if isinstance(key, (str,int)): key = {"key": key}
-  cur = db_connection().cursor()
-  try:
-    res = cur.execute(f"SELECT val FROM '{table}_{VERSION}' WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}", tuple(key.values()))
-  except sqlite3.OperationalError:
-    return None  # table doesn't exist
-  if (val:=res.fetchone()) is not None: return pickle.loads(val[0])
-  return None
-
-_db_tables = set()
+  with _db_mem_lock:
+    if (val:=_db_lru.pop(k:=_db_key(table, key), None)) is not None: _db_lru[k] = val
+    elif k in _db_pending: val = _db_pending[k][1]
+  if val is None:
+    with _db_lock:
+      cur = db_connection().cursor()
+      try:
+        res = cur.execute(f"SELECT val FROM '{table}_{VERSION}' WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}", tuple(key.values()))
+      except sqlite3.OperationalError:
+        return None  # table doesn't exist
+      if (row:=res.fetchone()) is None: return None
+    with _db_mem_lock: _db_lru_put(k, val:=row[0])
+  return pickle.loads(val)
+
+def diskcache_items(table:str) -> list[tuple[dict, Any]]:
+  if CACHELEVEL < 1: return []
+  diskcache_flush()
+  with _db_lock:
+    cur = db_connection().cursor()
+    try: res = cur.execute(f"SELECT * FROM '{table}_{VERSION}'")
+    except sqlite3.OperationalError: return []  # table doesn't exist
+    cols, rows = [d[0] for d in res.description], res.fetchall()
+  return [(dict(zip(cols[:-1], row[:-1])), pickle.loads(row[-1])) for row in rows]
+
 def diskcache_put(table:str, key:Union[dict, str, int], val:Any, prepickled=False):
   if CACHELEVEL < 1: return val
   if isinstance(key, (str,int)): key = {"key": key}
-  conn = db_connection()
-  cur = conn.cursor()
-  if table not in _db_tables:
-    TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
-    ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
-    cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, PRIMARY KEY ({', '.join(key.keys())}))")
-    _db_tables.add(table)
-  cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val) VALUES ({', '.join(['?']*len(key))}, ?)", tuple(key.values()) + (val if prepickled else pickle.dumps(val), ))  # noqa: E501
-  conn.commit()
-  cur.close()
+  with _db_mem_lock:
+    _db_lru_put(k:=_db_key(table, key), pval:=val if prepickled else pickle.dumps(val))
+    _db_pending[k] = (key, pval)
+  if DISKCACHE_SYNC: diskcache_flush()
+  else:
+    _db_start_flusher()
+    _db_flush_event.set()
   return val
 
 def diskcache(func:Callable[..., T]):
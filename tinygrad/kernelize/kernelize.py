@@ -4,8 +4,9 @@ from tinygrad.uop.ops import track_rewrites, _substitute
 from tinygrad.uop.spec import type_verify, tensor_uop_spec
 from tinygrad.uop.symbolic import symbolic_simple
 from tinygrad.helpers import Metadata, all_int, all_same, colored, prod, dedup, unwrap, getenv, pluralize, FUSE_ARANGE, DEBUG, SPLIT_REDUCEOP
+from tinygrad.helpers import ALLREDUCE_BUCKET
 from tinygrad.dtype import ImageDType
-from tinygrad.kernelize.multi import multi_pm
+from tinygrad.kernelize.multi import multi_pm, replace_allreduce, bucket_allreduces
 from tinygrad.shape.shapetracker import ShapeTracker
 from tinygrad.shape.view import View, strides_for_shape, get_contraction_with_reduce
 from tinygrad.kernelize.grouper import group_realizes, ALWAYS_CONTIGUOUS
@@ -428,8 +429,14 @@ def get_kernelize_map(sink:UOp) -> dict[UOp, UOp]:
     Map transforming each UOp in the sink to the Ops.KERNEL graph.
   """
 
-  # multi + merge_views + simplify
-  tensor_map = graph_rewrite_map(sink, multi_pm+do_fuse+merge_views+sym+replace_contiguous, ctx={}, name="merge_views")
+  # multi + merge_views + simplify. with ALLREDUCE_BUCKET the allreduces are put in buckets before they are replaced, so multi goes first
+  bucket_map: dict[UOp, UOp] = {}
+  if ALLREDUCE_BUCKET:
+    bucket_map = graph_rewrite_map(sink, multi_pm, name="multi")
+    bucket_map = graph_rewrite_map(bucket_map[sink], _substitute, ctx=bucket_allreduces(bucket_map[sink]), bottom_up=True, input_map=bucket_map,
+                                   name="bucket allreduces")
+  tensor_map = graph_rewrite_map(bucket_map.get(sink, sink), multi_pm+replace_allreduce+do_fuse+merge_views+sym+replace_contiguous, ctx={},
+                                 input_map=bucket_map or None, name="merge_views")
 
   # display the cleaned up tensor graph
   if getenv("VIZ"): graph_rewrite(tensor_map[sink], PatternMatcher([]), name="View Tensor Graph")
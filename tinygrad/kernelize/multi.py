@@ -1,31 +1,116 @@
 from typing import cast
 import functools, itertools, operator
-from tinygrad.helpers import all_same, all_int, prod, DEBUG, RING, getenv, unwrap
+from tinygrad.helpers import all_same, all_int, prod, DEBUG, RING, getenv, unwrap, dedup, ALLREDUCE_GROUP, ALLREDUCE_BUCKET
 from tinygrad.uop.ops import Ops, UOp, sint, PatternMatcher, UPat, GroupOp, resolve
 
 # *** allreduce implementation ***
 
+# RING=0 is the naive allreduce, 2 the ring, 3 recursive halving-doubling and 4 hierarchical. RING=1 is the ring on more than 2 devices above
+# RING_ALLREDUCE_THRESHOLD elements, RING=5 picks one with allreduce_cost
+NAIVE, RING_THRESHOLD, RING_ALLREDUCE, HALVING_DOUBLING, HIERARCHICAL, COST_MODEL = 0, 1, 2, 3, 4, 5
+
+def _chunk_bounds(numel:int, n:int) -> list[int]:
+  factor = next((f for f in [32, 16, 8, 4, 2] if numel % f == 0), 1)
+  base, left = (numel // factor) // n, (numel // factor) % n
+  return list(itertools.accumulate([(base + 1) * factor] * left + [base * factor] * (n - left), initial=0))
+
+def allreduce_groups(devices:tuple[str, ...]) -> list[list[int]]|None:
+  # the devices that talk fast to each other: ALLREDUCE_GROUP consecutive devices, or the devices of one backend when there's more than one
+  if (sz:=ALLREDUCE_GROUP.value) > 0: return [list(range(i, min(i+sz, len(devices)))) for i in range(0, len(devices), sz)]
+  backends = dedup(d.split(":")[0] for d in devices)
+  return [[i for i,d in enumerate(devices) if d.split(":")[0] == b] for b in backends] if len(backends) > 1 else None
+
+def ring_crossover_latency(elems:int, n:int=6, itemsize:int=4) -> float:
+  # the latency where the naive allreduce and the ring cost the same for elems items on n devices in allreduce_cost:
+  # lat + (n-1)*b == 2*(n-1)*lat + 2*(n-1)/n*b, so lat = (n-1)*(n-2)/n*b / (2*n-3). it's 10/27 of the bytes on 6 devices
+  return (n-1)*(n-2)/n*elems*itemsize / (2*n-3)
+
+def allreduce_cost(algo:int, n:int, nbytes:int, groups:list[list[int]]|None=None) -> float:
+  # alpha-beta model in bytes: a step (a copy and a kernel on every device) costs ALLREDUCE_LATENCY, a byte crossing between groups costs
+  # ALLREDUCE_INTER. by default the latency is where the naive and the ring cross at RING_ALLREDUCE_THRESHOLD floats on 6 devices, like RING=1
+  lat = getenv("ALLREDUCE_LATENCY", ring_crossover_latency(getenv("RING_ALLREDUCE_THRESHOLD", 256_000)))
+  inter = getenv("ALLREDUCE_INTER", 4) if groups is not None and len(groups) > 1 else 1
+  if algo == NAIVE: return lat + (n-1)*nbytes*inter
+  if algo == RING_ALLREDUCE: return 2*(n-1)*lat + 2*(n-1)/n*nbytes*inter
+  if algo == HALVING_DOUBLING:
+    p = 1 << (n.bit_length()-1)
+    return 2*(p.bit_length()-1)*lat + 2*(p-1)/p*nbytes*inter + (2*lat + 2*nbytes*inter if p != n else 0)
+  assert algo == HIERARCHICAL and groups is not None
+  # reduce to the first device of each group, allreduce them across the groups, copy back inside the groups
+  return 2*lat + max(len(g) for g in groups)*nbytes + min(allreduce_cost(a, len(groups), nbytes, groups) for a in (NAIVE, HALVING_DOUBLING))
+
+def _reduce(xs:list[UOp], op:Ops) -> UOp: return functools.reduce(lambda x,y: x.alu(op, y), xs)
+
+def allreduce_naive(xs:list[UOp], op:Ops) -> list[UOp]:
+  return [_reduce([y if j == i else y.copy_to_device(x.device) for j,y in enumerate(xs)], op) for i,x in enumerate(xs)]
+
+def allreduce_halving_doubling(xs:list[UOp], op:Ops) -> list[UOp]:
+  # recursive halving reduce-scatter, then recursive doubling allgather: 2*log2(n) steps where the ring takes 2*(n-1). devices past the largest
+  # power of 2 are reduced into the first ones before and get a copy of the result after
+  n, numel, p = len(xs), xs[0].shape[0], 1 << (len(xs).bit_length()-1)
+  b = _chunk_bounds(cast(int, numel), p)
+  # device i holds the reduction of chunks [lo, hi) of the devices it exchanged with
+  segs = [(0, p, x.alu(op, xs[p+i].copy_to_device(x.device)) if p+i < n else x) for i,x in enumerate(xs[:p])]
+  d = p // 2
+  while d:
+    nsegs = []
+    for i,(lo,hi,x) in enumerate(segs):
+      s, e = (lo, (lo+hi)//2) if i & d == 0 else ((lo+hi)//2, hi)
+      mine, theirs = x.shrink(((b[s]-b[lo], b[e]-b[lo]),)), segs[i^d][2].shrink(((b[s]-b[lo], b[e]-b[lo]),))
+      nsegs.append((s, e, mine.alu(op, theirs.copy_to_device(x.device))))
+    segs, d = nsegs, d // 2
+  # the allgather sends the pieces as they are and puts them together once at the end, instead of a kernel for every step
+  pieces = [[seg] for seg in segs]
+  d = 1
+  while d < p:
+    pieces = [pcs + [(lo, hi, x.copy_to_device(pcs[0][2].device)) for lo,hi,x in pieces[i^d]] for i,pcs in enumerate(pieces)]
+    d *= 2
+  ret = [functools.reduce(operator.add, [x.pad(((b[lo], numel-b[hi]),)) for lo,hi,x in pcs]) for pcs in pieces]
+  return ret + [ret[i-p].copy_to_device(xs[i].device) for i in range(p, n)]
+
+def allreduce_hierarchical(xs:list[UOp], op:Ops, groups:list[list[int]]) -> list[UOp]:
+  # reduce inside each group to its first device, allreduce those across the groups, then copy the result back inside the groups
+  leaders = [_reduce([xs[g[0]]] + [xs[i].copy_to_device(xs[g[0]].device) for i in g[1:]], op) for g in groups]
+  nbytes = cast(int, leaders[0].shape[0]) * leaders[0].dtype.itemsize
+  if allreduce_cost(HALVING_DOUBLING, len(groups), nbytes, groups) < allreduce_cost(NAIVE, len(groups), nbytes, groups):
+    reduced = allreduce_halving_doubling(leaders, op)
+  else: reduced = allreduce_naive(leaders, op)
+  ret = cast(list[UOp], [None]*len(xs))
+  for g,r in zip(groups, reduced):
+    for i in g: ret[i] = r if i == g[0] else r.copy_to_device(xs[i].device)
+  return ret
+
 def handle_allreduce(buf:UOp, red:UOp) -> UOp|None:
   if not isinstance(buf.device, tuple): return None
   assert all_int(buf.shape), f"does not support symbolic shape {buf.shape}"
   n_lbs, shape, numel = len(buf.device), buf.shape, prod(buf.shape)
-  # ring allreduce doesn't provide a benefit with only 2 nodes or where number of elements is less than 256k (empirically)
-  # fallback to naive allreduce to save on kernel dispatch, chunking and reassembling chunks.
-  use_ring = (RING >= 2 or (n_lbs > 2 and numel > getenv("RING_ALLREDUCE_THRESHOLD", 256_000) and RING >= 1))
-  if DEBUG >= 2: print(f"{'RING ALLREDUCE' if use_ring else 'NAIVE ALLREDUCE'} {n_lbs}x{numel} | {buf.dtype}")
+  groups = allreduce_groups(buf.device)
+  if RING.value == RING_THRESHOLD:
+    # ring allreduce doesn't provide a benefit with only 2 nodes or where number of elements is less than 256k (empirically)
+    # fallback to naive allreduce to save on kernel dispatch, chunking and reassembling chunks.
+    algo = RING_ALLREDUCE if n_lbs > 2 and numel > getenv("RING_ALLREDUCE_THRESHOLD", 256_000) else NAIVE
+  elif RING.value == COST_MODEL:
+    algos = [NAIVE, RING_ALLREDUCE, HALVING_DOUBLING] + ([HIERARCHICAL] if groups is not None else [])
+    algo = min(algos, key=lambda a: allreduce_cost(a, n_lbs, numel*buf.dtype.itemsize, groups))
+  else: algo = RING.value
+  if red.src[1].arg != buf.device or n_lbs < 2: algo = NAIVE
+  if DEBUG >= 2: print(f"{['NAIVE', '', 'RING', 'HALVING DOUBLING', 'HIERARCHICAL'][algo]} ALLREDUCE {n_lbs}x{numel} | {buf.dtype}")
 
   # contiguous before we copy it
   buf = buf.contiguous()
 
   # copy to all devices. if you shrink later, that'll be handled
-  if not use_ring: return functools.reduce(lambda x,y: x.alu(red.arg, y),
-                                           [UOp(Ops.COPY, buf.dtype, (buf.mselect(i), red.src[1])) for i in range(len(buf.device))])
+  if algo == NAIVE: return functools.reduce(lambda x,y: x.alu(red.arg, y),
+                                            [UOp(Ops.COPY, buf.dtype, (buf.mselect(i), red.src[1])) for i in range(len(buf.device))])
+
+  if algo in (HALVING_DOUBLING, HIERARCHICAL):
+    xs = [buf.reshape((numel,)).mselect(i) for i in range(n_lbs)]
+    if algo == HIERARCHICAL: outs = allreduce_hierarchical(xs, red.arg, groups or [list(range(i, min(i+2, n_lbs))) for i in range(0, n_lbs, 2)])
+    else: outs = allreduce_halving_doubling(xs, red.arg)
+    return UOp(Ops.MSTACK, buf.dtype, tuple(outs)).reshape(shape)
 
   # new ring reduce
-  factor = next((f for f in [32, 16, 8, 4, 2] if numel % f == 0), 1)
-  base, left = (numel // factor) // n_lbs, (numel // factor) % n_lbs
-  chunk_sizes = [(base + 1) * factor] * left + [base * factor] * (n_lbs - left)
-  chunks = list(itertools.pairwise(itertools.accumulate(chunk_sizes, initial=0)))
+  chunks = list(itertools.pairwise(_chunk_bounds(numel, n_lbs)))
 
   # extract chunks and scatter-reduce
   reduced_chunks = []
@@ -53,6 +138,40 @@ def handle_allreduce(buf:UOp, red:UOp) -> UOp|None:
   pads = [((s,numel-e),) for s,e in chunks]
   return functools.reduce(operator.add, [c.pad(pad) for pad,c in zip(pads, copied_chunks)]).reshape(shape)
 
+def bucket_allreduces(sink:UOp) -> dict[UOp, UOp]:
+  # the sum allreduces go in buckets of ALLREDUCE_BUCKET bytes in the order their inputs are ready (by the reduces before them), a bucket is one
+  # allreduce that starts when the last of its inputs is computed. with the gradients of a backward pass the first bucket can be sent while
+  # the rest of the backward runs, and a bucket pays the latency of the allreduce once for all of its gradients
+  depth: dict[UOp, int] = {}
+  # a bitmask of the allreduces every UOp depends on, an allreduce that depends on one in the bucket can't be in it
+  deps: dict[UOp, int] = {}
+  reds: list[UOp] = []
+  for u in sink.toposort():
+    depth[u] = max([depth[s] for s in u.src], default=0) + (u.op is Ops.REDUCE_AXIS)
+    deps[u] = functools.reduce(operator.or_, [deps[s] for s in u.src], 0)
+    if u.op is Ops.ALLREDUCE and u.arg is Ops.ADD and u.src[1].arg == u.src[0].device and isinstance(u.device, tuple) and all_int(u.shape):
+      deps[u] |= 1 << len(reds)
+      reds.append(u)
+  buckets: list[list[UOp]] = []
+  # (allreduces, mask, bytes) of the bucket being filled for each device and dtype
+  filling: dict[tuple, tuple[list[UOp], int, int]] = {}
+  for r in sorted(reds, key=lambda r: depth[r]):
+    members, mask, nbytes = filling.get(key:=(r.device, r.dtype), ([], 0, 0))
+    if deps[r.src[0]] & mask: members, mask, nbytes = [], 0, 0
+    if not members: buckets.append(members)
+    members.append(r)
+    filling[key] = (members, mask | deps[r], nbytes + prod(r.shape)*r.dtype.itemsize)
+    if filling[key][2] >= ALLREDUCE_BUCKET.value: del filling[key]
+  ret: dict[UOp, UOp] = {}
+  for b in buckets:
+    if len(b) < 2: continue
+    bounds = list(itertools.accumulate([prod(r.shape) for r in b], initial=0))
+    flat = functools.reduce(operator.add, [r.src[0].reshape((e-s,)).pad(((s, bounds[-1]-e),)) for r,(s,e) in zip(b, itertools.pairwise(bounds))])
+    red = flat.allreduce(Ops.ADD, b[0].src[1])
+    for r,(s,e) in zip(b, itertools.pairwise(bounds)): ret[r] = red.shrink(((s, e),)).reshape(r.shape)
+  if DEBUG >= 2 and ret: print(f"ALLREDUCE BUCKETS {len(reds)} allreduces in {len(buckets)} buckets")
+  return ret
+
 # ***** multi rewrite MSELECT/MSTACK *****
 
 def _replace_dnum(st, val):
@@ -201,4 +320,4 @@ multi_pm = PatternMatcher([
     lambda multi,device,red: multi.src[0].allreduce(red.arg, device).multi(axis=multi.axis)),
   (UPat((Ops.CAST, Ops.BITCAST, Ops.CONTIGUOUS, Ops.DETACH, Ops.CONTIGUOUS_BACKWARD, Ops.FUSE),
         src=(UPat(Ops.MULTI, name="multi"), ), name="root"), passthrough_multi),
-])+replace_allreduce
+])
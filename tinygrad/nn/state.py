@@ -1,8 +1,9 @@
-import json, pathlib, zipfile, pickle, tarfile, struct, functools, io
+import json, pathlib, zipfile, pickle, tarfile, struct, functools, io, mmap, ctypes, os, weakref
 from collections import OrderedDict
-from typing import Union, Optional, Any, Callable, BinaryIO, Iterable
+from typing import Union, Optional, Any, Callable, BinaryIO, Iterable, cast
 from tinygrad.tensor import Tensor
-from tinygrad.dtype import dtypes
+from tinygrad.dtype import dtypes, DType
+from tinygrad.device import Buffer, Device
 from tinygrad.helpers import prod, argsort, DEBUG, Timing, CI, unwrap, GlobalCounters, tqdm, round_up, T
 from tinygrad.shape.view import strides_for_shape
 
@@ -40,6 +41,32 @@ def accept_filename(func: Callable[[Tensor], T]) -> Callable[[Union[Tensor, str,
   def wrapper(fn: Union[Tensor, str, pathlib.Path]) -> T: return func(Tensor(pathlib.Path(fn)) if not isinstance(fn, Tensor) else fn)
   return wrapper
 
+# the mapping of a file is copy-on-write, the pages are the page cache's until a process writes to them.
+# processes that map the same file share one copy of it in memory. the buffers in a mapping keep it alive, it's unmapped with the last one
+class _Mapping:
+  def __init__(self, fn:str, size:int):
+    with open(fn, "rb") as f: self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    self.arr = (ctypes.c_uint8 * size).from_buffer(self.mm)
+    self.addr = ctypes.addressof(self.arr)
+_mmaps: weakref.WeakValueDictionary[tuple[str, int, int], _Mapping] = weakref.WeakValueDictionary()
+_mapped_buffers: weakref.WeakKeyDictionary[Buffer, _Mapping] = weakref.WeakKeyDictionary()
+def _mmap_file(fn:Union[str, pathlib.Path]) -> _Mapping:
+  st = os.stat(fn := os.path.realpath(fn))
+  if (m:=_mmaps.get(key:=(fn, st.st_size, st.st_mtime_ns))) is None: _mmaps[key] = m = _Mapping(fn, st.st_size)
+  return m
+
+def _mmap_tensor(fn:Union[str, pathlib.Path], offset:int, dtype:DType, shape:tuple[int, ...]) -> Tensor:
+  # vector loads in CPU kernels need the buffer aligned, like the MallocAllocator does it
+  if prod(shape) == 0: return Tensor.empty(*shape, dtype=dtype, device="CPU")
+  if (ptr:=(m:=_mmap_file(fn)).addr+offset) % 0x20 == 0:
+    ret = Tensor.from_blob(ptr, shape, dtype=dtype, device="CPU")
+    _mapped_buffers[cast(Buffer, ret.uop.buffer)] = m
+    return ret
+  if DEBUG >= 2: print(f"mmap: {fn} at {offset} isn't aligned, copied {prod(shape)*dtype.itemsize} bytes")
+  ret = Tensor.empty(*shape, dtype=dtype, device="CPU")
+  ctypes.memmove(cast(Buffer, ret.uop.buffer).ensure_allocated()._buf, ptr, ret.nbytes())
+  return ret
+
 @accept_filename
 def safe_load_metadata(t:Tensor) -> tuple[Tensor, int, dict[str, Any]]:
   """
@@ -48,14 +75,23 @@ def safe_load_metadata(t:Tensor) -> tuple[Tensor, int, dict[str, Any]]:
   data_start = int.from_bytes(t[0:8].data(), "little") + 8
   return t, data_start, json.loads(t[8:data_start].data().tobytes())
 
-def safe_load(fn:Union[Tensor, str, pathlib.Path]) -> dict[str, Tensor]:
+def safe_load(fn:Union[Tensor, str, pathlib.Path], mmap=False) -> dict[str, Tensor]:
   """
   Loads a .safetensor file, returning the `state_dict`.
 
+  With `mmap=True`, the file is mapped in memory and the tensors are CPU buffers in the mapping, without a copy.
+
   ```python
   state_dict = nn.state.safe_load("test.safetensor")
   ```
   """
+  if mmap:
+    if isinstance(fn, Tensor): raise ValueError("mmap needs a filename")
+    with open(fn, "rb") as f:
+      data_start = int.from_bytes(f.read(8), "little") + 8
+      metadata = json.loads(f.read(data_start-8))
+    return { k: _mmap_tensor(fn, data_start+v['data_offsets'][0], safe_dtypes[v['dtype']], tuple(v['shape']))
+            for k, v in metadata.items() if k != "__metadata__" }
   t, data_start, metadata = safe_load_metadata(fn)
   data = t[data_start:]
   return { k: data[v['data_offsets'][0]:v['data_offsets'][1]].bitcast(safe_dtypes[v['dtype']]).reshape(v['shape'])
@@ -162,6 +198,38 @@ def load_state_dict(model, state_dict:dict[str, Tensor], strict=True, verbose=Tr
       ret.append(v)
   return ret
 
+def load_bulk(state_dict:dict[str, Tensor], device:Optional[str]=None, depth=64, seg_len=1<<22) -> dict[str, Tensor]:
+  """
+  Realizes a `state_dict` on `device`. The reads of the tensors on DISK, which can be spread across files, are all queued in the io_uring
+  together and the data goes to the device as the reads complete. Up to `depth` reads of at most `seg_len` bytes are in flight.
+
+  ```python
+  state_dict = nn.state.load_bulk(nn.state.safe_load("test.safetensor") | nn.state.safe_load("test2.safetensor"))
+  ```
+  """
+  from tinygrad.uop.ops import Ops
+  from tinygrad.engine.realize import run_schedule
+  from tinygrad.runtime.ops_disk import DiskDevice, read_bulk
+  ret = {k:v.to(device) for k,v in state_dict.items()}
+  schedule, var_vals = Tensor.schedule_with_vars(*ret.values())
+  reads: list[tuple[int, int, int, Buffer]] = []
+  def flush():
+    for idx,data in read_bulk([(fd, offset, size) for fd,offset,size,_ in reads], depth, seg_len):
+      reads[idx][3].copyin(data)
+    reads.clear()
+  for si in schedule:
+    if si.ast.op is Ops.COPY and si.bufs[1].device.startswith("DISK") and hasattr(DiskDevice, "io_uring") and \
+       hasattr(Device[si.bufs[0].device].allocator, "_offset") and (src:=si.bufs[1].ensure_allocated()._buf).device.fd is not None:
+      dest = si.bufs[0].ensure_allocated()
+      for off in range(0, dest.nbytes, seg_len):
+        reads.append((src.device.fd, src.offset+off, size:=min(seg_len, dest.nbytes-off), dest.view(size, dtypes.uint8, off).ensure_allocated()))
+      continue
+    # everything else runs after the reads it could depend on
+    flush()
+    run_schedule([si], var_vals)
+  flush()
+  return ret
+
 @accept_filename
 def tar_extract(t: Tensor) -> dict[str, Tensor]:
   """
@@ -302,8 +370,7 @@ def ggml_data_to_tensor(t: Tensor, n: int, ggml_type: int) -> Tensor:
       return d * (xl.bitwise_or(xh).bitcast(dtypes.int8) - 32).flatten(-2) * scales
   raise ValueError(f"GGML type '{ggml_type}' is not supported!")
 
-@accept_filename
-def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
+def gguf_load(tensor: Union[Tensor, str, pathlib.Path], mmap=False) -> tuple[dict, dict[str, Tensor]]:
   """
   Loads a .gguf file, returning the `kv_data` and `state_dict`.
 
@@ -312,9 +379,26 @@ def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
   kv_data, state_dict = nn.state.gguf_load(gguf_tensor)
   ```
 
+  With `mmap=True`, the file is mapped in memory and the tensors are CPU buffers in the mapping, without a copy.
+
   NOTE: The provided tensor must be on a device that supports execution.
   """
-  reader, kv_data, state_dict = io.BufferedReader(TensorIO(tensor), 1_000_000), {}, {}
+  if not mmap:
+    t = tensor if isinstance(tensor, Tensor) else Tensor(pathlib.Path(tensor))
+    kv_data, t_infos, data_start = _gguf_header(io.BufferedReader(TensorIO(t), 1_000_000))
+    def data(off:int) -> Tensor: return t[data_start+off:]
+  elif isinstance(tensor, Tensor): raise ValueError("mmap needs a filename")
+  else:
+    fn = tensor
+    with open(fn, "rb") as f: kv_data, t_infos, data_start = _gguf_header(f)
+    # a tensor ends where the next one starts
+    offs = sorted(off for *_,off in t_infos) + [os.path.getsize(fn) - data_start]
+    ends = dict(zip(offs, offs[1:]))
+    def data(off:int) -> Tensor: return _mmap_tensor(fn, data_start+off, dtypes.uint8, (ends[off]-off,))
+  return kv_data, { name: ggml_data_to_tensor(data(off), prod(dims), typ).reshape(*reversed(dims)) for name, dims, typ, off in t_infos }
+
+def _gguf_header(reader:BinaryIO) -> tuple[dict, list[tuple[str, tuple[int, ...], int, int]], int]:
+  kv_data: dict = {}
   def read_unpack(fmt: str, n: int): return struct.unpack(fmt, reader.read(n))[0]
   def read_str(): return str(reader.read(read_uint64()), "utf-8")
   def read_arr():
@@ -333,8 +417,4 @@ def gguf_load(tensor: Tensor) -> tuple[dict, dict[str, Tensor]]:
 
   t_infos = [ (read_str(), tuple(read_uint64() for _ in range(read_uint32())), read_int32(), read_uint64()) for _ in range(n_tensors) ]
   alignment, pos = kv_data.get("general.alignment", 32), reader.tell()
-  data_start = round_up(pos, alignment)
-
-  for name, dims, typ, off in t_infos: state_dict[name] = ggml_data_to_tensor(tensor[data_start + off:], prod(dims), typ).reshape(*reversed(dims))
-
-  return kv_data, state_dict
+  return kv_data, t_infos, round_up(pos, alignment)
@@ -8,7 +8,7 @@ from tinygrad.renderer import Renderer
 
 def get_optimized_ast(ast:UOp, renderer:Renderer) -> UOp:
   """
-  Optimize an AST based on heuristics or BEAM search.
+  Optimize an AST based on heuristics or BEAM search. The BEAM results imported with BEAM_DB are used before searching.
 
   Args:
     ast: The Ops.SINK rooted AST
@@ -18,8 +18,10 @@ def get_optimized_ast(ast:UOp, renderer:Renderer) -> UOp:
     The Ops.SINK rooted AST transformed to apply the opts and with a KernelInfo in the arg.
   """
 
+  from tinygrad.opt.beamdb import imported_kernel
   k = Kernel(ast, opts=renderer)
   if ast.arg is not None and ast.arg.opts_to_apply is not None: k.apply_opts(ast.arg.opts_to_apply)
+  elif not NOOPT and (kdb:=imported_kernel(k)) is not None: k = kdb
   elif not NOOPT:
     if not k.apply_tensor_cores(USE_TC.value): k.apply_opts(hand_coded_optimizations(k))
     if BEAM >= 1:
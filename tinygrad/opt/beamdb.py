@@ -0,0 +1,86 @@
+# the BEAM results as a file artifact: a tuning box exports them, the serving nodes apply them without searching (BEAM_DB=file.json)
+# an entry is the AST key, the opts and the measured time, for a device fingerprint. merging keeps the fastest entry for each kernel
+from __future__ import annotations
+import json, platform
+from dataclasses import dataclass, asdict
+from tinygrad.helpers import getenv, diskcache_items, diskcache_put, DEBUG
+from tinygrad.opt.kernel import Kernel, Opt, OptOps, KernelOptError
+from tinygrad.renderer import Renderer
+
+BEAMDB_VERSION = 1
+
+def device_fingerprint(renderer:Renderer) -> str:
+  # the renderer args have the arch of the GPUs
+  cls, args = renderer.__reduce__()
+  return f"{renderer.device}{':'+renderer.suffix if renderer.suffix else ''}/{getattr(cls, '__name__', cls)}{args}/{platform.machine()}"
+
+@dataclass(frozen=True)
+class BeamEntry:
+  ast: str
+  device: str
+  suffix: str
+  fingerprint: str
+  opts: tuple[Opt, ...]
+  time: float
+  amt: int
+  allow_test_size: bool
+  @property
+  def kernel_key(self) -> tuple[str, str, str, str]: return (self.ast, self.device, self.suffix, self.fingerprint)
+
+def _opt_to_json(o:Opt) -> list: return [o.op.name, o.axis, list(o.arg) if isinstance(o.arg, tuple) else o.arg]
+def _opt_from_json(x:list) -> Opt: return Opt(OptOps[x[0]], x[1], tuple(x[2]) if isinstance(x[2], list) else x[2])
+
+def save_beam(fn:str, entries:list[BeamEntry]):
+  # an entry per line
+  lines = [json.dumps({**asdict(e), "opts": [_opt_to_json(o) for o in e.opts]}) for e in entries]
+  with open(fn, "w") as f: f.write(f'{{"version": {BEAMDB_VERSION}, "entries": [\n' + ",\n".join(lines) + "\n]}\n")
+
+def load_beam(fn:str) -> list[BeamEntry]:
+  with open(fn) as f: db = json.load(f)
+  if db.get("version") != BEAMDB_VERSION: raise RuntimeError(f"{fn} is BEAM db version {db.get('version')}, expected {BEAMDB_VERSION}")
+  return [BeamEntry(**{**e, "opts": tuple(_opt_from_json(o) for o in e["opts"])}) for e in db["entries"]]
+
+def merge_beam(*dbs:list[BeamEntry]) -> list[BeamEntry]:
+  best: dict[tuple[str, str, str, str], BeamEntry] = {}
+  for e in (e for db in dbs for e in db):
+    if (old:=best.get(e.kernel_key)) is None or e.time < old.time: best[e.kernel_key] = e
+  return list(best.values())
+
+def export_beam() -> list[BeamEntry]:
+  # beam_search stores the time and the fingerprint of each result next to its opts
+  results = {tuple(sorted(k.items())): v for k,v in diskcache_items("beam_result")}
+  return [BeamEntry(k["ast"].hex(), k["device"], k["suffix"], res[1], tuple(opts), res[0], k["amt"], bool(k["allow_test_size"]))
+          for k,opts in diskcache_items("beam_search") if (res:=results.get(tuple(sorted(k.items())))) is not None]
+
+def import_beam(entries:list[BeamEntry]):
+  # into the local diskcache, so a BEAM search of these kernels is a cache hit
+  for e in entries:
+    key = {"ast": bytes.fromhex(e.ast), "amt": e.amt, "allow_test_size": e.allow_test_size, "device": e.device, "suffix": e.suffix}
+    diskcache_put("beam_search", key, list(e.opts))
+    diskcache_put("beam_result", key, (e.time, e.fingerprint))
+
+_imported: dict[tuple[str, str, str, str], BeamEntry]|None = None
+def imported_kernel(k:Kernel) -> Kernel|None:
+  global _imported
+  if _imported is None: _imported = {e.kernel_key:e for e in merge_beam(load_beam(fn))} if (fn:=getenv("BEAM_DB", "")) else {}
+  if not _imported or (e:=_imported.get((k.ast.key.hex(), k.opts.device, k.opts.suffix, device_fingerprint(k.opts)))) is None: return None
+  try:
+    (ret:=k.copy()).apply_opts(e.opts)
+    return ret
+  except KernelOptError:
+    if DEBUG >= 1: print(f"BEAM_DB: failed to apply {e.opts} to {k.name}")
+    return None
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="export, merge and import BEAM results")
+  sub = parser.add_subparsers(dest="cmd", required=True)
+  sub.add_parser("export", help="write the BEAM results of the local diskcache to a file").add_argument("out")
+  (merge:=sub.add_parser("merge", help="merge BEAM result files keeping the fastest entry")).add_argument("out")
+  merge.add_argument("inputs", nargs="+")
+  sub.add_parser("import", help="add the BEAM results of a file to the local diskcache").add_argument("inp")
+  args = parser.parse_args()
+  if args.cmd == "export": save_beam(args.out, entries:=export_beam())
+  elif args.cmd == "merge": save_beam(args.out, entries:=merge_beam(*[load_beam(fn) for fn in args.inputs]))
+  else: import_beam(entries:=load_beam(args.inp))
+  print(f"{args.cmd}: {len(entries)} entries")
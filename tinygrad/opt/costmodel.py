@@ -0,0 +1,73 @@
+# a cost model ranks the candidates of a BEAM step so only the best predicted ones are compiled and timed
+# it's a linear model of the log time, trained on the timings beam_search stores in the diskcache
+from __future__ import annotations
+import math
+from tinygrad.uop.ops import Ops, GroupOp, AxisType, Variable, sym_infer
+from tinygrad.dtype import PtrDType
+from tinygrad.helpers import prod, diskcache_get, diskcache_put, diskcache_items
+from tinygrad.opt.kernel import Kernel
+from tinygrad.renderer import ProgramSpec
+
+FEATURES = ("ops", "lds", "mem", "global", "local", "group", "upcast", "unroll", "loop", "reduce", "uops", "loads", "stores", "alus", "local_mem",
+            "vec", "tc")
+
+def kernel_features(k:Kernel, p:ProgramSpec, var_vals:dict[Variable, int]) -> list[float]:
+  def axes(*t:AxisType) -> float: return math.log2(prod(sym_infer(k.full_shape[i], var_vals) for i in k.axes_of(*t)))
+  uops = p.uops or []
+  cnt = {op:sum(u.op is op for u in uops) for op in (Ops.LOAD, Ops.STORE)}
+  local_mem = sum(u.dtype.size*u.dtype.base.itemsize for u in uops if u.op is Ops.DEFINE_LOCAL and isinstance(u.dtype, PtrDType))
+  vec = max([u.dtype.count for u in uops if u.op is Ops.LOAD] + [1])
+  return [math.log2(1+sym_infer(x, var_vals)) for x in (p.estimates.ops, p.estimates.lds, p.estimates.mem)] + \
+    [axes(AxisType.GLOBAL), axes(AxisType.LOCAL), axes(AxisType.GROUP_REDUCE), axes(AxisType.UPCAST), axes(AxisType.UNROLL), axes(AxisType.LOOP),
+     axes(AxisType.REDUCE), math.log2(1+len(uops)), math.log2(1+cnt[Ops.LOAD]), math.log2(1+cnt[Ops.STORE]),
+     math.log2(1+sum(u.op in GroupOp.ALU for u in uops)), math.log2(1+local_mem), math.log2(vec), float(k.tensor_core is not None)]
+
+class CostModel:
+  def __init__(self, weights:list[float]): self.weights = weights
+  # only the order of the candidates of a kernel matters, the prediction is the log2 time up to a constant
+  def predict(self, features:list[float]) -> float: return sum(w*f for w,f in zip(self.weights, features))
+
+  @staticmethod
+  def train(kernels:list[list[tuple[list[float], float]]], l2:float=1e-3) -> CostModel:
+    # ridge regression of log2 time on the features, centered per kernel so the model learns what differs between candidates
+    n = len(FEATURES)
+    xtx, xty = [[0.0]*n for _ in range(n)], [0.0]*n
+    for kernel in kernels:
+      if len(samples := [(f, math.log2(tm)) for f,tm in kernel if 0 < tm < math.inf]) < 2: continue
+      mf, mt = [sum(f[i] for f,_ in samples)/len(samples) for i in range(n)], sum(t for _,t in samples)/len(samples)
+      for f,t in samples:
+        x = [a-b for a,b in zip(f, mf)]
+        for i in range(n):
+          xty[i] += x[i]*(t-mt)
+          for j in range(n): xtx[i][j] += x[i]*x[j]
+    for i in range(n): xtx[i][i] += l2*(1+xtx[i][i])
+    return CostModel(_solve(xtx, xty))
+
+  @staticmethod
+  def load(device:str) -> CostModel|None: return CostModel(weights) if (weights:=diskcache_get("beam_costmodel", device)) is not None else None
+  def save(self, device:str): diskcache_put("beam_costmodel", device, self.weights)
+
+def beam_samples(device:str) -> list[list[tuple[list[float], float]]]:
+  return [v for k,v in diskcache_items("beam_samples") if k["device"] == device]
+
+def _solve(a:list[list[float]], b:list[float]) -> list[float]:
+  # gaussian elimination with partial pivoting
+  n = len(b)
+  m = [row[:] + [b[i]] for i,row in enumerate(a)]
+  for c in range(n):
+    p = max(range(c, n), key=lambda r: abs(m[r][c]))
+    m[c], m[p] = m[p], m[c]
+    if m[c][c] == 0: continue
+    for r in range(n):
+      if r != c and m[r][c] != 0: m[r] = [x - m[r][c]/m[c][c]*y for x,y in zip(m[r], m[c])]
+  return [m[i][n]/m[i][i] if m[i][i] != 0 else 0.0 for i in range(n)]
+
+if __name__ == "__main__":
+  # train the model of a device from the beam_search timings in the diskcache
+  import sys
+  from tinygrad.device import Device
+  dev = sys.argv[1] if len(sys.argv) > 1 else Device.DEFAULT
+  if not (samples:=beam_samples(dev)): raise SystemExit(f"no BEAM timings for {dev} in the diskcache, run a BEAM search first")
+  (model:=CostModel.train(samples)).save(dev)
+  print(f"trained the {dev} cost model on {sum(len(s) for s in samples)} timings of {len(samples)} kernels")
+  for name,weight in zip(FEATURES, model.weights): print(f"{name:10s} {weight:8.4f}")
@@ -0,0 +1,104 @@
+# BEAM picks the opts of each kernel in isolation. with JOINT_BEAM=n each kernel of a schedule has n candidates (the opts get_optimized_ast
+# picks and its best timed neighbors) and the choice is made on the time of the kernels it shares buffers with, run back to back, so the cache
+# a producer leaves warm for its consumer counts. the kernels are chosen in turn until a sweep changes nothing
+from __future__ import annotations
+import math, hashlib
+from dataclasses import replace
+from typing import Callable
+from tinygrad.uop.ops import Ops, UOp, KernelInfo, Variable
+from tinygrad.device import Device, Buffer
+from tinygrad.helpers import JOINT_BEAM, CACHELEVEL, DEBUG, getenv, dedup, diskcache_get, diskcache_put, time_to_str
+from tinygrad.opt import get_optimized_ast
+from tinygrad.opt.kernel import Kernel, Opt
+from tinygrad.opt.search import get_kernel_actions, bufs_from_lin, _try_compile_linearized_w_idx, _time_program
+from tinygrad.engine.schedule import ScheduleItem
+from tinygrad.engine.realize import CompiledRunner, get_program
+
+def kernel_candidates(ast:UOp, device:str, var_vals:dict[Variable, int], amt:int) -> list[tuple[Opt, ...]]:
+  # the opts get_optimized_ast picks come first, then the neighbors of it that are fastest in isolation
+  k = Kernel(ast, opts=Device[device].renderer)
+  best = get_optimized_ast(ast, k.opts).arg.applied_opts
+  (kb:=k.copy()).apply_opts(best)
+  rawbufs, tms = bufs_from_lin(k), []
+  for lin in get_kernel_actions(kb, include_0=False).values():
+    if (proc:=_try_compile_linearized_w_idx((0, lin), Device[device].compiler)[1]) is None: continue
+    try: tms.append((min(_time_program(proc[0], proc[1], var_vals, rawbufs, cnt=2)), tuple(lin.applied_opts)))
+    except RuntimeError: continue
+  return [best] + [opts for tm,opts in sorted(tms, key=lambda x: x[0]) if tm < math.inf and opts != best][:amt-1]
+
+def descend(cands:list[int], cost:Callable[[int, list[int]], float], sweeps:int, min_gain:float) -> list[int]:
+  # coordinate descent from the first candidate of each kernel. cost(i, choice) is the time of the kernels around kernel i with these choices
+  choice = [0]*len(cands)
+  for _ in range(sweeps):
+    changed = False
+    for i in range(len(cands)):
+      if cands[i] < 2: continue
+      tms = [cost(i, choice[:i]+[c]+choice[i+1:]) for c in range(cands[i])]
+      if (c:=min(range(cands[i]), key=lambda c: tms[c])) != choice[i] and tms[c] < tms[choice[i]]*(1-min_gain): choice[i], changed = c, True
+    if not changed: break
+  return choice
+
+def optimize_schedule(schedule:list[ScheduleItem], var_vals:dict[Variable, int]) -> list[ScheduleItem]:
+  kernels = [i for i,si in enumerate(schedule) if si.ast.op is Ops.SINK and si.ast.arg is None]
+  if len(kernels) < 2: return schedule
+  key = {"asts": hashlib.sha256(b"".join(schedule[i].ast.key for i in kernels)).digest(), "amt": JOINT_BEAM.value,
+         "devices": ",".join(schedule[i].bufs[0].device for i in kernels)}
+  if CACHELEVEL < 1 or (opts:=diskcache_get("joint_beam", key)) is None:
+    opts = _search(schedule, kernels, var_vals)
+    if CACHELEVEL >= 1: diskcache_put("joint_beam", key, opts)
+  ret = schedule[:]
+  for i,o in zip(kernels, opts): ret[i] = replace(schedule[i], ast=_with_opts(schedule[i], o))
+  return ret
+
+# a kernel is named once, the name is in the ast key of the method cache so a schedule optimized again hits it. it's keyed by the ast key, the
+# asts aren't kept alive, and the least recently used names past JOINT_NAMES are dropped
+_kernel_names: dict[tuple[bytes, str], str] = {}
+def _kernel_name(ast:UOp, device:str) -> str:
+  if (key:=(ast.key, device)) in _kernel_names: _kernel_names[key] = _kernel_names.pop(key)
+  else:
+    _kernel_names[key] = Kernel(ast, opts=Device[device].renderer).name
+    while len(_kernel_names) > getenv("JOINT_NAMES", 4096): del _kernel_names[next(iter(_kernel_names))]
+  return _kernel_names[key]
+def _with_opts(si:ScheduleItem, opts:tuple[Opt, ...]) -> UOp:
+  return si.ast.replace(arg=KernelInfo(_kernel_name(si.ast, si.bufs[0].device), opts_to_apply=opts))
+
+def _search(schedule:list[ScheduleItem], kernels:list[int], var_vals:dict[Variable, int]) -> list[tuple[Opt, ...]]:
+  kvars = [var_vals|schedule[i].fixedvars for i in kernels]
+  cands = [kernel_candidates(schedule[i].ast, schedule[i].bufs[0].device, kvars[j], JOINT_BEAM.value) for j,i in enumerate(kernels)]
+  runners: dict[tuple[int, int], CompiledRunner] = {}
+  def runner(j:int, c:int) -> CompiledRunner:
+    if (j, c) not in runners:
+      si = schedule[kernels[j]]
+      runners[(j, c)] = CompiledRunner(get_program(_with_opts(si, cands[j][c]), Device[si.bufs[0].device].renderer))
+    return runners[(j, c)]
+  # the kernels that share a buffer with kernel j, in schedule order
+  windows = [[k for k in range(len(kernels)) if set(schedule[kernels[k]].bufs) & set(schedule[kernels[j]].bufs)] for j in range(len(kernels))]
+  # the window runs on scratch buffers, shared like the real ones so a consumer reads what its producer wrote. descend times the candidates of a
+  # window in a row, so they're allocated once per window. the next window frees the ones it doesn't use and keeps the rest
+  scratch: dict[Buffer, Buffer] = {}
+  scratch_window = -1
+  def cost(j:int, choice:list[int]) -> float:
+    nonlocal scratch_window
+    if scratch_window != j:
+      bufs = dedup(b for k in windows[j] for b in schedule[kernels[k]].bufs)
+      for b in [b for b in scratch if b not in bufs]: scratch.pop(b).deallocate()
+      for b in bufs:
+        if b not in scratch: scratch[b] = Buffer(b.device, b.size, b.dtype).allocate()
+      scratch_window = j
+    tms = []
+    for _ in range(getenv("JOINT_CNT", 3)):
+      tm = 0.0
+      for k in windows[j]:
+        r = runner(k, choice[k])
+        tm += r([scratch[schedule[kernels[k]].bufs[x]] for x in r.p.globals], kvars[k], wait=True) or 0.0
+      tms.append(tm)
+    return min(tms)
+  try:
+    choice = descend([len(c) for c in cands], cost, getenv("JOINT_SWEEPS", 2), getenv("JOINT_MIN_GAIN", 0.02))
+    if DEBUG >= 2:
+      base = sum(cost(j, [0]*len(kernels)) for j in range(len(kernels)))
+      print(f"JOINT_BEAM: {len(kernels)} kernels, changed {sum(c != 0 for c in choice)}, windows {time_to_str(base, w=0)} -> "
+            f"{time_to_str(sum(cost(j, choice) for j in range(len(kernels))), w=0)}")
+  finally:
+    for sb in scratch.values(): sb.deallocate()
+  return [cands[j][c] for j,c in enumerate(choice)]
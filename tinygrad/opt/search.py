@@ -1,13 +1,15 @@
-from typing import cast, Optional, Callable
-import itertools, functools, random, math, time, multiprocessing, traceback, signal, atexit
+from typing import cast, Optional, Callable, Sequence
+import itertools, functools, math, time, multiprocessing, traceback, signal, atexit, statistics
 from collections import defaultdict
 from dataclasses import replace
 from tinygrad.uop.ops import UOp, Ops, Variable, sym_infer
 from tinygrad.device import Device, Buffer, Compiler
 from tinygrad.helpers import prod, flatten, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, getenv, Context, colored, time_to_str
-from tinygrad.helpers import IGNORE_BEAM_CACHE, TC_SEARCH_OVER_SHAPE
+from tinygrad.helpers import IGNORE_BEAM_CACHE, TC_SEARCH_OVER_SHAPE, BEAM_RACE
 from tinygrad.dtype import ImageDType, PtrDType
 from tinygrad.opt.kernel import Kernel, Opt, OptOps, KernelOptError
+from tinygrad.opt.costmodel import CostModel, kernel_features
+from tinygrad.opt.beamdb import device_fingerprint
 from tinygrad.tensor import Tensor
 from tinygrad.engine.realize import CompiledRunner, get_program
 from tinygrad.renderer import ProgramSpec
@@ -35,40 +37,77 @@ def get_test_global_size(global_size, max_global_size, var_vals):
         break
   return test_global_size, input_size / prod(test_global_size)
 
-def _time_program(p:ProgramSpec, lib:bytes, var_vals:dict[Variable, int], rawbufs:list[Buffer], early_stop:Optional[float]=None,
-                  allow_test_size:int=True, max_global_size:Optional[int]=65536, clear_l2=False, cnt=3, name="test") -> list[float]:
+def _test_runner(p:ProgramSpec, lib:bytes, var_vals:dict[Variable, int], allow_test_size:int=True,
+                 max_global_size:Optional[int]=65536) -> tuple[CompiledRunner, float]|None:
   factor = 1
   if allow_test_size and p.global_size is not None and max_global_size is not None:
     global_size, factor = get_test_global_size(p.global_size, max_global_size, var_vals)
     p = replace(p, global_size=global_size)
-  try: car = CompiledRunner(p, precompiled=lib)
-  except AssertionError: return [math.inf] * cnt
+  try: return CompiledRunner(p, precompiled=lib), factor
+  except AssertionError: return None
+
+def _run_program(runner:tuple[CompiledRunner, float], var_vals:dict[Variable, int], rawbufs:list[Buffer], early_stop:Optional[float]=None,
+                 clear_l2=False, cnt=3) -> list[float]:
+  car, factor = runner
   tms = []
   input_bufs = [rawbufs[i] for i in car.p.globals]
   for _ in range(cnt):
     if clear_l2:
-      if hasattr(dev:=Device[p.device], 'invalidate_caches'): dev.invalidate_caches()
+      if hasattr(dev:=Device[car.p.device], 'invalidate_caches'): dev.invalidate_caches()
       else:
         with Context(DEBUG=0, BEAM=0, CAPTURING=0, TRACK_MATCH_STATS=0): Tensor.ones(1024,1024).contiguous().realize(do_update_stats=False)
     tms.append(cast(float, car(input_bufs, var_vals, wait=True))*factor)
     if early_stop is not None and early_stop < min(tms): break
   return tms
 
+def _time_program(p:ProgramSpec, lib:bytes, var_vals:dict[Variable, int], rawbufs:list[Buffer], early_stop:Optional[float]=None,
+                  allow_test_size:int=True, max_global_size:Optional[int]=65536, clear_l2=False, cnt=3, name="test") -> list[float]:
+  if (runner:=_test_runner(p, lib, var_vals, allow_test_size, max_global_size)) is None: return [math.inf] * cnt
+  return _run_program(runner, var_vals, rawbufs, early_stop, clear_l2, cnt)
+
+def _race(runners:list[tuple[CompiledRunner, float]], tms:list[list[float]], keep:int, var_vals:dict[Variable, int], rawbufs:list[Buffer],
+          clear_l2=False) -> None:
+  # successive halving: every candidate was timed once, each round keeps the fastest half without the ones slower than the keep-th best by more
+  # than the timer noise, and doubles the runs of the survivors. the time of a candidate is the min of its runs
+  def bound(c:int, z:float, noise:float) -> float: return min(tms[c])*(1+z*noise/math.sqrt(len(tms[c])))
+  alive = sorted([c for c in range(len(runners)) if not math.isinf(min(tms[c]))], key=lambda c: min(tms[c]))
+  while alive and 2*len(tms[alive[0]]) <= BEAM_RACE.value:
+    # the relative noise of the timer, from the candidates timed more than once
+    spread = sorted(statistics.stdev(t)/statistics.mean(t) for t in tms if len(t) > 1 and 0 < statistics.mean(t) < math.inf)
+    noise = max(spread[len(spread)//2] if spread else BEAM_NOISE, BEAM_NOISE/4)
+    upper = bound(alive[min(keep, len(alive))-1], 2, noise)
+    alive = [c for c in alive[:max(keep, (len(alive)+1)//2)] if bound(c, -2, noise) <= upper]
+    for c in alive: tms[c] += _run_program(runners[c], var_vals, rawbufs, clear_l2=clear_l2, cnt=len(tms[c]))
+    alive.sort(key=lambda c: min(tms[c]))
+
 class TimeoutException(Exception): pass
 def timeout_handler(signum, frame): raise TimeoutException()
 
-def _try_compile_linearized_w_idx(x:tuple[int,Kernel], compiler:Compiler) -> tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]:
+def _get_test_program(k:Kernel) -> ProgramSpec:
+  p = get_program(k.copy().get_optimized_ast(name_override="test"), k.opts)
+  assert p.uops is not None, "uop list wasn't generated?"
+  if len(p.uops) >= (uops_max:=getenv("BEAM_UOPS_MAX", 3000)) > 0:
+    if getenv("BEAM_LOG_SURPASS_MAX"): print(f"too many uops. {len(p.uops)=}, {uops_max=}")
+    raise RuntimeError("too many uops")
+  return p
+
+def _try_linearize_w_idx(x:tuple[int,Kernel]) -> tuple[int, Optional[ProgramSpec]]:
+  try: return x[0], _get_test_program(x[1])
+  except RuntimeError:
+    if DEBUG >= 4: traceback.print_exc()
+  except Exception as e:
+    if getenv("BEAM_STRICT_MODE"): raise e
+  return x[0], None
+
+# the candidates can come linearized already, when the cost model needed their uops
+def _try_compile_linearized_w_idx(x:tuple[int,Kernel|ProgramSpec], compiler:Compiler) -> tuple[int, Optional[tuple[ProgramSpec, bytes, float]]]:
   if hasattr(signal, "alarm"):
     signal.signal(getattr(signal, 'SIGALRM'), timeout_handler)
     # set timeout
     signal.alarm(getenv("BEAM_TIMEOUT_SEC", 10))
   ret = None
   try:
-    p = get_program(x[1].copy().get_optimized_ast(name_override="test"), x[1].opts)
-    assert p.uops is not None, "uop list wasn't generated?"
-    if len(p.uops) >= (uops_max:=getenv("BEAM_UOPS_MAX", 3000)) > 0:
-      if getenv("BEAM_LOG_SURPASS_MAX"): print(f"too many uops. {len(p.uops)=}, {uops_max=}")
-      raise RuntimeError("too many uops")
+    p = x[1] if isinstance(x[1], ProgramSpec) else _get_test_program(x[1])
     st = time.perf_counter()
     prog = compiler.compile(p.src)
     et = time.perf_counter() - st
@@ -138,7 +177,9 @@ def get_kernel_actions(lin:Kernel, include_0=True) -> dict[int, Kernel]:
     except KernelOptError: pass
   return acted_lins
 
-beam_pool, BEAM_DEBUG = None, getenv("BEAM_DEBUG")
+beam_pool, BEAM_DEBUG, BEAM_TOPK = None, getenv("BEAM_DEBUG"), getenv("BEAM_TOPK", 0)
+# BEAM_NOISE is the relative timer noise prior of BEAM_RACE
+BEAM_NOISE = getenv("BEAM_NOISE", 0.05)
 def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value) -> Kernel:
   global beam_pool
   key = {"ast": lin.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": lin.opts.device, "suffix": lin.opts.suffix}
@@ -149,6 +190,9 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
 
   beam: list[tuple[Kernel, float]] = [(lin, float("inf"))]
   seen_libs = set()
+  # the timings are kept to train the cost model, with BEAM_TOPK and a trained model only the best predicted candidates are timed
+  samples: list[tuple[list[float], float]] = []
+  model = CostModel.load(lin.opts.device) if BEAM_TOPK else None
 
   default_parallel = multiprocessing.cpu_count() if lin.opts.device in {"CUDA", "AMD", "NV", "METAL", "HIP"} else 0
   if beam_pool is None and (workers := getenv("PARALLEL", default_parallel)):
@@ -165,12 +209,19 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
     var_vals: dict[Variable, int] = {k:int(k.vmax+k.vmin)//2 for k in lin.ast.variables()}
     exiting, st = False, time.perf_counter()
     dev = Device[lin.opts.device]
+    clear_l2 = hasattr(dev, 'invalidate_caches')
     while not exiting:
       acted_lins: list[Kernel] = flatten([get_kernel_actions(lin, include_0=False).values() for lin,_ in beam])
       timed_lins: list[tuple[Kernel, float]] = []
       _compile_fn = functools.partial(_try_compile_linearized_w_idx, compiler=dev.compiler)
+      candidates: Sequence[tuple[int, Kernel|ProgramSpec]] = list(enumerate(acted_lins))
+      if model is not None and len(candidates) > BEAM_TOPK:
+        progs = [(i,p) for i,p in (map(_try_linearize_w_idx, enumerate(acted_lins)) if beam_pool is None else \
+                                   beam_pool.imap_unordered(_try_linearize_w_idx, enumerate(acted_lins))) if p is not None]
+        candidates = sorted(progs, key=lambda x: model.predict(kernel_features(acted_lins[x[0]], x[1], var_vals)))[:BEAM_TOPK]
       least_compute_ops = math.inf
-      for i,proc in (map(_compile_fn, enumerate(acted_lins)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(acted_lins))):
+      racing: list[tuple[int, tuple[CompiledRunner, float], list[float]]] = []
+      for i,proc in (map(_compile_fn, candidates) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, candidates)):
         if proc is None: continue
         p, lib, compile_et = proc
         if lib in seen_libs: continue
@@ -178,13 +229,24 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
         least_compute_ops = min(this_compute_ops:=sym_infer(p.estimates.ops, var_vals), least_compute_ops)
         if least_compute_ops*1000 < this_compute_ops: continue
         seen_libs.add(lib)
-        try: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0,
-                                 allow_test_size=allow_test_size, clear_l2=hasattr(dev, 'invalidate_caches'))
+        try:
+          if not BEAM_RACE: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0,
+                                                allow_test_size=allow_test_size, clear_l2=clear_l2)
+          elif (runner:=_test_runner(p, lib, var_vals, allow_test_size)) is None: tms = [math.inf]
+          else: racing.append((len(timed_lins), runner, tms:=_run_program(runner, var_vals, rawbufs, clear_l2=clear_l2, cnt=1)))
         except RuntimeError: continue # for runtime issues
         timed_lins.append((acted_lins[i], min(tms)))
+        samples.append((kernel_features(acted_lins[i], p, var_vals), min(tms)))
         if BEAM_DEBUG > 1: print(f"{time.perf_counter() - st:7.2f}s: {i:5d} {len(cast(list, p.uops)):5d} uops {time_to_str(compile_et, w=12)} compile/{time_to_str(timed_lins[-1][1], w=12)} run       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}")  # noqa: E501
         elif DEBUG >= 2: print(f"\r{time.perf_counter() - st:7.2f}s: {time_to_str(timed_lins[-1][1], w=12)}       {len(timed_lins):4d}/{len(acted_lins):4d}         {timed_lins[-1][0].colored_shape()}\033[K", end="")  # noqa: E501
 
+      # with BEAM_RACE the candidates were timed once, the fast ones are timed more
+      if racing:
+        try: _race([r for _,r,_ in racing], [t for _,_,t in racing], amt, var_vals, rawbufs, clear_l2)
+        except RuntimeError: pass # the time of a candidate is the min of the runs that finished
+        step = len(samples) - len(timed_lins)
+        for j,_,tms in racing: timed_lins[j], samples[step+j] = (timed_lins[j][0], min(tms)), (samples[step+j][0], min(tms))
+
       # done
       opts = sorted(timed_lins, key=lambda x: x[1])
       exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress))
@@ -195,18 +257,40 @@ def beam_search(lin:Kernel, rawbufs:list[Buffer], amt:int, allow_test_size=True,
     if beam_pool is not None: beam_pool.terminate()
     raise e
 
-  if CACHELEVEL >= 1: diskcache_put("beam_search", key, beam[0][0].applied_opts)
+  if CACHELEVEL >= 1:
+    diskcache_put("beam_search", key, beam[0][0].applied_opts)
+    diskcache_put("beam_samples", key, samples)
+    diskcache_put("beam_result", key, (beam[0][1], device_fingerprint(lin.opts)))
   if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={time_to_str(beam[0][1], w=0)}, applied_opts={beam[0][0].applied_opts}")
   return beam[0][0]
 
-def optimize_local_size(_prg:Callable, global_size:list[int], rawbufs:list[Buffer]) -> list[int]:
+def _divisors(n:int, limit:int) -> list[int]: return [d for d in range(1, min(n, limit)+1) if n % d == 0]
+
+def local_size_score(global_size:list[int], local_size:list[int]) -> float:
+  # the occupancy and coalescing model the local sizes are timed in the order of, higher is better
+  threads = prod(local_size)
+  lanes = threads / (-(-threads//32)*32)                       # the fraction of the SIMD lanes of the group's warps that run
+  coalesce = min(local_size[0], 32) / min(global_size[0], 32)  # the x dim is the contiguous one
+  fill = min(prod(global_size) // threads / 64, 1.0)           # enough groups to keep the compute units busy
+  return lanes * coalesce * fill * (1.0 if 64 <= threads <= 256 else 0.8)
+
+def optimize_local_size(_prg:Callable, global_size:list[int], rawbufs:list[Buffer], local_max:Optional[tuple[int, ...]]=None,
+                        key:Optional[dict]=None) -> list[int]:
+  # the local sizes are divisors of the global size within the device limits, the LOCAL_SIZE_TOPK best by the model are timed in order.
+  # with a key the result is cached like a BEAM result so a restart times the same kernel the same
+  if key is not None and CACHELEVEL >= 1 and not IGNORE_BEAM_CACHE and (val:=diskcache_get("local_size", key)) is not None: return val
   test_rawbuffers = [Buffer(rawbufs[0].device, rawbufs[0].size, rawbufs[0].dtype).allocate(), *rawbufs[1:]] if rawbufs[0] in rawbufs[1:] else rawbufs
   MAX_WORKGROUP = 1024
-  local_dims = [[x for x in set([sz, 1, 2, 4, 8, 16, 32, 64, 128, 256, MAX_WORKGROUP]) if x<=sz] for sz in global_size]
-  local_sizes = [list(x) for x in itertools.product(*local_dims) if prod(x) <= MAX_WORKGROUP] * 2  # try each valid size twice
+  local_dims = [_divisors(sz, min(MAX_WORKGROUP, local_max[i] if local_max is not None and i < len(local_max) else MAX_WORKGROUP))
+                for i,sz in enumerate(global_size)]
+  local_sizes = sorted([list(x) for x in itertools.product(*local_dims) if prod(x) <= MAX_WORKGROUP],
+                       key=lambda x: local_size_score(global_size, x), reverse=True)[:getenv("LOCAL_SIZE_TOPK", 16)]
   def try_exec(local_size):
-    try: return _prg(*[x._buf for x in test_rawbuffers], global_size=[g//l if g%l == 0 else g/l for g,l in zip(global_size, local_size)], local_size=local_size, wait=True)  # noqa: E501
+    try: return _prg(*[x._buf for x in test_rawbuffers], global_size=[g//l for g,l in zip(global_size, local_size)], local_size=local_size, wait=True)
     except Exception: return float('inf')
-  ret = min([(try_exec(local_size), local_size) for local_size in random.sample(local_sizes, len(local_sizes))])
-  assert not math.isinf(ret[0]), "all optimize_local_size exec failed"
-  return ret[1]
+  # each size is timed twice, a tie goes to the one the model ranks higher
+  tms = [min(try_exec(local_size), try_exec(local_size)) for local_size in local_sizes]
+  assert not math.isinf(min(tms)), "all optimize_local_size exec failed"
+  ret = local_sizes[tms.index(min(tms))]
+  if key is not None and CACHELEVEL >= 1: diskcache_put("local_size", key, ret)
+  return ret
@@ -85,7 +85,7 @@ class CStyleLanguage(Renderer):
   smem_prefix_for_cast: bool = True
   arg_int_prefix: str = "const int"
   barrier: str = ""
-  code_for_workitem: dict[Literal["g", "l", "i"], Callable] = {}
+  code_for_workitem: dict[Literal["g", "l", "i", "c"], Callable] = {}
   extra_args: list[str] = []
   float4: str|None = None
   float4_style: tuple[str, str] = ('(', ')')
@@ -185,6 +185,7 @@ class ClangRenderer(CStyleLanguage):
   float4_style = ('{', '}')
   gep_arr_threshold = 0
   has_local = False
+  has_threads = True
   global_max = None
   infinity = "__builtin_inff()"
   nan = '__builtin_nanf("")'
@@ -192,6 +193,7 @@ class ClangRenderer(CStyleLanguage):
 
   # language options
   buffer_suffix = " restrict"
+  code_for_workitem = {"c": lambda _: "core_id"}
   type_map = {dtypes.bool:"_Bool", dtypes.half:"__fp16"}
   code_for_op = {**({k:v for k,v in CStyleLanguage.code_for_op.items() if k not in [Ops.EXP2, Ops.SIN, Ops.LOG2]}),
                  Ops.SQRT: lambda x,dtype: f"__builtin_sqrt({x})" if dtype == dtypes.float64 else f"__builtin_sqrtf({x})"}
@@ -226,6 +228,8 @@ class ClangRenderer(CStyleLanguage):
   def _render_entry(self, function_name:str, bufs:list[tuple[str,tuple[DType,bool]]]) -> str: return ""
 
   def render_kernel(self, function_name, kernel, bufs, uops, prefix=None) -> str:
+    # threaded kernels get the core they run on as the last argument
+    if any(u.op is Ops.SPECIAL for u in uops): bufs = bufs + [("core_id", (dtypes.int, False))]
     defines = '\n'.join(self._render_defines(uops))
     return defines + "\n" + self._render_body(function_name, kernel, bufs, uops, prefix) + "\n" + self._render_entry(function_name, bufs)
 
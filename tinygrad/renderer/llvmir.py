@@ -117,6 +117,7 @@ class LLVMRenderer(Renderer):
   abi = 'win64cc' if sys.platform == 'win32' else None
   supports_float4 = True
   has_local = False
+  has_threads = True
   global_max: tuple[int, ...] | None = None
   string_rewrite = base_rewrite + PatternMatcher([(UPat(Ops.WMMA, name="wmma"), render_wmma_amx)])
   if AMX: tensor_cores = tc.amx
@@ -172,6 +173,7 @@ class LLVMRenderer(Renderer):
       if u.op in (Ops.DEFINE_GLOBAL, Ops.DEFINE_VAR):
         r[u] = f"%data{u.arg}" if u.op is Ops.DEFINE_GLOBAL else f"%{u.arg[0]}"
         args.append((r[u], u.dtype))
+      elif u.op is Ops.SPECIAL and self.has_threads: r[u] = "%core_id"  # passed in as the last argument
       elif u.op == Ops.DEFINE_LOCAL:
         r[u] = f"%local_{u.arg}"
         assert isinstance(u.dtype, PtrDType)
@@ -202,6 +204,7 @@ class LLVMRenderer(Renderer):
               vc += 1
               kernel.append(f"  %acc{vc} = phi {ldt(x.dtype)} [ {r[x]}, %loop_entry_{u.arg} ], [ {r[acc_to_assign[x]]}, %loop_latch_{u.arg} ]")
               r[x] = f"%acc{vc}"
+    if self.has_threads and any(u.op is Ops.SPECIAL for u in uops): args.append(("%core_id", dtypes.int32))
     return tuple(local_args), self._render_fn(name, args, kernel, prefix)
 
 barrier = 'fence syncscope("workgroup") release\ntail call void @llvm.amdgcn.s.barrier()\nfence syncscope("workgroup") acquire\n'
@@ -210,6 +213,7 @@ code_for_workitem = {"g": lambda x: f"tail call i32 @llvm.amdgcn.workgroup.id.{c
 class AMDLLVMRenderer(LLVMRenderer):
   device = "AMD"
   has_local = True
+  has_threads = False
   shared_max = AMDRenderer.shared_max
   global_max = AMDRenderer.global_max
   abi = "amdgpu_kernel"
@@ -0,0 +1,34 @@
+from typing import cast
+from tinygrad.helpers import cpu_time_execution
+from tinygrad.device import Buffer, CPUProgram
+from tinygrad.engine.realize import ExecItem, CompiledRunner
+from tinygrad.engine.jit import GraphRunner, GraphException
+from tinygrad.uop.ops import Variable
+
+class CPUGraph(GraphRunner):
+  def __init__(self, jit_cache: list[ExecItem], input_rawbuffers: list[Buffer], var_vals: dict[Variable, int]):
+    super().__init__(jit_cache, input_rawbuffers, var_vals)
+    if not all(isinstance(ji.prg, CompiledRunner) and isinstance(ji.prg._prg, CPUProgram) for ji in jit_cache): raise GraphException
+    # the number of cores is the launch dim of a threaded kernel, it's always a constant
+    if self.launch_dims_replace: raise GraphException("symbolic launch dims are not supported")
+
+    # the ctypes arg table is built once, a call only patches the input buffers and the vars in place
+    self.calls: list[tuple[CPUProgram, list[list]]] = []
+    for j,ji in enumerate(jit_cache):
+      prg = cast(CompiledRunner, ji.prg)
+      bufs = [None if (j,i) in self.input_replace else cast(Buffer, b)._buf for i,b in enumerate(ji.bufs)]
+      vals = [var_vals.get(v, ji.fixedvars.get(v)) for v in prg.p.vars]
+      self.calls.append((prg._prg, prg._prg.core_args(bufs, vals, prg.p.launch_dims(var_vals)[0] if prg.p.global_size is not None else None)))
+
+  def __call__(self, rawbufs: list[Buffer], var_vals: dict[Variable, int], wait=False):
+    for (j,i),input_idx in self.input_replace.items():
+      for args in self.calls[j][1]: args[i] = rawbufs[input_idx]._buf
+    for j,i,v in self.updated_vars(var_vals):
+      n = len(self.jit_cache[j].bufs) + i
+      for args in self.calls[j][1]: args[n] = CPUProgram.arg(n, v)
+    return cpu_time_execution(self._run, enable=wait)
+
+  def _run(self):
+    for prg,core_args in self.calls:
+      if len(core_args) == 1: prg.fxn(*core_args[0])
+      else: CPUProgram.workers.run(prg.fxn, core_args)
@@ -124,3 +124,40 @@ class DiskAllocator(Allocator):
         processed_reqs_cnt += 1
 
   def _offset(self, buf:DiskBuffer, size:int, offset:int): return DiskBuffer(buf.device, size, offset)
+
+def read_bulk(reqs:list[tuple[int, int, int]], depth:int, seg_len:int) -> Generator[tuple[int, memoryview], None, None]:
+  """
+  Reads (fd, offset, size) requests of at most seg_len bytes with up to depth of them in flight in the io_uring, the fds can be of different files.
+  Yields the index and the data of the requests as they complete, the memory of the data is reused once the consumer resumes the generator.
+  """
+  assert hasattr(DiskDevice, 'io_uring'), "function requires io uring support"
+  if not reqs: return
+  ring = DiskDevice.io_uring
+  # O_DIRECT reads are page aligned, a request is read from the page it starts in
+  stride = round_up(seg_len, mmap.PAGESIZE) + mmap.PAGESIZE
+  staging = mmap.mmap(-1, (depth:=min(depth, len(reqs), ring.sq.kring_mask[0]+1)) * stride)
+  staging_addr, free = ctypes.addressof(ctypes.c_char.from_buffer(staging)), list(range(depth))
+  inflight: dict[int, int] = {}
+  next_req = 0
+  while next_req < len(reqs) or inflight:
+    submit = 0
+    while next_req < len(reqs) and free:
+      fd, offset, size = reqs[next_req]
+      assert size <= seg_len, f"request of {size} bytes is larger than {seg_len=}"
+      inflight[next_req] = slot = free.pop()
+      minor_offset = offset % mmap.PAGESIZE
+      sqe = ring.sq.sqes[(tail:=ring.sq.ktail[0]) & ring.sq.kring_mask[0]]
+      sqe.opcode, sqe.fd, sqe.off = io_uring.IORING_OP_READ, fd, offset - minor_offset
+      sqe.addr, sqe.len, sqe.user_data = staging_addr + slot*stride, round_up(minor_offset + size, mmap.PAGESIZE), next_req
+      ring.sq.array[tail & ring.sq.kring_mask[0]] = tail & ring.sq.kring_mask[0]
+      ring.sq.ktail[0] = tail + 1
+      next_req, submit = next_req + 1, submit + 1
+    libc.syscall(io_uring.NR_io_uring_enter, ring.ring_fd, submit, 1, io_uring.IORING_ENTER_GETEVENTS)
+    while (head:=ring.cq.khead[0]) != ring.cq.ktail[0]:
+      cqe = ring.cq.cqes[head & ring.cq.kring_mask[0]]
+      idx, res = cqe.user_data, cqe.res
+      ring.cq.khead[0] = head + 1
+      fd, offset, size = reqs[idx]
+      assert res >= offset % mmap.PAGESIZE + size, f"read from disk failed, err: {res}"
+      yield idx, memoryview(staging)[(start:=inflight[idx]*stride + offset % mmap.PAGESIZE):start+size]
+      free.append(inflight.pop(idx))
@@ -70,4 +70,6 @@ class HostLLVMCompiler(LLVMCompiler):
     super().__init__(cpu.decode(), feats.decode())
 
 class LLVMDevice(Compiled):
-  def __init__(self, device:str): super().__init__(device, MallocAllocator, LLVMRenderer(), HostLLVMCompiler(), CPUProgram)
+  def __init__(self, device:str):
+    from tinygrad.runtime.graph.cpu import CPUGraph
+    super().__init__(device, MallocAllocator, LLVMRenderer(), HostLLVMCompiler(), CPUProgram, CPUGraph)
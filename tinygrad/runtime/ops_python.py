@@ -3,14 +3,16 @@
 # works to test the tensor cores, and all the uops in general
 # this is the (living) definition of uops
 from typing import Optional, Any, TYPE_CHECKING
-import pickle, base64, itertools, time, struct, sys
-from tinygrad.dtype import DType, dtypes, ImageDType, PtrDType, truncate
-from tinygrad.helpers import all_same, getenv, flatten, get_single_element
+import pickle, base64, itertools, time, struct, sys, math, importlib.util
+from tinygrad.dtype import DType, dtypes, ImageDType, PtrDType, truncate, _to_np_dtype
+from tinygrad.helpers import all_same, getenv, flatten, get_single_element, prod
 from tinygrad.device import Compiled, Compiler, Allocator
 from tinygrad.opt import tc
 from tinygrad.uop.ops import exec_alu, Ops, UOp, GroupOp
 from tinygrad.renderer import Renderer
 
+PYTHON_NUMPY = getenv("PYTHON_NUMPY", 1)
+
 def _load(m, i):
   if i is None: return 0.0
   if i < 0 or i >= len(m): raise IndexError(f"load out of bounds, size is {len(m)} and access is {i}")
@@ -24,11 +26,260 @@ def _store(m, i, v):
   if i < 0 or i >= len(m): raise IndexError(f"store out of bounds, size is {len(m)}, access is {i}, value is {v}")
   m[i] = v
 
+# an element of a thread is a value, or a numpy array with its value in every warp when the program is vectorized
+def _all_eq(a, b) -> bool: return bool((a == b).all()) if hasattr(a, "all") else a == b
+
+def wmma(inp:list, arg, warp_size:int) -> list:
+  # here are the models for the WMMA instruction on the different hardware
+  def wmma_helper(WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map):
+    for cc, tinp, num in zip(("A", "B", "C"), inp, (NUM_A, NUM_B, NUM_C)):
+      assert len(tinp) == num, f"{cc} must have {num} elements per thread, it has {len(tinp)}"
+      assert len(flatten(tinp)) == num * warp_size, f"WMMA must have {num * warp_size} total elements for {cc} in WMMA"
+    assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
+    out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
+    for goff in range(0, warp_size, WARP_THREADS):
+      for lane_id in range(WARP_THREADS):
+        for elem_idx in range(NUM_C): # calculate new muls and add to acc
+          (c_i, c_j) = c_map(lane_id, elem_idx)
+          out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
+    return out
+
+  # TODO: refactor these to a shared TensorCoreLayout in kernel.py
+  if arg[4] == "METAL":
+    # A (2 elements on 32 threads): row major
+    def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
+    # (i, j), C, D (2 elements on 32 threads): row major same as A/B
+    def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
+    return wmma_helper(32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map)
+  elif arg[4] == "AMD" and arg[5] == 64:
+    def a_elem(x, k, row, goff): return x[k%4][goff + (k//4)*16 + row]
+    def b_elem(x, col, k, goff): return a_elem(x, k, col, goff) # pylint: disable=arguments-out-of-order
+    def c_map(lane, elem): return (lane%16, (lane//16)*4 + elem)
+    return wmma_helper(64, 16, 4, 4, 4, a_elem, b_elem, c_map)
+  elif arg[4] == "AMD" and len(inp[0]) == 8: # RDNA4
+    def a_elem(x, k, row, goff): return x[k - [0, 4, 4, 8][k//4]][goff + row + [0, 16, 0, 16][k//4]]
+    def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)
+    def c_map(lane, elem): return (lane%16, (lane//16)*8 + elem)
+    return wmma_helper(32, 16, 8, 8, 8, a_elem, b_elem, c_map)
+  elif arg[4] == "AMD":
+    # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
+    def a_elem(x, k, row, goff):
+      assert _all_eq(x[k][goff+row], x[k][goff+row+16]), "warp elements not duplicated properly across lanes"
+      return x[k][goff+row]
+    # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
+    def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)  # pylint: disable=arguments-out-of-order
+    def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
+    return wmma_helper(32, 16, 16, 16, 8, a_elem, b_elem, c_map)
+  elif arg[4] == "CUDA":
+    # (col, row) given (lane, elem) for C & D (4 elements on 32 threads); shared by all tc shapes with M=16 N=8
+    def c_map(lane, elem): return (elem%2 + (lane%4)*2, lane//4 + (elem//2)*8)
+
+    if arg[1] == (8,16,16):
+      def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2 + (k//8)*4][goff + (k//2)%4 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k%2 + (k//8)*2][goff + (k//2)%4 + col*4]
+      return wmma_helper(32, 16, 8, 4, 4, a_elem, b_elem, c_map)
+
+    elif arg[1] == (8,16,8) and arg[2] == dtypes.half:
+      def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2][goff + k//2 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k%2][goff + k//2 + col*4]
+      return wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
+
+    elif arg[1] == (8,16,8) and arg[2] == dtypes.float:
+      def a_elem(x, k, row, goff): return x[(k//4)*2 + row//8][goff + k%4 + (row%8)*4]
+      def b_elem(x, col, k, goff): return x[k//4][goff + k%4 + col*4]
+      return wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
+
+    else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+  elif arg[4] == "INTEL":
+    # A (16 elements on 8 threads)
+    def a_elem(x, k, row, goff): return x[k%2+row*2][goff+k//2]
+    # B (16 elements on 8 threads)
+    def b_elem(x, col, k, goff): return x[k][goff+col]
+    # C, D (8 elements on 8 threads)
+    def c_map(lane, elem): return (lane, elem)
+    return wmma_helper(8, 16, 16, 16, 8, a_elem, b_elem, c_map)
+  elif arg[4] == "CPU":
+    def elem(x, col, row, _): return x[col+row][0] # k is always 0
+    def c_map(_, elem): return (elem%16, elem//16)
+    return wmma_helper(1, 1, 16, 16, 256, elem, elem, c_map)
+  else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+
+# *** vectorized with numpy: each uop runs once for the whole launch, the values are arrays with one element per thread ***
+
+def numpy_supported(uops:list[tuple[Ops, Optional[DType], list[int], Any]]) -> bool:
+  varying: set[int] = set()
+  for i,(uop,dtype,idp,arg) in enumerate(uops):
+    if isinstance(dtype, ImageDType) or (isinstance(dtype, DType) and (dtype.base if isinstance(dtype, PtrDType) else dtype).scalar() in no_numpy):
+      return False
+    if uop in GroupOp.ALU and dtype is not None and dtype.count > 1: return False
+    # a const isn't truncated, a python int outside of the dtype doesn't fit in the array
+    if uop is Ops.CONST and (isinstance(arg, tuple) or (dtypes.is_int(dtype) and not dtypes.min(dtype) <= arg <= dtypes.max(dtype))): return False
+    if uop in {Ops.SPECIAL, Ops.LOAD} or any(j in varying for j in idp): varying.add(i)
+    # all threads run the loop together, it has to end at the same place for all of them
+    if uop is Ops.RANGE and idp[0] in varying: return False
+  return True
+no_numpy = {dtypes.bfloat16, *dtypes.fp8s}
+
+def exec_numpy(uops:list[tuple[Ops, Optional[DType], list[int], Any]], bufs:tuple[memoryview, ...], global_size:tuple[int,int,int],
+               local_size:tuple[int,int,int], vals:tuple[int, ...]):
+  import numpy as np
+  # the threads are in the order of the scalar emulator, the warps of the first global index come first
+  warp_size, groups = prod(local_size), prod(global_size)
+  tid = np.arange(warp_size*groups, dtype=np.int64)
+  gid, lid = tid // warp_size, tid % warp_size
+  # floats are kept as float64 like the python floats of the scalar emulator, they are truncated where it truncates
+  def wide(dtype:DType): return np.bool_ if dtype == dtypes.bool else np.float64 if dtypes.is_float(dtype) else \
+    np.uint64 if dtype == dtypes.uint64 else np.int64
+  def trunc(x, dtype:DType):
+    if dtype == dtypes.bool: return x.astype(np.bool_)
+    if dtype not in truncate or dtype in (dtypes.float64, dtypes.int64, dtypes.uint64): return x.astype(wide(dtype), copy=False)
+    return x.astype(_to_np_dtype(dtype)).astype(wide(dtype))
+  def full(v, dtype:DType): return np.full(len(tid), v, dtype=wide(dtype))
+  def check(what:str, off, size:int, gate):
+    bad = (off < 0) | (off >= size)
+    if gate is not None: bad &= gate
+    if bad.any(): raise IndexError(f"{what} out of bounds, size is {size} and access is {off[bad.argmax()]}")
+
+  def alu(op:Ops, dtype:DType, inp:list):
+    if op is Ops.WHERE: return trunc(np.where(inp[0], inp[1], inp[2]), dtype)
+    x = [v.astype(np.int64) if v.dtype == np.bool_ else v for v in inp]
+    if len({v.dtype for v in x}) == 1 and (ret:=alu_fast(op, x[0].dtype == np.float64, x)) is not None: return trunc(ret, dtype)
+    # everything else is computed by the scalar emulator
+    return np.array(np.frompyfunc(lambda *p: exec_alu(op, dtype, p), len(inp), 1)(*[v.astype(object) for v in inp]), dtype=wide(dtype))
+  def alu_fast(op:Ops, is_float:bool, x:list):
+    if op is Ops.ADD: return x[0] + x[1]
+    if op is Ops.SUB: return x[0] - x[1]
+    if op is Ops.MUL: return x[0] * x[1]
+    if op is Ops.MULACC: return x[0] * x[1] + x[2]
+    if op is Ops.NEG: return -x[0]
+    # max(x, y) is x unless y is bigger, that's where the nans and the signed zeros go
+    if op is Ops.MAX: return np.where(x[1] > x[0], x[1], x[0])
+    if op is Ops.CMPLT: return x[0] < x[1]
+    if op is Ops.CMPNE: return x[0] != x[1]
+    if is_float:
+      if op is Ops.RECIP: return 1 / x[0]
+      if op is Ops.SQRT: return np.where(x[0] >= 0, np.sqrt(np.where(x[0] >= 0, x[0], 0)), math.nan)
+      return None
+    if op is Ops.XOR: return x[0] ^ x[1]
+    if op is Ops.OR: return x[0] | x[1]
+    if op is Ops.AND: return x[0] & x[1]
+    if op in {Ops.SHL, Ops.SHR}:
+      # a shift by the whole width or more is 0 (or -1), in numpy it's undefined
+      sh = np.minimum(x[1], 63).astype(x[0].dtype)
+      if op is Ops.SHL: return np.where(x[1] >= 64, 0, x[0] << sh).astype(x[0].dtype)
+      return np.where(x[1] >= 64, 0, x[0] >> sh).astype(x[0].dtype) if x[0].dtype == np.uint64 else x[0] >> sh
+    if op in {Ops.IDIV, Ops.MOD}:
+      # cdiv and cmod, rounding towards zero and 0 on division by 0
+      y = np.where(x[1] == 0, 1, x[1])
+      # the magnitudes are unsigned, abs of the smallest int64 doesn't fit in an int64
+      q = (np.abs(x[0]).astype(np.uint64) // np.abs(y).astype(np.uint64)).astype(x[0].dtype)
+      q = np.where(x[1] == 0, 0, np.where((x[0] < 0) != (y < 0), -q, q)).astype(x[0].dtype)
+      return q if op is Ops.IDIV else x[0] - q * x[1]
+    return None
+  def cast(x, src:DType, dtype:DType):
+    if dtype == dtypes.bool: return x != 0
+    if dtypes.is_float(dtype): return trunc(x.astype(np.float64), dtype)
+    # int() rounds towards zero, the truncate wraps it
+    if dtypes.is_float(src) and dtype == dtypes.uint64: return np.where(x < 0, x.astype(np.int64).astype(np.uint64), x.astype(np.uint64))
+    return trunc(x.astype(np.int64) if dtypes.is_float(src) else x, dtype)
+
+  ul: dict[int, Any] = {}
+  dl: dict[int, DType] = {}
+  pbufs: list[memoryview] = list(bufs)
+  pvals: list[int] = list(vals)
+  i = 0
+  loop_ends: dict[int, int] = {}
+  void_ops = {Ops.STORE, Ops.ENDRANGE, Ops.BARRIER, Ops.IF, Ops.ENDIF, Ops.SINK}
+  srcs = [[v for v in (idp[:1] if uop is Ops.DEFINE_REG else idp) if uops[v][0] not in void_ops] for uop,_,idp,_ in uops]
+  with np.errstate(all="ignore"):
+    while i < len(uops):
+      uop, dtype, idp, arg = uops[i]
+      inp, dtp = [ul[v] for v in srcs[i]], [dl[v] for v in srcs[i]]
+      if uop is Ops.STORE:
+        (mem, base, size, off, gate), dt = inp[0], dtp[1]
+        for j,val in enumerate(inp[1] if dt.count > 1 else [inp[1]]):
+          check("store", off+j, size, gate)
+          addr = base+off+j if gate is None else (base+off+j)[gate]
+          if gate is not None: val = val[gate]
+          # with more stores to the same address the last thread wins
+          addr, last = np.unique(addr[::-1], return_index=True)
+          mem[addr] = val[::-1][last]
+        i += 1
+        continue
+      if uop is Ops.ENDRANGE:
+        loop_ends[idp[0]] = i
+        i = idp[0]
+        continue
+      if uop in (Ops.BARRIER, Ops.IF, Ops.ENDIF, Ops.SINK):
+        i += 1
+        continue
+      assert dtype is not None, f"{uop} is missing a dtype"
+      dl[i] = dtype
+      if uop is Ops.DEFINE_GLOBAL:
+        assert isinstance(dtype, PtrDType)
+        buf, npdt = pbufs.pop(0), np.dtype(_to_np_dtype(dtype.base.scalar()))
+        ul[i] = (np.frombuffer(buf, npdt, count=buf.nbytes//npdt.itemsize), 0, buf.nbytes//npdt.itemsize)
+      elif uop is Ops.DEFINE_LOCAL:
+        assert isinstance(dtype, PtrDType)
+        # one local buffer for each warp
+        ul[i] = (np.zeros(dtype.size*groups, _to_np_dtype(dtype.base.scalar())), gid*dtype.size, dtype.size)
+      elif uop is Ops.DEFINE_VAR: ul[i] = full(pvals.pop(0), dtype)
+      elif uop is Ops.SPECIAL:
+        dim, sz = int(arg[0][-1]), global_size if arg[0][0] == 'g' else local_size
+        ul[i] = ((gid if arg[0][0] == 'g' else lid) // prod(sz[:dim])) % sz[dim]
+      elif uop is Ops.CONST: ul[i] = full(arg, dtype)
+      elif uop is Ops.DEFINE_REG:
+        ul[i] = [full(inp[0][0][0], dtype.scalar()) for _ in range(dtype.count)] if dtype.count > 1 else full(inp[0][0], dtype)
+      elif uop is Ops.INDEX: ul[i] = inp[0] + (inp[1].astype(np.int64), inp[2] if len(inp) == 3 else None)
+      elif uop is Ops.CAST and isinstance(dtype, PtrDType): ul[i] = inp[0]
+      elif uop is Ops.RANGE:
+        if i not in ul: ul[i] = full(0, dtype)
+        else:
+          ul[i] += 1
+          if ul[i][0] == inp[0][0]:
+            del ul[i]
+            i = loop_ends[i] + 1
+            continue
+      elif uop is Ops.VECTORIZE: ul[i] = inp
+      elif uop is Ops.BITCAST: ul[i] = inp[0].astype(_to_np_dtype(dtp[0])).view(_to_np_dtype(dtype)).astype(wide(dtype))
+      elif uop is Ops.CAST: ul[i] = cast(inp[0], dtp[0], dtype)
+      elif uop is Ops.LOAD:
+        (mem, base, size, off, gate) = inp[0]
+        def load(j:int, default):
+          if default is None:
+            check("load", off+j, size, None)
+            return mem[base+off+j].astype(wide(dtype))
+          check("load", off+j, size, gate)
+          if gate is None: return mem[base+off+j].astype(wide(dtype))
+          return np.where(gate, mem[np.where(gate, base+off+j, 0)], default).astype(wide(dtype)) if gate.any() else default.copy()
+        alt = inp[1] if len(inp) == 2 else None
+        ul[i] = [load(j, alt[j] if alt is not None and dtp[1].count > 1 else alt) for j in range(dtype.count)] if dtype.count > 1 else load(0, alt)
+      elif uop is Ops.ASSIGN:
+        if isinstance(inp[0], list):
+          for j in range(len(inp[0])): inp[0][j] = inp[1][j]
+        else: inp[0][:] = inp[1]
+        ul[i] = inp[0]
+      elif uop is Ops.GEP: ul[i] = inp[0][get_single_element(arg)]
+      elif uop is Ops.WMMA:
+        # the models work on the lanes of a warp, here a lane is an array over the warps
+        def lanes(x): return x.reshape(groups, warp_size).T
+        out = wmma([[lanes(x) for x in inp[0]], [lanes(x) for x in inp[1]], [lanes(x).copy() for x in inp[2]]], arg, warp_size)
+        ul[i] = [x.T.reshape(-1) for x in out]
+      elif uop in GroupOp.ALU:
+        assert all_same([dtype] + dtp) or uop in {Ops.CMPNE, Ops.CMPLT, Ops.WHERE}, f"dtype mismatch on {uop}"
+        ul[i] = alu(uop, dtype, inp)
+      assert i in ul, (uop, dtype, idp, arg)
+      i += 1
+
 class PythonProgram:
   def __init__(self, name:str, lib:bytes):
     self.uops: list[tuple[Ops, Optional[DType], list[int], Any]] = pickle.loads(lib)
+    self.vectorized = bool(PYTHON_NUMPY) and not getenv("TRACE") and importlib.util.find_spec("numpy") is not None and numpy_supported(self.uops)
   def __call__(self, *bufs, global_size:tuple[int,int,int]=(1,1,1), local_size:tuple[int,int,int]=(1,1,1), vals:tuple[int, ...]=(), wait=False):
     st = time.perf_counter()
+    if self.vectorized:
+      exec_numpy(self.uops, bufs, global_size, local_size, vals)
+      return time.perf_counter() - st
     warp = list(itertools.product(*[range(x) for x in local_size[::-1]]))
     warp_size = len(warp)
     for idxs in itertools.product(*[range(x) for x in global_size[::-1]]):
@@ -111,80 +362,7 @@ class PythonProgram:
           for j in range(len(inp[0])): inp[0][j] = inp[1][j]
           ul[i] = inp[0]
         elif uop is Ops.GEP: ul[i] = inp[0][get_single_element(arg)]
-        elif uop is Ops.WMMA:
-          # here are the models for the WMMA instruction on the different hardware
-          def wmma_helper(WARP_THREADS, K, NUM_A, NUM_B, NUM_C, a_elem, b_elem, c_map):
-            for cc, tinp, num in zip(("A", "B", "C"), inp, (NUM_A, NUM_B, NUM_C)):
-              assert len(tinp) == num, f"{cc} must have {num} elements per thread, it has {len(tinp)}"
-              assert len(flatten(tinp)) == num * warp_size, f"WMMA must have {num * warp_size} total elements for {cc} in WMMA"
-            assert warp_size > 0 and warp_size % WARP_THREADS == 0, f"must have multiples of {WARP_THREADS} warp threads"
-            out = [inp[2][elem_idx][:] for elem_idx in range(NUM_C)]
-            for goff in range(0, warp_size, WARP_THREADS):
-              for lane_id in range(WARP_THREADS):
-                for elem_idx in range(NUM_C): # calculate new muls and add to acc
-                  (c_i, c_j) = c_map(lane_id, elem_idx)
-                  out[elem_idx][goff+lane_id] += sum(a_elem(inp[0], _k, c_j, goff) * b_elem(inp[1], c_i, _k, goff) for _k in range(K))
-            return out
-
-          # TODO: refactor these to a shared TensorCoreLayout in kernel.py
-          if arg[4] == "METAL":
-            # A (2 elements on 32 threads): row major
-            def a_b_elem(x, i, j, goff): return x[(i%2)][goff+(i//2)%2+(j%4)*2+(i//4)*8+(j//4)*16]
-            # (i, j), C, D (2 elements on 32 threads): row major same as A/B
-            def c_map(lane, elem): return (elem + ((lane%2)*2) + ((lane//8)%2)*4, ((lane//2)%4) + (lane//16)*4)
-            ul[i] = wmma_helper(32, 8, 2, 2, 2, a_b_elem, a_b_elem, c_map)
-          elif arg[4] == "AMD" and arg[5] == 64:
-            def a_elem(x, k, row, goff): return x[k%4][goff + (k//4)*16 + row]
-            def b_elem(x, col, k, goff): return a_elem(x, k, col, goff) # pylint: disable=arguments-out-of-order
-            def c_map(lane, elem): return (lane%16, (lane//16)*4 + elem)
-            ul[i] = wmma_helper(64, 16, 4, 4, 4, a_elem, b_elem, c_map)
-          elif arg[4] == "AMD" and len(inp[0]) == 8: # RDNA4
-            def a_elem(x, k, row, goff): return x[k - [0, 4, 4, 8][k//4]][goff + row + [0, 16, 0, 16][k//4]]
-            def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)
-            def c_map(lane, elem): return (lane%16, (lane//16)*8 + elem)
-            ul[i] = wmma_helper(32, 16, 8, 8, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "AMD":
-            # A (16 elements on 32 threads): col major, lane 16-32 == lane 0-15
-            def a_elem(x, k, row, goff):
-              assert x[k][goff+row] == x[k][goff+row+16], "warp elements not duplicated properly across lanes"
-              return x[k][goff+row]
-            # B (16 elements on 32 threads): row major, lane 16-32 == lane 0-15
-            def b_elem(x, col, k, goff): return a_elem(x, k, col, goff)  # pylint: disable=arguments-out-of-order
-            def c_map(lane, elem): return (lane%16, lane//16+elem*2) # (i, j), C, D (8 elements on 32 threads): row major
-            ul[i] = wmma_helper(32, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CUDA":
-            # (col, row) given (lane, elem) for C & D (4 elements on 32 threads); shared by all tc shapes with M=16 N=8
-            def c_map(lane, elem): return (elem%2 + (lane%4)*2, lane//4 + (elem//2)*8)
-
-            if arg[1] == (8,16,16):
-              def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2 + (k//8)*4][goff + (k//2)%4 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k%2 + (k//8)*2][goff + (k//2)%4 + col*4]
-              ul[i] = wmma_helper(32, 16, 8, 4, 4, a_elem, b_elem, c_map)
-
-            elif arg[1] == (8,16,8) and arg[2] == dtypes.half:
-              def a_elem(x, k, row, goff): return x[k%2 + (row//8)*2][goff + k//2 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k%2][goff + k//2 + col*4]
-              ul[i] = wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
-
-            elif arg[1] == (8,16,8) and arg[2] == dtypes.float:
-              def a_elem(x, k, row, goff): return x[(k//4)*2 + row//8][goff + k%4 + (row%8)*4]
-              def b_elem(x, col, k, goff): return x[k//4][goff + k%4 + col*4]
-              ul[i] = wmma_helper(32, 8, 4, 2, 4, a_elem, b_elem, c_map)
-
-            else: raise NotImplementedError(f"unimplemented tensor core {arg}")
-          elif arg[4] == "INTEL":
-            # A (16 elements on 8 threads)
-            def a_elem(x, k, row, goff): return x[k%2+row*2][goff+k//2]
-            # B (16 elements on 8 threads)
-            def b_elem(x, col, k, goff): return x[k][goff+col]
-            # C, D (8 elements on 8 threads)
-            def c_map(lane, elem): return (lane, elem)
-            ul[i] = wmma_helper(8, 16, 16, 16, 8, a_elem, b_elem, c_map)
-          elif arg[4] == "CPU":
-            def elem(x, col, row, _): return x[col+row][0] # k is always 0
-            def c_map(_, elem): return (elem%16, elem//16)
-            ul[i] = wmma_helper(1, 1, 16, 16, 256, elem, elem, c_map)
-          else: raise NotImplementedError(f"unimplemented tensor core {arg}")
+        elif uop is Ops.WMMA: ul[i] = wmma(inp, arg, warp_size)
         elif uop in GroupOp.ALU:
           assert all_same([len(x) for x in inp]), f"{[len(x) for x in inp]} doesn't match on {uop}"
           assert all_same([dtype] + dtp) or uop in {Ops.CMPNE, Ops.CMPLT, Ops.WHERE}, f"dtype mismatch on {uop}"
@@ -3,12 +3,15 @@
 # with REMOTE tinygrad is  frontend <-> middleware <-> RemoteDevice ///HTTP/// remote_server <-> runtime <-> hardware
 # this client and server can be on the same machine, same network, or just same internet
 # it should be a secure (example: no use of pickle) boundary. HTTP is used for RPC
+# with REMOTE_STREAM=1 (the default) the HTTP connection is upgraded to a stream of frames, the client doesn't wait for a batch unless it needs
+# the result and the server runs the requests as they arrive
 
 from __future__ import annotations
 from typing import Callable, Iterator, Optional, Any, cast
 from collections import defaultdict
 from dataclasses import dataclass, field, replace
 import multiprocessing, threading, functools, itertools, asyncio, http, http.client, hashlib, time, os, binascii, struct, ast, contextlib, weakref
+import socket, queue, zlib
 from tinygrad.renderer import Renderer, ProgramSpec
 from tinygrad.dtype import DTYPES_DICT, dtypes
 from tinygrad.uop.ops import UOp, Ops, Variable, sint
@@ -60,6 +63,9 @@ class CopyIn(RemoteRequest): buffer_num: int; datahash: str # noqa: E702
 @dataclass(frozen=True)
 class CopyOut(RemoteRequest): buffer_num: int
 
+@dataclass(frozen=True)
+class HaveBlobs(RemoteRequest): datahashes: tuple[str, ...]
+
 @dataclass(frozen=True)
 class Transfer(RemoteRequest): buffer_num: int; dsession: SessionKey; dbuffer_num: int # noqa: E702
 
@@ -112,8 +118,8 @@ class GraphExec(RemoteRequest):
 
 # for safe deserialization
 eval_globals = {x.__name__:x for x in [SessionKey, SessionFree, RemoteProperties, GetProperties, Event, Wait, BufferAlloc, BufferOffset, BufferFree,
-                                       CopyIn, CopyOut, Transfer, BatchTransfer, ProgramAlloc, ProgramFree, ProgramExec, GraphComputeItem, GraphAlloc,
-                                       GraphFree, GraphExec, BufferSpec, UOp, Ops, dtypes]}
+                                       CopyIn, CopyOut, HaveBlobs, Transfer, BatchTransfer, ProgramAlloc, ProgramFree, ProgramExec, GraphComputeItem,
+                                       GraphAlloc, GraphFree, GraphExec, BufferSpec, UOp, Ops, dtypes]}
 attribute_whitelist: dict[Any, set[str]] = {dtypes: {*DTYPES_DICT.keys(), 'imagef', 'imageh'}, Ops: {x.name for x in Ops}}
 eval_fxns = {ast.Constant: lambda x: x.value, ast.Tuple: lambda x: tuple(map(safe_eval, x.elts)), ast.List: lambda x: list(map(safe_eval, x.elts)),
   ast.Dict: lambda x: {safe_eval(k):safe_eval(v) for k,v in zip(x.keys, x.values)},
@@ -124,25 +130,60 @@ def safe_getattr(value, attr):
   return getattr(value, attr)
 def safe_eval(node): return eval_fxns[node.__class__](node)
 
+# blobs are content addressed with their sha256. the server keeps the large ones for all its connections, so a blob it already has is only sent
+# once. NOTE: the hash is cryptographic, a client can't make up data with the hash of a blob another one sends
+def blob_hash(d:bytes|memoryview) -> bytes: return hashlib.sha256(d).digest()
+HASH_SIZE, DEDUP_MIN = 32, getenv("REMOTE_DEDUP_MIN", 1<<16)
+
+# a frame of the stream is a header (kind, length) and the payload. a blob is sent in chunks (hash, total length, offset, data), the requests
+# that use it come after it. a ZBLOB chunk is zlib compressed. the flags of the requests say if the client waits for the result and if the batch
+# (and its blobs) ends there
+FRAME_BLOB, FRAME_REQS, FRAME_ZBLOB = 0, 1, 2
+FLAG_REPLY, FLAG_END = 1, 2
+MAX_FRAME, MAX_BLOB = getenv("REMOTE_MAX_FRAME", 1<<28), getenv("REMOTE_MAX_BLOB", 1<<32)
+frame_hdr, chunk_hdr = struct.Struct("<BQ"), struct.Struct(f"<{HASH_SIZE}sQQ")
+
 class BatchRequest:
   def __init__(self):
     self._q: list[RemoteRequest] = []
     self._h: dict[str, bytes] = {}
+    self.nbytes = 0
   def h(self, d:bytes|memoryview) -> str:
-    datahash = hashlib.sha256(d).hexdigest() # NOTE: this is very slow, should use blake3 on gpu instead
+    datahash = blob_hash(d).hex()
     if datahash not in self._h:
-      self._h[datahash] = bytes.fromhex(datahash)+struct.pack("<Q", len(d))+bytes(d)
+      self._h[datahash] = bytes(d)
+      self.nbytes += len(d)
     return datahash
   def q(self, x:RemoteRequest): self._q.append(x)
   def serialize(self) -> bytes:
     self.h(repr(self._q).encode())
-    return b''.join(self._h.values())
+    return b''.join(bytes.fromhex(k)+struct.pack("<Q", len(v))+v for k,v in self._h.items())
+  def frames(self, reply:bool, chunk_size:int, compress:bool=False) -> Iterator[bytes|memoryview]:
+    # the requests before a blob are sent before it, the server runs them while the blob is on the way
+    sent: set[str] = set()
+    def reqs(q:list[RemoteRequest], flags:int) -> Iterator[bytes]:
+      yield frame_hdr.pack(FRAME_REQS, 1+len(dat:=repr(q).encode())) + bytes([flags]) + dat
+    start = 0
+    for i,x in enumerate(self._q):
+      if (datahash:=getattr(x, "datahash", None)) not in self._h or datahash in sent: continue
+      if start != i: yield from reqs(self._q[start:i], 0)
+      sent.add(datahash)
+      data, zblob = memoryview(self._h[datahash]), compress
+      for off in range(0, max(len(data), 1), chunk_size):
+        kind, dat = FRAME_BLOB, data[off:off+chunk_size]
+        # a blob that doesn't compress in its first chunk is sent as is
+        if zblob and len(zdat:=zlib.compress(dat, 1)) < len(dat) * 0.9: kind, dat = FRAME_ZBLOB, memoryview(zdat)
+        elif off == 0: zblob = False
+        yield frame_hdr.pack(kind, chunk_hdr.size+len(dat)) + chunk_hdr.pack(bytes.fromhex(datahash), len(data), off)
+        yield dat
+      start = i
+    yield from reqs(self._q[start:], FLAG_END | (FLAG_REPLY if reply else 0))
   def deserialize(self, dat:bytes) -> BatchRequest:
     ptr = 0
     while ptr < len(dat):
-      datahash, datalen = binascii.hexlify(dat[ptr:ptr+0x20]).decode(), struct.unpack("<Q", dat[ptr+0x20:ptr+0x28])[0]
-      self._h[datahash] = dat[ptr+0x28:ptr+0x28+datalen]
-      ptr += 0x28+datalen
+      datahash, datalen = binascii.hexlify(dat[ptr:ptr+HASH_SIZE]).decode(), struct.unpack("<Q", dat[ptr+HASH_SIZE:ptr+HASH_SIZE+8])[0]
+      self._h[datahash] = dat[ptr+HASH_SIZE+8:ptr+HASH_SIZE+8+datalen]
+      ptr += HASH_SIZE+8+datalen
     self._q = safe_eval(ast.parse(self._h[datahash], mode="eval").body)
     return self
 
@@ -151,118 +192,213 @@ class BatchRequest:
 @dataclass
 class RemoteSession:
   programs: dict[tuple[str, str], Any] = field(default_factory=dict)
+  program_refs: defaultdict[tuple[str, str], int] = field(default_factory=functools.partial(defaultdict, int))
   graphs: dict[int, GraphRunner] = field(default_factory=dict)
   buffers: dict[int, Buffer] = field(default_factory=dict)
   events: defaultdict[int, asyncio.Event] = field(default_factory=functools.partial(defaultdict, asyncio.Event))
 
+class BlobCache:
+  # the large blobs outlive their batch, session and connection, in LRU order. a blob is only kept if it has its hash, the blob a client sends
+  # under the hash of other data isn't served to the others
+  size = getenv("REMOTE_BLOB_CACHE", 1<<30)
+
+  def __init__(self):
+    self.blobs: dict[str, bytes] = {}
+    self.nbytes = 0
+
+  def add(self, datahash:str, blob:bytes):
+    if len(blob) < DEDUP_MIN or len(blob) > self.size or datahash in self.blobs or blob_hash(blob).hex() != datahash: return
+    self.blobs[datahash] = blob
+    self.nbytes += len(blob)
+    while self.nbytes > self.size: self.nbytes -= len(self.blobs.pop(next(iter(self.blobs))))
+
+  def get(self, datahash:str) -> bytes|None:
+    if (ret:=self.blobs.pop(datahash, None)) is not None: self.blobs[datahash] = ret
+    return ret
+
+class ConnectionBlobs:
+  # the ones a HaveBlobs said the server has are kept for the connection until its next HaveBlobs, the batch that uses them can't lose them to
+  # eviction by the others
+  def __init__(self, cache:BlobCache):
+    self.cache = cache
+    self.pinned: dict[str, bytes] = {}
+
+  def have(self, datahashes:tuple[str, ...]) -> bytes:
+    self.pinned = {h:b for h in datahashes if (b:=self.cache.get(h)) is not None}
+    return bytes(h in self.pinned for h in datahashes)
+
+  def get(self, req:BatchRequest, datahash:str) -> bytes:
+    if (ret:=req._h.get(datahash)) is not None: self.cache.add(datahash, ret)
+    elif (ret:=self.cache.get(datahash)) is None and (ret:=self.pinned.get(datahash)) is None: raise RuntimeError(f"blob {datahash} wasn't sent")
+    return ret
+
 class RemoteHandler:
   def __init__(self, base_device: str):
     self.base_device = base_device
     self.sessions: defaultdict[SessionKey, RemoteSession] = defaultdict(RemoteSession)
+    self.blobs = BlobCache()
 
   async def __call__(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    blobs = ConnectionBlobs(self.blobs)
     while (req_hdr:=(await reader.readline()).decode().strip()):
       req_method, req_path, _ = req_hdr.split(' ')
       req_headers = {}
       while (hdr:=(await reader.readline()).decode().strip()):
         key, value = hdr.split(':', 1)
         req_headers[key.lower()] = value.strip()
+      if req_path == "/stream" and req_method == "POST":
+        writer.write(f"HTTP/1.1 {http.HTTPStatus.SWITCHING_PROTOCOLS.value} {http.HTTPStatus.SWITCHING_PROTOCOLS.phrase}\r\n\r\n".encode())
+        return await self.stream(reader, writer, blobs)
       req_body = await reader.readexactly(int(req_headers.get("content-length", "0")))
-      res_status, res_body = await self.handle(req_method, req_path, req_body)
+      res_status, res_body = await self.handle(req_method, req_path, req_body, blobs)
       writer.write(f"HTTP/1.1 {res_status.value} {res_status.phrase}\r\nContent-Length: {len(res_body)}\r\n\r\n".encode() + res_body)
 
-  async def handle(self, method:str, path:str, body:bytes) -> tuple[http.HTTPStatus, bytes]:
-    status, ret = http.HTTPStatus.OK, b""
-    if path == "/batch" and method == "POST":
-      # TODO: streaming deserialize?
-      req = BatchRequest().deserialize(body)
-      # the cmds are always last (currently in datahash)
-      for c in req._q:
-        if DEBUG >= 1: print(c)
-        session, dev = self.sessions[unwrap(c.session)], Device[f"{self.base_device}:{unwrap(c.session).idx}"]
-        match c:
-          case SessionFree(): del self.sessions[unwrap(c.session)]
-          case GetProperties():
-            cls, args = dev.renderer.__reduce__()
-            graph_cls = graph_class(Device[self.base_device])
-            rp = RemoteProperties(
-              real_device=dev.device, renderer=(cls.__module__, cls.__name__, args), offset_supported=hasattr(dev.allocator, '_offset'),
-              graph_supported=graph_cls is not None, graph_supports_multi=graph_cls is not None and issubclass(graph_cls, MultiGraphRunner),
-            )
-            ret = repr(rp).encode()
-          case Event():
-            if c.session == c.event_session:
-              session.events[c.event].set()
-            else:
-              for d in Device._opened_devices: Device[d].synchronize() # wait for device*s* to finish executing previous stuff
-              # TODO: don't wait, just send
-              await RemoteConnection(c.event_session.host).aq(Event(c.event_session, c.event, session=c.event_session), wait=True)
-          case Wait():
-            assert await session.events[c.event].wait()
-            del session.events[c.event] # do not leak memory
-          case BufferAlloc():
-            assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already allocated"
-            session.buffers[c.buffer_num] = Buffer(dev.device, c.size, dtypes.uint8, options=c.options, preallocate=True)
-          case BufferOffset():
-            assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already exists"
-            session.buffers[c.buffer_num] = session.buffers[c.sbuffer_num].view(c.size, dtypes.uint8, c.offset).allocate()
-          case BufferFree(): del session.buffers[c.buffer_num]
-          case CopyIn(): session.buffers[c.buffer_num].copyin(memoryview(bytearray(req._h[c.datahash])))
-          case CopyOut(): session.buffers[c.buffer_num].copyout(memoryview(ret:=bytearray(session.buffers[c.buffer_num].nbytes)))
-          case Transfer():
-            if c.dsession.host == unwrap(c.session).host:
-              dsession, ddev = self.sessions[c.dsession], Device[f"{self.base_device}:{unwrap(c.dsession).idx}"]
-              dbuf, sbuf = dsession.buffers[c.dbuffer_num], session.buffers[c.buffer_num]
-              if hasattr(ddev.allocator, '_transfer'):
-                assert dbuf.nbytes == sbuf.nbytes, f"{dbuf.nbytes} != {sbuf.nbytes}"
-                ddev.allocator._transfer(dbuf._buf, sbuf._buf, dbuf.nbytes, dest_dev=ddev, src_dev=dev)
-              else:
-                sbuf.copyout(data:=memoryview(bytearray(sbuf.nbytes)))
-                dbuf.copyin(data)
+  async def stream(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter, blobs:ConnectionBlobs):
+    # the reader decodes the frames while the requests before them run
+    batches: asyncio.Queue[tuple[BatchRequest, int]|None] = asyncio.Queue(maxsize=getenv("REMOTE_STREAM_DEPTH", 64))
+    async def read_frames():
+      req = BatchRequest()
+      try:
+        while True:
+          kind, sz = frame_hdr.unpack(await reader.readexactly(frame_hdr.size))
+          if sz > MAX_FRAME: raise ValueError(f"frame of {sz} bytes is larger than REMOTE_MAX_FRAME")
+          if kind in (FRAME_BLOB, FRAME_ZBLOB):
+            datahash, total, off = chunk_hdr.unpack(await reader.readexactly(chunk_hdr.size))
+            dat = await reader.readexactly(sz-chunk_hdr.size)
+            if total > MAX_BLOB: raise ValueError(f"blob of {total} bytes is larger than REMOTE_MAX_BLOB")
+            # a chunk can't write past the end of its blob, compressed or not
+            if kind == FRAME_ZBLOB:
+              # max_length 0 is no limit
+              dat = (d:=zlib.decompressobj()).decompress(dat, max(total-off, 1))
+              if d.unconsumed_tail or not d.eof: raise ValueError(f"compressed chunk at {off} is larger than its blob of {total} bytes")
+            if len(blob:=cast(bytearray, req._h.setdefault(datahash.hex(), bytearray(total)))) != total or off+len(dat) > total:
+              raise ValueError(f"chunk at {off} of {len(dat)} bytes doesn't fit in a blob of {len(blob)} bytes")
+            blob[off:off+len(dat)] = dat
+          else:
+            flags, dat = (await reader.readexactly(1))[0], await reader.readexactly(sz-1)
+            req._q = safe_eval(ast.parse(dat, mode="eval").body)
+            await batches.put((req, flags))
+            # the blobs of a batch stay until its end
+            nreq = BatchRequest()
+            if not flags & FLAG_END: nreq._h = req._h
+            req = nreq
+      except asyncio.IncompleteReadError: pass
+      except ValueError as e:
+        if DEBUG >= 1: print(f"closing the stream: {e}")
+      finally: await batches.put(None)
+    reader_task = asyncio.create_task(read_frames())
+    try:
+      while (item:=await batches.get()) is not None:
+        ret = await self.run(item[0], blobs)
+        if item[1] & FLAG_REPLY:
+          writer.write(struct.pack("<Q", len(ret)) + ret)
+          await writer.drain()
+    finally:
+      reader_task.cancel()
+      writer.close()
+
+  async def handle(self, method:str, path:str, body:bytes, blobs:ConnectionBlobs) -> tuple[http.HTTPStatus, bytes]:
+    if path == "/batch" and method == "POST": return http.HTTPStatus.OK, await self.run(BatchRequest().deserialize(body), blobs)
+    return http.HTTPStatus.NOT_FOUND, b"Not Found"
+
+  async def run(self, req:BatchRequest, blobs:ConnectionBlobs) -> bytes:
+    ret = b""
+    for c in req._q:
+      if DEBUG >= 1: print(c)
+      if isinstance(c, HaveBlobs):
+        # the client only sends the blobs the server doesn't have
+        ret = blobs.have(c.datahashes)
+        continue
+      session, dev = self.sessions[unwrap(c.session)], Device[f"{self.base_device}:{unwrap(c.session).idx}"]
+      match c:
+        case SessionFree(): del self.sessions[unwrap(c.session)]
+        case GetProperties():
+          cls, args = dev.renderer.__reduce__()
+          graph_cls = graph_class(Device[self.base_device])
+          rp = RemoteProperties(
+            real_device=dev.device, renderer=(cls.__module__, cls.__name__, args), offset_supported=hasattr(dev.allocator, '_offset'),
+            graph_supported=graph_cls is not None, graph_supports_multi=graph_cls is not None and issubclass(graph_cls, MultiGraphRunner),
+          )
+          ret = repr(rp).encode()
+        case Event():
+          if c.session == c.event_session:
+            session.events[c.event].set()
+          else:
+            for d in Device._opened_devices: Device[d].synchronize() # wait for device*s* to finish executing previous stuff
+            # TODO: don't wait, just send
+            await RemoteConnection(c.event_session.host).aq(Event(c.event_session, c.event, session=c.event_session), wait=True)
+        case Wait():
+          assert await session.events[c.event].wait()
+          del session.events[c.event] # do not leak memory
+        case BufferAlloc():
+          assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already allocated"
+          session.buffers[c.buffer_num] = Buffer(dev.device, c.size, dtypes.uint8, options=c.options, preallocate=True)
+        case BufferOffset():
+          assert c.buffer_num not in session.buffers, f"buffer {c.buffer_num} already exists"
+          session.buffers[c.buffer_num] = session.buffers[c.sbuffer_num].view(c.size, dtypes.uint8, c.offset).allocate()
+        case BufferFree(): del session.buffers[c.buffer_num]
+        case CopyIn(): session.buffers[c.buffer_num].copyin(memoryview(bytearray(blobs.get(req, c.datahash))))
+        case CopyOut(): session.buffers[c.buffer_num].copyout(memoryview(ret:=bytearray(session.buffers[c.buffer_num].nbytes)))
+        case Transfer():
+          if c.dsession.host == unwrap(c.session).host:
+            dsession, ddev = self.sessions[c.dsession], Device[f"{self.base_device}:{unwrap(c.dsession).idx}"]
+            dbuf, sbuf = dsession.buffers[c.dbuffer_num], session.buffers[c.buffer_num]
+            if hasattr(ddev.allocator, '_transfer'):
+              assert dbuf.nbytes == sbuf.nbytes, f"{dbuf.nbytes} != {sbuf.nbytes}"
+              ddev.allocator._transfer(dbuf._buf, sbuf._buf, dbuf.nbytes, dest_dev=ddev, src_dev=dev)
             else:
-              conn = RemoteConnection(c.dsession.host)
-              sbuf = session.buffers[c.buffer_num]
               sbuf.copyout(data:=memoryview(bytearray(sbuf.nbytes)))
-              conn.q(CopyIn(c.dbuffer_num, conn.req.h(data), session=c.dsession), wait=True)
-          case BatchTransfer():
-            conn = RemoteConnection(c.dbuffer_nums[0][0].host)
-            for (sbuf_session,sbuf_num),(dbuf_session,dbuf_num) in zip(c.sbuffer_nums, c.dbuffer_nums):
-              sbuf = self.sessions[sbuf_session].buffers[sbuf_num]
-              sbuf.copyout(data:=memoryview(bytearray(sbuf.nbytes)))
-              await conn.aq(CopyIn(dbuf_num, conn.req.h(data), session=dbuf_session), wait=True)
-          case ProgramAlloc():
-            lib = dev.compiler.compile_cached(req._h[c.datahash].decode())
+              dbuf.copyin(data)
+          else:
+            conn = RemoteConnection(c.dsession.host)
+            sbuf = session.buffers[c.buffer_num]
+            sbuf.copyout(data:=memoryview(bytearray(sbuf.nbytes)))
+            conn.q(CopyIn(c.dbuffer_num, conn.req.h(data), session=c.dsession), wait=True)
+        case BatchTransfer():
+          conn = RemoteConnection(c.dbuffer_nums[0][0].host)
+          for (sbuf_session,sbuf_num),(dbuf_session,dbuf_num) in zip(c.sbuffer_nums, c.dbuffer_nums):
+            sbuf = self.sessions[sbuf_session].buffers[sbuf_num]
+            sbuf.copyout(data:=memoryview(bytearray(sbuf.nbytes)))
+            await conn.aq(CopyIn(dbuf_num, conn.req.h(data), session=dbuf_session), wait=True)
+        case ProgramAlloc():
+          # the same program can be loaded more than once (like by a CapturedJit from the diskcache), it's freed with its last RemoteProgram
+          if (c.name, c.datahash) not in session.programs:
+            lib = dev.compiler.compile_cached(blobs.get(req, c.datahash).decode())
             session.programs[(c.name, c.datahash)] = dev.runtime(c.name, lib)
-          case ProgramFree(): del session.programs[(c.name, c.datahash)]
-          case ProgramExec():
-            bufs = [session.buffers[x]._buf for x in c.bufs]
-            extra_args = {k:v for k,v in [("global_size", c.global_size), ("local_size", c.local_size)] if v is not None}
-            r = session.programs[(c.name, c.datahash)](*bufs, vals=c.vals, wait=c.wait, **extra_args)
-            if r is not None: ret = str(r).encode()
-          case GraphAlloc():
-            graph_fn: Callable = unwrap(dev.graph)
-            def _parse_ji(gi: GraphComputeItem|Transfer):
-              match gi:
-                case GraphComputeItem():
-                  prg = self.sessions[gi.session].programs[(gi.name, gi.datahash)]
-                  ps = ProgramSpec(gi.name, '', f"{self.base_device}:{gi.session.idx}", UOp(Ops.NOOP),
-                                   vars=list(gi.vars), ins=list(gi.ins), outs=list(gi.outs),
-                                   global_size=list(cast(tuple[int], gi.global_size)) if gi.global_size is not None else None,
-                                   local_size=list(cast(tuple[int], gi.local_size)) if gi.local_size is not None else None)
-                  return ExecItem(CompiledRunner(ps, precompiled=b'', prg=prg), [self.sessions[gi.session].buffers[buf] for buf in gi.bufs],
-                                  fixedvars=gi.fixedvars)
-                case Transfer():
-                  dbuf, sbuf = self.sessions[gi.dsession].buffers[gi.dbuffer_num], self.sessions[unwrap(gi.session)].buffers[gi.buffer_num]
-                  assert dbuf.nbytes == sbuf.nbytes, f"{dbuf.nbytes} != {sbuf.nbytes}"
-                  return ExecItem(BufferXfer(dbuf.nbytes, dbuf.device, sbuf.device), [dbuf, sbuf])
-            assert c.graph_num not in session.graphs, f"graph {c.graph_num} already allocated"
-            session.graphs[c.graph_num] = graph_fn(list(map(_parse_ji, c.jit_cache)), [self.sessions[s].buffers[i] for s,i in c.bufs], c.var_vals)
-          case GraphFree(): del session.graphs[c.graph_num]
-          case GraphExec():
-            r = session.graphs[c.graph_num]([self.sessions[s].buffers[i] for s,i in c.bufs], c.var_vals, wait=c.wait)
-            if r is not None: ret = str(r).encode()
-    else: status, ret = http.HTTPStatus.NOT_FOUND, b"Not Found"
-    return status, ret
+          session.program_refs[(c.name, c.datahash)] += 1
+        case ProgramFree():
+          if (refs:=session.program_refs.pop((c.name, c.datahash))) > 1: session.program_refs[(c.name, c.datahash)] = refs - 1
+          else: del session.programs[(c.name, c.datahash)]
+        case ProgramExec():
+          bufs = [session.buffers[x]._buf for x in c.bufs]
+          extra_args = {k:v for k,v in [("global_size", c.global_size), ("local_size", c.local_size)] if v is not None}
+          r = session.programs[(c.name, c.datahash)](*bufs, vals=c.vals, wait=c.wait, **extra_args)
+          if r is not None: ret = str(r).encode()
+        case GraphAlloc():
+          graph_fn: Callable = unwrap(dev.graph)
+          def _parse_ji(gi: GraphComputeItem|Transfer):
+            match gi:
+              case GraphComputeItem():
+                prg = self.sessions[gi.session].programs[(gi.name, gi.datahash)]
+                ps = ProgramSpec(gi.name, '', f"{self.base_device}:{gi.session.idx}", UOp(Ops.NOOP),
+                                 vars=list(gi.vars), ins=list(gi.ins), outs=list(gi.outs),
+                                 global_size=list(cast(tuple[int], gi.global_size)) if gi.global_size is not None else None,
+                                 local_size=list(cast(tuple[int], gi.local_size)) if gi.local_size is not None else None)
+                return ExecItem(CompiledRunner(ps, precompiled=b'', prg=prg), [self.sessions[gi.session].buffers[buf] for buf in gi.bufs],
+                                fixedvars=gi.fixedvars)
+              case Transfer():
+                dbuf, sbuf = self.sessions[gi.dsession].buffers[gi.dbuffer_num], self.sessions[unwrap(gi.session)].buffers[gi.buffer_num]
+                assert dbuf.nbytes == sbuf.nbytes, f"{dbuf.nbytes} != {sbuf.nbytes}"
+                return ExecItem(BufferXfer(dbuf.nbytes, dbuf.device, sbuf.device), [dbuf, sbuf])
+          assert c.graph_num not in session.graphs, f"graph {c.graph_num} already allocated"
+          session.graphs[c.graph_num] = graph_fn(list(map(_parse_ji, c.jit_cache)), [self.sessions[s].buffers[i] for s,i in c.bufs], c.var_vals)
+        case GraphFree(): del session.graphs[c.graph_num]
+        case GraphExec():
+          r = session.graphs[c.graph_num]([self.sessions[s].buffers[i] for s,i in c.bufs], c.var_vals, wait=c.wait)
+          if r is not None: ret = str(r).encode()
+      # let the frames after this one be read
+      await asyncio.sleep(0)
+    return ret
 
 def remote_server(port:int):
   device = getenv("REMOTEDEV", next(Device.get_available_devices()) if Device.DEFAULT == "REMOTE" else Device.DEFAULT)
@@ -322,40 +458,119 @@ class RemoteProgram:
 class RemoteConnection:
   q_lock = threading.Lock()
   all: dict[RemoteConnection, None] = {} # dict instead of set for deterministic ordering
+  chunk_size, flush_size, compress = getenv("REMOTE_CHUNK", 1<<20), getenv("REMOTE_FLUSH", 16<<20), bool(getenv("REMOTE_COMPRESS", 0))
 
   def __init__(self, host:str):
     if DEBUG >= 1: print(f"remote with host {host}")
+    self.stream = bool(getenv("REMOTE_STREAM", 1))
     while 1:
       try:
-        self.conn = http.client.HTTPConnection(host, timeout=getenv("REMOTE_TIMEOUT", 300.0))
-        self.conn.connect()
+        if self.stream: self.sock = self._connect_stream(host)
+        else:
+          self.conn = http.client.HTTPConnection(host, timeout=getenv("REMOTE_TIMEOUT", 300.0))
+          self.conn.connect()
         break
       except Exception as e:
         print(e)
         time.sleep(0.1)
+    if self.stream:
+      # the sender thread writes the frames of the flushed batches while the client keeps queueing
+      self.send_q: queue.Queue[Iterator[bytes|memoryview]] = queue.Queue()
+      self.send_err: Exception|None = None
+      threading.Thread(target=self._sender, daemon=True).start()
     self.req: BatchRequest = BatchRequest()
+    self.sent_bytes = 0
     RemoteConnection.all[self] = None
 
+  @staticmethod
+  def _connect_stream(host:str) -> socket.socket:
+    hostname, port = host.rsplit(":", 1) if ":" in host else (host, "80")
+    sock = socket.create_connection((hostname, int(port)), timeout=getenv("REMOTE_TIMEOUT", 300.0))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(b"POST /stream HTTP/1.1\r\n\r\n")
+    resp = b""
+    while not resp.endswith(b"\r\n\r\n"):
+      if not (dat:=sock.recv(1)): raise ConnectionError("connection closed while upgrading to a stream")
+      resp += dat
+    if int(resp.split(b" ")[1]) != http.HTTPStatus.SWITCHING_PROTOCOLS: raise ConnectionError(f"POST /stream failed: {resp!r}")
+    return sock
+
+  def _sender(self):
+    try:
+      while True:
+        buf: list[bytes|memoryview] = []
+        for frame in self.send_q.get():
+          buf.append(frame)
+          if len(frame) >= self.chunk_size or len(buf) >= 64:
+            self.sock.sendall(dat:=b''.join(buf))
+            self.sent_bytes += len(dat)
+            buf.clear()
+        self.sock.sendall(dat:=b''.join(buf))
+        self.sent_bytes += len(dat)
+        self.send_q.task_done()
+    except Exception as e: self.send_err = e
+
+  def _recv_exact(self, sz:int) -> bytes:
+    ret = bytearray()
+    while len(ret) < sz:
+      if not (dat:=self.sock.recv(sz-len(ret))): raise ConnectionError(f"connection closed: {self.send_err}")
+      ret += dat
+    return bytes(ret)
+
+  def _submit(self, req:BatchRequest, reply:bool) -> bytes|None:
+    if self.stream:
+      if self.send_err is not None: raise ConnectionError(f"send failed: {self.send_err}")
+      self.send_q.put(req.frames(reply, self.chunk_size, self.compress))
+      return self._recv_exact(struct.unpack("<Q", self._recv_exact(8))[0]) if reply else None
+    self.conn.request("POST", "/batch", data:=req.serialize())
+    self.sent_bytes += len(data)
+    response = self.conn.getresponse()
+    assert response.status == 200, f"POST /batch failed: {response}"
+    return response.read()
+
+  def dedup(self):
+    # the server is asked which of the large blobs it already has, those aren't sent again
+    if not (hashes:=tuple(k for k,v in self.req._h.items() if len(v) >= DEDUP_MIN)): return
+    (have:=BatchRequest()).q(HaveBlobs(hashes))
+    for datahash,has in zip(hashes, unwrap(self._submit(have, reply=True))):
+      if has: self.req.nbytes -= len(self.req._h.pop(datahash))
+
+  def flush(self, reply:bool=False) -> bytes|None:
+    # without a reply the batch is on its way, the client doesn't wait for it
+    self.dedup()
+    req, self.req = self.req, BatchRequest()
+    return self._submit(req, reply)
+
   def q(self, x:RemoteRequest, wait:bool=False):
     with RemoteConnection.q_lock:
       self.req.q(x)
       if wait: return self.batch_submit(take_q=False)
+      if self.stream and self.req.nbytes >= self.flush_size: self.flush()
 
   async def aq(self, x:RemoteRequest, wait:bool=False): return await asyncio.to_thread(self.q, x, wait=wait)
 
   def batch_submit(self, take_q:bool=True):
     if take_q: RemoteConnection.q_lock.acquire()
     conns = RemoteConnection.all.keys()
-    datas = {conn: conn.req.serialize() for conn in conns}
-    reqs, hashes, hash_datas = sum(len(c.req._q) for c in conns), sum(len(c.req._h) for c in conns), sum(len(data) for data in datas.values())
+    reqs, hashes, hash_datas = sum(len(c.req._q) for c in conns), sum(len(c.req._h) for c in conns), sum(c.req.nbytes for c in conns)
     with Timing(f"*** send {reqs:-3d} requests {hashes:-3d} hashes with len {hash_datas/1024:.2f} kB in ", enabled=DEBUG>=3):
-      for conn,data in datas.items(): conn.conn.request("POST", "/batch", data)
-      for conn in datas.keys():
-        response = conn.conn.getresponse()
-        assert response.status == 200, f"POST /batch failed: {response}"
-        resp = response.read()
-        if conn == self: ret = resp
-        conn.req = BatchRequest()
+      if self.stream:
+        # only the reply of this connection is waited on, the batches of the others stay in flight
+        for conn in conns:
+          if conn is not self and conn.req._q: conn.flush()
+        ret = self.flush(reply=True)
+      else:
+        for conn in conns: conn.dedup()
+        datas = {conn: conn.req.serialize() for conn in conns}
+        for conn,data in datas.items():
+          conn.conn.request("POST", "/batch", data)
+          conn.sent_bytes += len(data)
+        for conn in datas.keys():
+          response = conn.conn.getresponse()
+          assert response.status == 200, f"POST /batch failed: {response}"
+          resp = response.read()
+          if conn == self: ret = resp
+          conn.req = BatchRequest()
     if take_q: RemoteConnection.q_lock.release()
     return ret
 
@@ -1,10 +1,68 @@
 from __future__ import annotations
 import functools, operator, itertools
 from dataclasses import dataclass
-from typing import Optional, cast, Sequence
+from typing import Optional, Callable, Generic, Protocol, Hashable, TypeVar, cast, Sequence
 from tinygrad.dtype import dtypes
 from tinygrad.uop.ops import resolve, UOp, Variable, sint, sym_infer, smax, smin, sint_to_uop, Ops, ssimplify
-from tinygrad.helpers import prod, all_int, argsort, flatten, ceildiv
+from tinygrad.helpers import prod, all_int, argsort, flatten, ceildiv, ContextVar, DEBUG, T
+
+T_co = TypeVar("T_co", covariant=True)
+
+# the caches of the shape functions keep their Views and UOps alive, so they're bounded. an entry is in the current or the old generation, a hit
+# in the old one copies it to the current one. at the end of a schedule a cache with more than SHAPE_CACHE entries drops its old generation and
+# the current one becomes old, so the entries used since the last drop survive. a server that sees new shapes stays flat
+SHAPE_CACHE = ContextVar("SHAPE_CACHE", 1<<13)
+class _Miss(Exception): pass
+class CachedFunction(Protocol[T_co]):
+  def __call__(self, *args:Hashable, **kwargs:Hashable) -> T_co: ...
+  def cache_info(self) -> tuple[int, int, int|None, int]: ...
+
+class ShapeCache(Generic[T]):
+  # a generation is a functools.cache, a miss in the current one looks in the old one and a miss in the old one raises _Miss
+  def __init__(self, fxn:Callable[..., T]):
+    self.fxn, self.calls, self.misses, self.promoted, self.evicted = fxn, 0, 0, 0, 0
+    self.cur, self.old = self._generation(), self._generation()
+  def _generation(self) -> CachedFunction[T]:
+    def miss(*args, **kwargs) -> T:
+      if gen is not self.cur: raise _Miss
+      try:
+        ret = self.old(*args, **kwargs)
+        self.promoted += 1
+      except _Miss:
+        ret = self.fxn(*args, **kwargs)
+        self.misses += 1
+      return ret
+    gen: CachedFunction[T] = functools.cache(miss)
+    return gen
+  def sizes(self) -> tuple[int, int]:
+    # the entries in the old generation and not in the current one, and the entries in the current one
+    return self.old.cache_info()[3] - self.promoted, self.cur.cache_info()[3]
+  def stats(self) -> tuple[int, int, int, int]:
+    hits, misses, _, _ = self.cur.cache_info()
+    return self.calls+hits+misses-self.misses, self.misses, sum(self.sizes()), self.evicted
+  def generation(self, name:str):
+    if sum((sizes:=self.sizes())) <= SHAPE_CACHE.value: return
+    if DEBUG >= 2: print(f"shape cache {name}: dropped {sizes[0]} entries, kept {sizes[1]}")
+    hits, misses, _, _ = self.cur.cache_info()
+    self.calls, self.evicted, self.promoted = self.calls+hits+misses, self.evicted+sizes[0], 0
+    self.old, self.cur = self.cur, self._generation()
+
+shape_caches: dict[str, ShapeCache] = {}
+def shape_cache(fxn:Callable[..., T]) -> Callable[..., T]:
+  shape_caches[fxn.__qualname__] = c = ShapeCache(fxn)
+  @functools.wraps(fxn)
+  def wrapper(*args, **kwargs) -> T:
+    try: return c.cur(*args, **kwargs)
+    # the generation turned old while another thread was in it
+    except _Miss: return fxn(*args, **kwargs)
+  return wrapper
+
+def shape_cache_generation():
+  for name,c in shape_caches.items(): c.generation(name)
+
+def shape_cache_stats() -> dict[str, tuple[int, int, int, int]]:
+  # hits, misses, entries and evicted entries of each cache
+  return {name:c.stats() for name,c in shape_caches.items()}
 
 # returns the axes to create new_shape if new_shape can be created by combining axis from old_shape
 def get_contraction(old_shape:tuple[sint, ...], new_shape:tuple[sint, ...]) -> list[list[int]]|None:
@@ -31,17 +89,17 @@ def get_contraction_with_reduce(old_shape:tuple[sint, ...], new_shape:tuple[sint
         contraction[j] = contraction[j][-1:]
   return contraction
 
-@functools.cache
+@shape_cache
 def canonicalize_strides(shape:tuple[sint, ...], strides:tuple[sint, ...]) -> tuple[sint, ...]:
   return tuple(0 if s == 1 else st for s, st in zip(shape, strides))
 
-@functools.cache
+@shape_cache
 def strides_for_shape(shape:tuple[sint, ...]) -> tuple[sint, ...]:
   if not shape: return ()
   strides = tuple(itertools.accumulate(reversed(shape[1:]), operator.mul, initial=1))[::-1]
   return canonicalize_strides(shape, strides)
 
-@functools.cache
+@shape_cache
 def merge_dims(shape:tuple[int, ...], strides:tuple[int, ...], mask:Optional[tuple[tuple[int, int], ...]]=None) -> tuple[tuple[int, int, int], ...]:
   # merge contiguous sub-parts or zero strided dims
   # any stride 0, masked from dim=1, or contiguous part is merged into next dim.
@@ -63,7 +121,7 @@ def merge_dims(shape:tuple[int, ...], strides:tuple[int, ...], mask:Optional[tup
     merging = (mask[i][1] - mask[i][0] == 1) if mask is not None else s == 1
   return tuple(ret)
 
-@functools.cache
+@shape_cache
 def _reshape_mask(_mask:Optional[tuple[tuple[sint, sint], ...]], old_shape:tuple[sint, ...], new_shape:tuple[sint, ...]) \
   -> Optional[tuple[tuple[sint, sint], ...]]:
   """Returns the new mask if reshape is possible, and None if not possible."""
@@ -123,14 +181,14 @@ class View:
         if resolve(m[1] != sh): vexpr = vexpr * (idx < m[1])
     return iexpr, vexpr
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def size(self) -> int:
     ret = prod([x.vmax if isinstance(x, UOp) else x for x in self.shape])
     assert isinstance(ret, int), f"{ret=} is not int"
     return ret
 
   @staticmethod
-  @functools.cache
+  @shape_cache
   def create(shape:tuple[sint, ...], strides:Optional[tuple[sint, ...]]=None, offset:sint=0, mask:Optional[tuple[tuple[sint, sint], ...]]=None):
     # TODO: resolve shouldn't be needed here
     if not all(resolve(s >= 0) for s in shape): raise ValueError(f"Trying to create View with negative dimension: {shape=}")
@@ -157,12 +215,12 @@ class View:
     contiguous = offset == 0 and mask is None and strides == strides_for_shape(shape)
     return View(shape, strides, offset, mask, contiguous)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def vars(self) -> set[Variable]:
     flatten_mask = tuple(x for m in self.mask for x in m) if self.mask is not None else tuple()
     return functools.reduce(operator.or_, [x.vars() for x in self.shape+self.strides+(self.offset,)+flatten_mask if isinstance(x, UOp)], set())
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def unbind(self) -> tuple[View, dict[Variable, int]]:
     var_unboundvar_val = [(v, v.unbind()) for v in self.vars() if v.op is Ops.BIND]
     unbound_vars = {v:uv for v,(uv,_) in var_unboundvar_val}
@@ -176,7 +234,7 @@ class View:
     new_mask = tuple((_substitute(x[0]), _substitute(x[1])) for x in self.mask) if self.mask is not None else None
     return View.create(new_shape, new_strides, new_offset, new_mask)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def __add__(self, vm1:View) -> Optional[View]:
     vm2 = self
     if vm2.contiguous or vm1.size() == 0: return vm1
@@ -243,14 +301,14 @@ class View:
 
     return View.create(vm1.shape, tuple(strides), ssimplify(sum(o * s for o, s in zip(origin, vm2.strides)) + vm2.offset))
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def invert(self, out_shape:tuple[sint, ...]) -> Optional[View]:
     ret = View.create(self.shape)
     if self.mask: ret = ret.shrink(self.mask)
     ret = ret.flip(tuple(x < 0 for x in self.strides)).permute(argsort(tuple(-x if x > 0 else x for x in self.strides)))
     return ret if prod(ret.shape) == prod(out_shape) else None   # don't support shrink, expand, or stride != (-1, 1)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def minify(self):
     min_shape = tuple(x[0] for x in merge_dims(self.shape, self.strides, self.mask))
     return nv if (nv := self.reshape(min_shape)) else self
@@ -264,7 +322,7 @@ class View:
       mask = tuple([(smax(mx1, mx2), smin(my1, my2)) for (mx1, my1), (mx2, my2) in zip(nmask, mask)]) if mask is not None else nmask
     return View.create(tuple([y-x for x,y in arg]), self.strides, self.offset+offset, mask)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def pad(self, arg: tuple[tuple[sint, sint], ...]) -> View:
     assert len(arg) == len(self.shape), f"invalid pad {arg} for {self.shape}"
     # NOTE: not checking for symbolic arg
@@ -275,14 +333,14 @@ class View:
       return self.__unsafe_resize(zvarg, mask=mask)
     return self
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def shrink(self, arg: tuple[tuple[sint, sint], ...]) -> View:
     assert len(arg) == len(self.shape), f"invalid shrink {arg} for {self.shape}"
     # NOTE: not checking for symbolic arg
     for s,(b,e) in zip(self.shape,arg): assert not all_int([s,b,e]) or (0<=b<=e<=s), f"invalid shrink {arg} for {self.shape}"
     return self.__unsafe_resize(arg)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def expand(self, new_shape: tuple[sint, ...]) -> View:
     if len(new_shape) != len(self.shape): raise ValueError(f"expand arg {new_shape=} must have same number of dimensions as shape {self.shape=}")
     # NOTE: does not check multiple of symbolic shape
@@ -293,19 +351,19 @@ class View:
                   for m,s,ns in zip(self.mask, self.shape, new_shape)]) if self.mask else None
     return View.create(new_shape, self.strides, self.offset, mask)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def permute(self, axis: tuple[int, ...]) -> View:
     assert sorted(axis) == list(range(len(self.shape))), f"invalid permutation {axis} of len {len(self.shape)}"
     return View.create(tuple(self.shape[a] for a in axis), tuple(self.strides[a] for a in axis), self.offset,
                        tuple(self.mask[a] for a in axis) if self.mask is not None else None)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def flip(self, arg: tuple[bool, ...]) -> View:
     offset = sum((s-1)*z for s,z,f in zip(self.shape, self.strides, arg) if f)
     mask = tuple((s-my,s-mx) if f else (mx,my) for (mx,my),s,f in zip(self.mask, self.shape, arg)) if self.mask is not None else None
     return View.create(self.shape, tuple(-z if f else z for z,f in zip(self.strides, arg)), self.offset+offset, mask)
 
-  @functools.cache  # pylint: disable=method-cache-max-size-none
+  @shape_cache
   def reshape(self, new_shape: tuple[sint, ...]) -> Optional[View]:
     if self.shape == new_shape: return self
 
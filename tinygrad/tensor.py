@@ -6,14 +6,15 @@ from typing import Callable, ClassVar, Sequence, cast, get_args, Literal, Suppor
 from tinygrad.dtype import DType, DTypeLike, dtypes, ImageDType, ConstType, least_upper_float, least_upper_dtype, sum_acc_dtype, to_dtype, truncate
 from tinygrad.dtype import _from_np_dtype, _to_np_dtype
 from tinygrad.helpers import argfix, make_tuple, flatten, prod, all_int, round_up, merge_dicts, argsort, getenv, all_same, fully_flatten, dedup
-from tinygrad.helpers import IMAGE, WINO, Metadata, TRACEMETA, ceildiv, fetch, polyN, unwrap, DEBUG, is_numpy_ndarray
+from tinygrad.helpers import IMAGE, WINO, Metadata, TRACEMETA, ceildiv, fetch, polyN, unwrap, DEBUG, is_numpy_ndarray, SCHEDULE_CACHE, GlobalCounters
 from tinygrad.gradient import compute_gradient
 from tinygrad.uop.ops import smax, smin, resolve, UOp, Ops, sint, Variable, MathTrait, identity_element, all_metadata
 from tinygrad.uop.spec import tensor_uop_spec, type_verify
 from tinygrad.device import Device, Buffer
-from tinygrad.engine.realize import run_schedule
+from tinygrad.engine.realize import run_schedule, capturing
 from tinygrad.engine.memory import memory_planner
-from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars
+from tinygrad.engine.schedule import ScheduleItem, create_schedule_with_vars, schedule_cache_key, schedule_cache_get, schedule_cache_add
+from tinygrad.shape.view import shape_cache_generation
 from tinygrad.kernelize.kernelize import get_kernelize_map
 
 # *** all in scope Tensors are here. this gets relevant UOps ***
@@ -44,6 +45,15 @@ def _apply_map_to_tensors(applied_map:dict[UOp, UOp], name:str|None=None) -> Non
       if s is ns: continue
       t.uop = ns
 
+# the body of Tensor.kernelize, the schedule cache stores the map it applied
+def _kernelize(big_sink:UOp) -> dict[UOp, UOp]:
+  # verify Tensors match the spec
+  if __debug__: type_verify(list(big_sink.toposort()), tensor_uop_spec)
+
+  becomes_map = get_kernelize_map(big_sink)
+  _apply_map_to_tensors(becomes_map, name="Apply Kernelize Map")
+  return becomes_map
+
 # **** Tensor helper functions ****
 
 # this tracks the tensor.py METADATA
@@ -229,13 +239,7 @@ class Tensor(MathTrait):
 
     NOTE: Kernelize can be called multiple times on a Tensor
     """
-    big_sink = UOp.sink(*[x.uop for x in (self,)+lst])
-
-    # verify Tensors match the spec
-    if __debug__: type_verify(list(big_sink.toposort()), tensor_uop_spec)
-
-    becomes_map = get_kernelize_map(big_sink)
-    _apply_map_to_tensors(becomes_map, name="Apply Kernelize Map")
+    _kernelize(UOp.sink(*[x.uop for x in (self,)+lst]))
     return self
 
   def schedule_with_vars(self, *lst:Tensor) -> tuple[list[ScheduleItem], dict[Variable, int]]:
@@ -245,7 +249,17 @@ class Tensor(MathTrait):
     NOTE: A Tensor can only be scheduled once.
     """
     st = time.perf_counter()
-    self.kernelize(*lst)
+    big_sink = UOp.sink(*[x.uop for x in (self,)+lst])
+    # NOTE: the jit plans the buffers of what it captures and replays it, the cache is skipped while capturing
+    if (cache_key:=schedule_cache_key(big_sink) if SCHEDULE_CACHE and not capturing else None) is not None and \
+       (hit:=schedule_cache_get(*cache_key)) is not None:
+      becomes_map, schedule, var_vals, miss_tm = hit
+      _apply_map_to_tensors(becomes_map, name="Apply Schedule Cache")
+      GlobalCounters.schedule_hits += 1
+      GlobalCounters.schedule_saved_s += miss_tm - (time.perf_counter()-st)
+      return schedule, var_vals
+
+    becomes_map = _kernelize(big_sink)
     sink = UOp.sink(*[x.uop for x in (self,)+lst])
 
     # remove all ASSIGNs, after scheduling, the tensors are just buffers
@@ -255,7 +269,13 @@ class Tensor(MathTrait):
     # create the schedule
     schedule, var_vals = create_schedule_with_vars(sink)
     schedule = memory_planner(schedule)
+    shape_cache_generation()
     if DEBUG >= 1 and len(schedule) >= 10: print(f"scheduled {len(schedule)} kernels in {(time.perf_counter()-st)*1000:.2f} ms")
+    if cache_key is not None:
+      GlobalCounters.schedule_misses += 1
+      becomes_map = {k:v for k,v in becomes_map.items() if k is not v}
+      if becomes_map: becomes_map = dict(zip(becomes_map, UOp.sink(*becomes_map.values()).substitute(remove_assign_map).src))
+      schedule_cache_add(*cache_key, becomes_map, schedule, var_vals, time.perf_counter()-st)
     return schedule, var_vals
 
   def schedule(self, *lst:Tensor) -> list[ScheduleItem]:
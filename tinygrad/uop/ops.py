@@ -712,7 +712,7 @@ def upat_interpret(p:UPat, fxn:Callable) -> Callable:
   return universal_match
 
 class PatternMatcher:
-  def __init__(self, patterns:Sequence[tuple[UPat, Callable|tuple]], compiled=bool(getenv("UPAT_COMPILE", 1))):
+  def __init__(self, patterns:Sequence[tuple[UPat, Callable|tuple]], compiled:int=getenv("UPAT_COMPILE", 1)):
     if compiled: from tinygrad.uop.upat import upat_compile
     # if this comes from a pickle, we reconstruct the lambda functions here
     self.patterns:list[tuple[UPat, Callable]] = [(p,types.FunctionType(*fxn) if isinstance(fxn, tuple) else fxn) for p,fxn in patterns]
@@ -724,12 +724,19 @@ class PatternMatcher:
       if compiled and (match:=upat_compile(p, fxn)) is not None: pass # pylint: disable=E0606
       else: match = upat_interpret(p, fxn)
       for uop in p.op: self.pdict.setdefault(uop, []).append((p, match, p.early_reject))
+    # UPAT_COMPILE=2 matches in C, the extension is built on the first rewrite
+    if compiled >= 2 and not isinstance(self, TrackedPatternMatcher): self.rewrite = self._rewrite_c  # type: ignore[method-assign]
 
   def __reduce__(self): return PatternMatcher, ([(x,deconstruct_function(fxn) if fxn.__name__ == "<lambda>" else fxn) for x,fxn in self.patterns],)
 
   @functools.cache  # pylint: disable=method-cache-max-size-none
   def __add__(self, more:PatternMatcher): return PatternMatcher(self.patterns+more.patterns)
 
+  def _rewrite_c(self, uop:UOp, ctx=None) -> UOp|None:
+    from tinygrad.uop.upat import pm_compile_c
+    self.rewrite = pm_compile_c(self)  # type: ignore[method-assign]
+    return self.rewrite(uop, ctx)
+
   def rewrite(self, uop:UOp, ctx=None) -> UOp|None:
     ler = {u.op for u in uop.src}
     for _,match,early_reject in self.pdict.get(uop.op, []):
@@ -1,7 +1,7 @@
-from typing import Any, Callable
-import itertools, inspect, functools, types
-from tinygrad.helpers import partition, dedup, Context
-from tinygrad.uop.ops import UPat, UPatAny, UOp, Ops, PatternMatcher, graph_rewrite, deconstruct_function
+from typing import Any, Callable, cast
+import itertools, inspect, functools, types, hashlib, os, subprocess, sysconfig, importlib.util
+from tinygrad.helpers import partition, dedup, flatten, unwrap, getenv, Context, OSX, cache_dir
+from tinygrad.uop.ops import UPat, UPatAny, UOp, Ops, PatternMatcher, graph_rewrite, deconstruct_function, printable
 
 class UPatCompileError(Exception): pass
 
@@ -161,3 +161,176 @@ def upat_compile(self:UPat, fxn) -> Callable|None:
   namespace: dict = {}
   exec(code_str, globs, namespace)  # pylint: disable=W0122
   return namespace["compiled_match"]
+
+# **** PatternMatcher compiled to C ****
+
+# with UPAT_COMPILE=2 the dispatch of a PatternMatcher is a C extension built with clang: a chain on the op of the UOp, then for each UPat the
+# checks of the op, len, names, dtype and arg of the UOp and its srcs, with permutations and UPat.any as alternatives. only the rewrite
+# functions run in python, a UPat that can't be compiled (names in a repeated src) uses its python match
+
+class UPatCCompileError(Exception): pass
+
+C_PRELUDE = """#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <structmember.h>
+static Py_ssize_t off_op, off_dtype, off_src, off_arg;
+static PyObject *s_scalar;
+#define C(i) PyTuple_GET_ITEM(consts, i)
+#define SLOT(u, off) (*(PyObject **)((char *)(u) + (off)))
+#define OP(u) SLOT(u, off_op)
+#define DT(u) SLOT(u, off_dtype)
+#define ARG(u) SLOT(u, off_arg)
+#define NSRC(u) PyTuple_GET_SIZE(SLOT(u, off_src))
+#define SRC(u, i) PyTuple_GET_ITEM(SLOT(u, off_src), i)
+// uop.dtype in dtypes or uop.dtype._scalar in dtypes
+static int dtype_in(PyObject *dt, PyObject *dtypes) {
+  Py_ssize_t i, n = PyTuple_GET_SIZE(dtypes);
+  for (i = 0; i < n; i++) if (PyTuple_GET_ITEM(dtypes, i) == dt) return 1;
+  PyObject *s = PyObject_GetAttr(dt, s_scalar);
+  if (s == NULL) { PyErr_Clear(); return 0; }
+  Py_DECREF(s);
+  for (i = 0; i < n; i++) if (PyTuple_GET_ITEM(dtypes, i) == s) return 1;
+  return 0;
+}
+// uop.arg == arg, without the identity shortcut of PyObject_RichCompareBool (nan)
+static int arg_eq(PyObject *a, PyObject *b) {
+  PyObject *r = PyObject_RichCompare(a, b, Py_EQ);
+  if (r == NULL) return -1;
+  int ret = PyObject_IsTrue(r);
+  Py_DECREF(r);
+  return ret;
+}
+// early_reject.issubset({u.op for u in uop.src})
+static int has_ops(PyObject *uop, PyObject *ops) {
+  Py_ssize_t i, j, n = PyTuple_GET_SIZE(ops), ns = NSRC(uop);
+  for (i = 0; i < n; i++) {
+    for (j = 0; j < ns && OP(SRC(uop, j)) != PyTuple_GET_ITEM(ops, i); j++);
+    if (j == ns) return 0;
+  }
+  return 1;
+}
+"""
+
+C_FOOTER = """static PyMethodDef rewrite_def = {"rewrite", (PyCFunction)(void(*)(void))rewrite, METH_FASTCALL|METH_KEYWORDS, NULL};
+static PyObject *make(PyObject *self, PyObject *args) {
+  PyObject *consts, *uop_type, *d;
+  const char *names[4] = {"op", "dtype", "src", "arg"};
+  Py_ssize_t *offs[4] = {&off_op, &off_dtype, &off_src, &off_arg};
+  if (!PyArg_ParseTuple(args, "O!O", &PyTuple_Type, &consts, &uop_type)) return NULL;
+  // the UOp fields are slots, read at their offsets
+  for (int i = 0; i < 4; i++) {
+    if ((d = PyObject_GetAttrString(uop_type, names[i])) == NULL) return NULL;
+    if (!Py_IS_TYPE(d, &PyMemberDescr_Type)) { Py_DECREF(d); PyErr_SetString(PyExc_TypeError, "UOp fields must be slots"); return NULL; }
+    *offs[i] = ((PyMemberDescrObject *)d)->d_member->offset;
+    Py_DECREF(d);
+  }
+  if (s_scalar == NULL && (s_scalar = PyUnicode_InternFromString("_scalar")) == NULL) return NULL;
+  return PyCFunction_New(&rewrite_def, consts);
+}
+static PyMethodDef methods[] = {{"make", make, METH_VARARGS, NULL}, {NULL, NULL, 0, NULL}};
+static struct PyModuleDef module = {PyModuleDef_HEAD_INIT, "%s", NULL, -1, methods};
+PyMODINIT_FUNC PyInit_%s(void) { return PyModule_Create(&module); }
+"""
+
+def _upat_names(p:UPat) -> set[str]:
+  ret = {p.name} if p.name is not None else set()
+  for alt in (p.src or []): ret |= set().union(*[_upat_names(s) for s in ((next(alt),) if isinstance(alt, itertools.repeat) else alt)])
+  return ret
+
+class _CMatcher:
+  def __init__(self):
+    self.consts: list[Any] = []
+    self.cnt = 0
+  def const(self, x:Any) -> str:
+    self.consts.append(x)
+    return f"C({len(self.consts)-1})"
+  def var(self, prefix:str) -> str:
+    self.cnt += 1
+    return f"{prefix}{self.cnt}"
+
+  def match(self, p:UPat, u:str, names:tuple[str, ...], cont:Callable[[tuple[str, ...]], list[str]], top=False) -> list[str]:
+    if isinstance(p, UPatAny): return flatten([self.match(alt, u, names, cont) for alt in p.src[0]])
+    # the first UPat with a name stores it, the others are the same UOp
+    bind = p.name is not None and (m:=f"m_{p.name}") not in names
+    conds: list[str] = []
+    if p.op is not None and not top: conds.append("(" + " || ".join(f"OP({u}) == {self.const(op)}" for op in p.op) + ")")
+    if p.strict_length or p.required_len > 0: conds.append(f"NSRC({u}) {'==' if p.strict_length else '>='} {p.required_len}")
+    if p.name is not None and not bind: conds.append(f"{u} == m_{p.name}")
+    if p.dtype is not None: conds.append(f"dtype_in(DT({u}), {self.const(tuple(p.dtype))})")
+    inner = ([f"PyObject *const {m} = {u};"] if bind else []) + self.match_src(p, u, names+((m,) if bind else ()), cont)
+    if p.arg is not None:
+      c = self.var("c")
+      inner = [f"int {c} = arg_eq(ARG({u}), {self.const(p.arg)});", f"if ({c} < 0) goto fail;",
+               f"if ({c}) {{"] + ["  "+x for x in inner] + ["}"]
+    return [f"if ({' && '.join(conds) if conds else '1'}) {{"] + ["  "+x for x in inner] + ["}"]
+
+  def match_src(self, p:UPat, u:str, names:tuple[str, ...], cont:Callable[[tuple[str, ...]], list[str]]) -> list[str]:
+    if p.src is None: return cont(names)
+    if isinstance(p.src[0], itertools.repeat):
+      if _upat_names(rp:=next(p.src[0])): raise UPatCCompileError("names in a repeated src")
+      i, ok, s = self.var("i"), self.var("ok"), self.var("u")
+      return [f"Py_ssize_t {i};", f"for ({i} = 0; {i} < NSRC({u}); {i}++) {{", f"  PyObject *const {s} = SRC({u}, {i});", f"  int {ok} = 0;"] + \
+        ["  "+x for x in self.match(rp, s, names, lambda _: [f"{ok} = 1;"])] + [f"  if (!{ok}) break;", "}", f"if ({i} == NSRC({u})) {{"] + \
+        ["  "+x for x in cont(names)] + ["}"]
+    ret: list[str] = []
+    for alt in p.src:
+      def chain(j:int, names:tuple[str, ...], alt=alt) -> list[str]:
+        if j == len(alt): return cont(names)
+        s = self.var("u")
+        return ["{", f"  PyObject *const {s} = SRC({u}, {j});"] + ["  "+x for x in self.match(alt[j], s, names, lambda n: chain(j+1, n))] + ["}"]
+      ret += chain(0, names)
+    return ret
+
+  def pattern(self, p:UPat, fxn:Callable, match:Callable, early_reject:set[Ops]) -> list[str]:
+    nxt = self.var("next")
+    real_fxn = types.FunctionType(*deconstruct_function(fxn))
+    has_ctx = 'ctx' in inspect.signature(real_fxn).parameters
+    # (ret:=fxn(**match)) is not None, and the rewrite is done if ret is not uop
+    def call(names:tuple[str, ...]) -> list[str]:
+      args, r = names + (("ctx",) if has_ctx else ()), self.var("r")
+      kwnames = self.const(tuple(x[2:] for x in names) + (("ctx",) if has_ctx else ())) if args else "NULL"
+      return [f"PyObject *{r}_args[] = {{{', '.join(('NULL',)+args)}}};",
+              f"PyObject *{r} = PyObject_Vectorcall({self.const(real_fxn)}, {r}_args+1, PY_VECTORCALL_ARGUMENTS_OFFSET, {kwnames});",
+              f"if ({r} == NULL) goto fail;", f"if ({r} != Py_None) {{ if ({r} != uop) return {r}; Py_DECREF({r}); goto {nxt}; }}",
+              f"Py_DECREF({r});"]
+    cnt, consts = self.cnt, len(self.consts)
+    try:
+      body = self.match(p, "uop", (), lambda names: ["{"] + ["  "+x for x in call(names)] + ["}"], top=True)
+      if len(body) > 20000: raise UPatCCompileError("too big to compile")
+    except UPatCCompileError:
+      self.cnt, self.consts = cnt, self.consts[:consts]
+      r = self.var("r")
+      body = [f"PyObject *{r} = PyObject_CallFunctionObjArgs({self.const(match)}, uop, ctx, NULL);", f"if ({r} == NULL) goto fail;",
+              f"if ({r} != Py_None && {r} != uop) return {r};", f"Py_DECREF({r});"]
+    if early_reject: body = [f"if (has_ops(uop, {self.const(tuple(early_reject))})) {{"] + ["  "+x for x in body] + ["}"]
+    # a backslash at the end of a comment continues it on the next line
+    return [f"// {printable(p.location).replace(chr(92), '')}"] + body + [f"{nxt}:;"]
+
+  def render(self, pm:PatternMatcher) -> str:
+    fxns: dict[Ops, list[Callable]] = {}
+    for p,fxn in pm.patterns:
+      for op in unwrap(p.op): fxns.setdefault(op, []).append(fxn)
+    lines = ["static PyObject *rewrite(PyObject *consts, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames) {",
+      "  Py_ssize_t nkw = kwnames == NULL ? 0 : PyTuple_GET_SIZE(kwnames);",
+      "  if (nargs < 1 || nargs+nkw > 2 || (nkw == 1 && PyUnicode_CompareWithASCIIString(PyTuple_GET_ITEM(kwnames, 0), \"ctx\") != 0)) {",
+      "    PyErr_SetString(PyExc_TypeError, \"rewrite(uop, ctx=None)\");", "    return NULL;", "  }",
+      "  PyObject *uop = args[0], *ctx = nargs+nkw == 2 ? args[1] : Py_None, *op = OP(uop);"]
+    for i,(op,lst) in enumerate(pm.pdict.items()):
+      lines.append(f"  {'else ' if i else ''}if (op == {self.const(op)}) {{")
+      for (p,match,early_reject),fxn in zip(lst, fxns[op]): lines += ["    "+x for x in self.pattern(p, fxn, match, early_reject)]
+      lines.append("  }")
+    lines += ["  Py_RETURN_NONE;", "fail:", "  return NULL;", "}"]
+    return C_PRELUDE + "\n".join(lines) + "\n"
+
+def pm_compile_c(pm:PatternMatcher) -> Callable:
+  src = (cm:=_CMatcher()).render(pm)
+  name = f"upat_{hashlib.sha256(src.encode()).hexdigest()[:16]}"
+  # the extension is built once for each source, the consts of the PatternMatcher are passed to make
+  if not os.path.exists(fn:=os.path.join(cache_dir, "upat", name+cast(str, sysconfig.get_config_var("EXT_SUFFIX")))):
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    subprocess.check_output([getenv("CC", "clang"), "-shared", "-fPIC", "-O1", "-w", "-x", "c", f"-I{sysconfig.get_paths()['include']}", "-",
+                             "-o", tmp:=f"{fn}.{os.getpid()}.tmp"] + (["-undefined", "dynamic_lookup"] if OSX else []),
+                            input=(src + C_FOOTER % (name, name)).encode())
+    os.replace(tmp, fn)
+  spec = unwrap(importlib.util.spec_from_file_location(name, fn))
+  return importlib.util.module_from_spec(spec).make(tuple(cm.consts), UOp)